@@ -0,0 +1,145 @@
+import logging
+import os
+import time
+from datetime import datetime
+
+import ffmpeg
+
+import config
+import encoder
+
+# Output container and Gemini MIME type per audio codec
+AUDIO_FORMATS = {
+    "aac": {"extension": ".m4a", "mime_type": "audio/mp4", "codec": "aac"},
+    "opus": {"extension": ".webm", "mime_type": "audio/webm", "codec": "libopus"},
+    "mp3": {"extension": ".mp3", "mime_type": "audio/mpeg", "codec": "libmp3lame"},
+}
+# Speech stays intelligible down to here, below it we fall back to the video path
+MIN_SPEECH_BITRATE = 16000
+
+
+def should_use_audio_path(info, mode=None):
+    """
+    Decide whether to summarize from the audio track instead of the video.
+    :param info: output of encoder.probe_media.
+    :param mode: "auto" takes the audio path when there are no moving pictures
+        (audio files, or video that is really a cover image); "always" forces it
+        for anything with audio, e.g. for podcast or talking-head folders;
+        "never" disables it. Defaults to config.AUDIO_FIRST_MODE.
+        Only models in config.AUDIO_INPUT_MODELS take audio.
+    """
+    mode = config.AUDIO_FIRST_MODE if mode is None else mode
+    if mode == "never" or not info["has_audio"]:
+        return False
+    if mode == "always" or not info["has_video"]:
+        return True
+    # fps is 0 when the container doesn't report a frame rate, which says
+    # nothing about whether the pictures move
+    return 0 < info["fps"] <= config.AUDIO_FIRST_MAX_FPS
+
+
+def audio_plan(info, size_upper_bound, codec=None):
+    """
+    Pick the cheapest way to get the audio track under a size bound.
+    The source track is stream copied when its codec is one Gemini accepts and
+    its bitrate is already no higher than the target; otherwise it is
+    transcoded to mono speech quality.
+    :param info: output of encoder.probe_media.
+    :param size_upper_bound: Max output size in KB.
+    :return: dict with codec, bitrate, copy, extension and mime_type, or None
+    """
+    codec = config.AUDIO_FIRST_CODEC if codec is None else codec
+    budget_bitrate = (
+        size_upper_bound * 1024 * 8 * config.ENCODER_SIZE_MARGIN / info["duration"]
+    ) / (1 + encoder.MUXING_OVERHEAD)
+    bitrate = min(config.AUDIO_FIRST_BITRATE, budget_bitrate)
+    if bitrate < MIN_SPEECH_BITRATE:
+        return None
+
+    source_codec = info["audio_codec"]
+    if source_codec in AUDIO_FORMATS and info["audio_bitrate"] <= bitrate:
+        return dict(
+            AUDIO_FORMATS[source_codec], copy=True, bitrate=info["audio_bitrate"]
+        )
+    return dict(AUDIO_FORMATS[codec], copy=False, bitrate=bitrate)
+
+
+def extract_audio(source, output_base, plan):
+    """
+    Write the audio track of source according to a plan from audio_plan.
+    :return: path of the audio file
+    """
+    output = output_base + plan["extension"]
+    audio = ffmpeg.input(source).audio
+    if plan["copy"]:
+        args = {"c:a": "copy"}
+    else:
+        args = {"c:a": plan["codec"], "b:a": int(plan["bitrate"]), "ac": 1}
+    if plan["extension"] == ".m4a":
+        args["movflags"] = "+faststart"
+    ffmpeg.output(audio, output, **args).overwrite_output().run(quiet=True)
+    return output
+
+
+def sample_frames(source, info, output_base, count=None):
+    """
+    Grab count evenly spaced stills as small JPEGs.
+    :return: list of JPEG paths, empty when the source has no video
+    """
+    count = config.AUDIO_FIRST_FRAMES if count is None else count
+    if not info["has_video"] or count <= 0:
+        return []
+    paths = []
+    for index in range(count):
+        path = "{}_frame{:02d}.jpg".format(output_base, index)
+        # Input-side seeking jumps to the nearest keyframe instead of decoding up to it
+        ffmpeg.input(source, ss=info["duration"] * (index + 0.5) / count).video.filter(
+            "scale", -2, min(info["height"], config.AUDIO_FIRST_FRAME_HEIGHT)
+        ).output(path, vframes=1, **{"q:v": 4}).overwrite_output().run(quiet=True)
+        if os.path.exists(path):
+            paths.append(path)
+    return paths
+
+
+def prepare(source, info, size_upper_bound, output_base=None):
+    """
+    Turn a media file into the parts of an audio-first summary request.
+    :param source: local media file, or a URL ffmpeg can read.
+    :param info: output of encoder.probe_media.
+    :param size_upper_bound: Max audio size in KB.
+    :param output_base: path prefix for the parts, defaults to source without its extension.
+    :return: dict with parts, a list of (path, mime_type) with the audio first,
+        plus prompt, media_note, bytes and seconds; or None when the audio
+        can't fit the bound
+    """
+    plan = audio_plan(info, size_upper_bound)
+    if plan is None:
+        return None
+    start = time.monotonic()
+    output_base = (output_base or os.path.splitext(source)[0]) + "_audio"
+    audio = extract_audio(source, output_base, plan)
+    if os.path.getsize(audio) > size_upper_bound * 1024:
+        os.remove(audio)
+        return None
+    frames = sample_frames(source, info, output_base)
+    parts = [(audio, plan["mime_type"])] + [(path, "image/jpeg") for path in frames]
+    prepared = {
+        "parts": parts,
+        "prompt": config.AUDIO_SUMMARY_PROMPT,
+        "media_note": config.AUDIO_MEDIA_NOTE,
+        "bytes": sum(os.path.getsize(path) for path, _ in parts),
+        "seconds": time.monotonic() - start,
+        "plan": plan,
+    }
+    logging.info(
+        "%s Prepared audio-first parts for %s: %s %s at %.0f bps + %s frames, %s bytes in %.1fs",
+        datetime.fromtimestamp(time.time()).strftime("%Y%m%d%H%M%S"),
+        source,
+        "copied" if plan["copy"] else "encoded",
+        plan["mime_type"],
+        plan["bitrate"],
+        len(frames),
+        prepared["bytes"],
+        prepared["seconds"],
+    )
+    return prepared
@@ -0,0 +1,90 @@
+"""
+Compare encode time and upload bytes of the full-video path with the
+audio-first path on example.wav and synthetic talking-head clips.
+
+Run from the repository root (needs ffmpeg on PATH):
+    python benchmarks/audio_first.py --seconds 60 120 --height 1080
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import audio_first  # noqa: E402
+import config  # noqa: E402
+import encoder  # noqa: E402
+from fakes import synthetic_clip  # noqa: E402
+
+
+def video_path(source, workdir, size_upper_bound):
+    start = time.monotonic()
+    output = os.path.join(workdir, "video_out.mp4")
+    info = encoder.probe_media(source)
+    if info["size"] <= size_upper_bound * 1024:
+        return {"seconds": time.monotonic() - start, "bytes": info["size"]}
+    result = encoder.encode_to_size(source, output, size_upper_bound)
+    return {
+        "seconds": time.monotonic() - start,
+        "bytes": result["size"] if result else None,
+    }
+
+
+def audio_path(source, workdir, size_upper_bound):
+    start = time.monotonic()
+    copy = os.path.join(workdir, "audio_src" + os.path.splitext(source)[1])
+    shutil.copy(source, copy)
+    info = encoder.probe_media(copy)
+    prepared = audio_first.prepare(copy, info, size_upper_bound)
+    if prepared is None:
+        return {"seconds": time.monotonic() - start, "bytes": None}
+    return {
+        "seconds": time.monotonic() - start,
+        "bytes": prepared["bytes"],
+        "parts": [mime_type for _, mime_type in prepared["parts"]],
+        "copied": prepared["plan"]["copy"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--seconds", type=int, nargs="+", default=[60, 120])
+    parser.add_argument("--height", type=int, default=1080)
+    parser.add_argument("--size-mb", type=float, default=config.GCS_MAX_FILE_SIZE)
+    args = parser.parse_args()
+
+    size_upper_bound = args.size_mb * 1024
+    workdir = tempfile.mkdtemp(prefix="audio_first_")
+    try:
+        sources = [os.path.join(ROOT, "example.wav")]
+        for seconds in args.seconds:
+            sources.append(
+                synthetic_clip(
+                    os.path.join(workdir, "clip_{}s.mp4".format(seconds)),
+                    seconds,
+                    args.height,
+                )
+            )
+        report = []
+        for source in sources:
+            report.append(
+                {
+                    "source": os.path.basename(source),
+                    "source_bytes": os.path.getsize(source),
+                    "video_path": video_path(source, workdir, size_upper_bound),
+                    "audio_path": audio_path(source, workdir, size_upper_bound),
+                }
+            )
+    finally:
+        shutil.rmtree(workdir)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
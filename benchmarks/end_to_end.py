@@ -0,0 +1,399 @@
+"""
+Drive lambda_handler end to end with local stand-ins for every external service.
+
+Each scenario copies synthetic testsrc clips or example.wav into a FakeDropbox
+folder and runs one batch invocation of the real handler in a fresh process.
+The fakes are FakeDropbox, FileGCSClient, FakeGenerativeModel,
+MockNotionServer and PushoverStub. Per-stage timings come from the
+invocation's EMF record. The report is JSON with sorted keys, so two runs
+can be diffed, or compared with --compare.
+
+Run from the repository root (needs ffmpeg and ffprobe on PATH):
+    python benchmarks/end_to_end.py --clips 10x480 30x720 --audio-seconds 60 \
+        --files 3 --concurrency 1 3 --output before.json
+    python benchmarks/end_to_end.py ... --output after.json --compare before.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from fakes import looped_audio, synthetic_clip  # noqa: E402
+
+SECRETS = {
+    "API_KEY": "benchmark",
+    "NOTION": "fake",
+    "MEDIA_SAVES_DB": "fake-database",
+    "PUSHOVER_APP": "fake",
+    "PUSHOVER_USER": "fake",
+    "GCS_BUCKET_NAME": "fake-bucket",
+    "S3_BUCKET_NAME": "fake-bucket",
+}
+
+
+def build_fixtures(directory, clips, audio_seconds, files):
+    """
+    Create distinct inputs for each size, so the summary cache can't
+    short-circuit a scenario. Existing fixtures are reused between runs.
+    :return: dict of fixture set name -> list of paths
+    """
+    os.makedirs(directory, exist_ok=True)
+    fixtures = {}
+    for spec in clips:
+        seconds, height = (int(value) for value in spec.split("x"))
+        paths = []
+        for index in range(files):
+            path = os.path.join(
+                directory, "clip_{}x{}_{}.mp4".format(seconds, height, index)
+            )
+            if not os.path.exists(path):
+                synthetic_clip(path, seconds, height, frequency=220 + 20 * index)
+            paths.append(path)
+        fixtures["video-{}".format(spec)] = paths
+    for seconds in audio_seconds:
+        # 0 means example.wav as it is, which has only one distinct copy
+        count = files if seconds else 1
+        paths = []
+        for index in range(count):
+            path = os.path.join(directory, "audio_{}s_{}.wav".format(seconds, index))
+            if not os.path.exists(path):
+                if seconds:
+                    looped_audio(
+                        path, os.path.join(ROOT, "example.wav"), seconds + index * 0.1
+                    )
+                else:
+                    shutil.copyfile(os.path.join(ROOT, "example.wav"), path)
+            paths.append(path)
+        fixtures["audio-{}".format("{}s".format(seconds) if seconds else "example")] = (
+            paths
+        )
+    return fixtures
+
+
+def stage_summary(records):
+    """Count, total and max wall seconds and bytes per stage"""
+    stages = {}
+    for record in records:
+        stage = stages.setdefault(
+            record["stage"],
+            {
+                "count": 0,
+                "wall_seconds": 0.0,
+                "max_wall_seconds": 0.0,
+                "cpu_seconds": 0.0,
+                "bytes_in": 0,
+                "bytes_out": 0,
+                "failed": 0,
+            },
+        )
+        stage["count"] += 1
+        stage["wall_seconds"] += record.get("wall_seconds", 0.0)
+        stage["max_wall_seconds"] = max(
+            stage["max_wall_seconds"], record.get("wall_seconds", 0.0)
+        )
+        stage["cpu_seconds"] += record.get("cpu_seconds", 0.0)
+        stage["bytes_in"] += record.get("bytes_in", 0)
+        stage["bytes_out"] += record.get("bytes_out", 0)
+        stage["failed"] += 0 if record.get("ok", True) else 1
+    return stages
+
+
+def run_scenario(scenario):
+    """Run one scenario in this process and return its results"""
+    workdir = scenario["workdir"]
+    dropbox_root = os.path.join(workdir, "dropbox")
+    os.makedirs(dropbox_root)
+    for path in scenario["fixtures"]:
+        shutil.copyfile(path, os.path.join(dropbox_root, os.path.basename(path)))
+
+    # Settings first: modules bind config defaults when they are imported
+    import config
+
+    config.DROPBOX_BATCH_MODE = True
+    config.BATCH_MAX_WORKERS = scenario["concurrency"]
+    config.PIPELINE_MODE = scenario["pipeline"]
+    config.FANOUT_PROMPTS = scenario["fanout"]
+    # The fake model takes audio parts, unlike the default gemini-pro-vision
+    config.AUDIO_FIRST_MODE = "auto"
+    config.JOB_MODE = False
+    config.DROPBOX_CURSOR_STORE = "file"
+    config.DROPBOX_CURSOR_FILE = os.path.join(workdir, "cursor.json")
+    config.SUMMARY_CACHE_BACKENDS = ["memory"]
+    config.DEDUPE_BACKEND = "memory"
+    config.DEDUPE_DEBOUNCE_SECONDS = 0
+    config.DEDUPE_MAX_WAIT_SECONDS = 0
+    config.LOG_SHIPPING_ENABLED = False
+    config.METRICS_ENABLED = True
+    config.SCRATCH_ROOT = os.path.join(workdir, "scratch")
+    config.SCRATCH_LEGACY_PATTERNS = []
+    config.GEMINI_REQUESTS_PER_MINUTE = scenario["gemini_requests_per_minute"]
+    config.NOTION_REQUESTS_PER_SECOND = scenario["notion_requests_per_second"]
+
+    from fakes import (
+        FakeDropbox,
+        FakeGenerativeModel,
+        FileGCSClient,
+        MockNotionServer,
+        PushoverStub,
+        prompt_responder,
+    )
+
+    with MockNotionServer(
+        requests_per_second=scenario["notion_requests_per_second"]
+    ) as notion, PushoverStub(latency=scenario["pushover_latency"]) as pushover:
+        config.PUSHOVER_URL = pushover.url
+        dbx = FakeDropbox(
+            dropbox_root,
+            latency=scenario["dropbox_latency"],
+            bytes_per_second=scenario["dropbox_bytes_per_second"],
+        )
+        gcs = FileGCSClient(
+            os.path.join(workdir, "gcs"),
+            bytes_per_second=scenario["gcs_bytes_per_second"],
+        )
+        model = FakeGenerativeModel(
+            response=prompt_responder(config.VIDEO_PROMPTS),
+            first_chunk_latency=scenario["gemini_latency"],
+            seed=0,
+        )
+
+        def notion_client():
+            from notion_client import Client
+
+            return Client(auth="fake", base_url=notion.url)
+
+        config.CLIENT_FACTORIES.update(
+            SECRETS=lambda: dict(SECRETS),
+            DROPBOX_CLIENT=lambda: dbx,
+            GCS_CLIENT=lambda: gcs,
+            NOTION_CLIENT=notion_client,
+            GEMINI_MODEL=lambda: model,
+            GEMINI_TEXT_MODEL=lambda: model,
+        )
+        config.reset_clients()
+
+        import lambda_function
+
+        # The fake model takes any object as a part; vertexai needn't be installed
+        lambda_function.media_parts = lambda media: [blob for blob, _ in media]
+
+        class Context:
+            aws_request_id = scenario["name"]
+
+        stdout = io.StringIO()
+        start = time.monotonic()
+        try:
+            with contextlib.redirect_stdout(stdout):
+                response = lambda_function.lambda_handler(
+                    {"headers": {"api-key": SECRETS["API_KEY"]}}, Context()
+                )
+            seconds = time.monotonic() - start
+        finally:
+            dbx.close()
+
+        emf = None
+        for line in stdout.getvalue().splitlines():
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(record, dict) and "_aws" in record:
+                emf = record
+        body = json.loads(response["body"])
+        input_bytes = sum(os.path.getsize(path) for path in scenario["fixtures"])
+        processed = len(body.get("urls", []))
+        return {
+            "name": scenario["name"],
+            "files": len(scenario["fixtures"]),
+            "input_bytes": input_bytes,
+            "concurrency": scenario["concurrency"],
+            "pipeline": scenario["pipeline"],
+            "fanout": scenario["fanout"],
+            "status_code": response["statusCode"],
+            "processed": processed,
+            "failed": len(body.get("failed", [])),
+            "wall_seconds": seconds,
+            "files_per_second": processed / seconds if seconds else 0.0,
+            "input_mb_per_second": (
+                input_bytes / 1024 / 1024 / seconds if seconds else 0.0
+            ),
+            "peak_rss_mb": emf["PeakRssMB"] if emf else None,
+            # ffmpeg runs as child processes
+            "peak_child_rss_mb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+            / 1024,
+            "stages": stage_summary(emf["stages"] if emf else []),
+            "scratch": emf.get("scratch") if emf else None,
+            "services": {
+                "dropbox_calls": dbx.calls,
+                "gcs": gcs.stats(),
+                "gemini_calls": model.calls,
+                "gemini_peak_in_flight": model.peak_in_flight,
+                "notion_pages": len(notion.pages),
+                "notion_rate_limited": notion.rate_limited,
+                "pushover_messages": len(pushover.messages),
+                "pushover_connections": pushover.connections,
+            },
+        }
+
+
+def compare(old, new):
+    """Print wall time, throughput and memory changes per scenario"""
+    old_scenarios = {s["name"]: s for s in old["scenarios"]}
+    for scenario in new["scenarios"]:
+        before = old_scenarios.get(scenario["name"])
+        if before is None:
+            print("{}: new scenario".format(scenario["name"]))
+            continue
+        print(
+            "{}: wall {:.2f}s -> {:.2f}s, {:.3f} -> {:.3f} files/s, "
+            "peak RSS {:.0f} -> {:.0f} MB".format(
+                scenario["name"],
+                before["wall_seconds"],
+                scenario["wall_seconds"],
+                before["files_per_second"],
+                scenario["files_per_second"],
+                before["peak_rss_mb"] or 0,
+                scenario["peak_rss_mb"] or 0,
+            )
+        )
+        for name, stage in sorted(scenario["stages"].items()):
+            previous = before["stages"].get(name)
+            if previous:
+                print(
+                    "  {}: {:.2f}s -> {:.2f}s".format(
+                        name, previous["wall_seconds"], stage["wall_seconds"]
+                    )
+                )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--clips", nargs="*", default=["10x480", "30x720"], help="SECONDSxHEIGHT"
+    )
+    parser.add_argument(
+        "--audio-seconds",
+        type=int,
+        nargs="*",
+        default=[0, 60],
+        help="example.wav looped to this long, 0 for the file as it is",
+    )
+    parser.add_argument("--files", type=int, default=3)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 3])
+    parser.add_argument(
+        "--pipeline", action="store_true", help="also run PIPELINE_MODE"
+    )
+    parser.add_argument("--fanout", nargs="*", default=[])
+    parser.add_argument("--gemini-latency", type=float, default=1.0)
+    parser.add_argument("--gemini-requests-per-minute", type=float, default=600)
+    parser.add_argument("--notion-requests-per-second", type=float, default=3.0)
+    parser.add_argument("--pushover-latency", type=float, default=0.2)
+    parser.add_argument("--dropbox-latency", type=float, default=0.05)
+    parser.add_argument("--dropbox-bytes-per-second", type=float, default=None)
+    parser.add_argument("--gcs-bytes-per-second", type=float, default=None)
+    parser.add_argument("--workdir", default=None)
+    parser.add_argument("--output", default=None, help="write the report here")
+    parser.add_argument(
+        "--compare", default=None, help="earlier report to compare with"
+    )
+    parser.add_argument("--verbose", action="store_true", help="show scenario logs")
+    parser.add_argument("--child", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        scenario = json.loads(args.child)
+        result = run_scenario(scenario)
+        with open(scenario["result_path"], "w") as f:
+            json.dump(result, f)
+        return
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="end_to_end_")
+    fixtures = build_fixtures(
+        os.path.join(workdir, "fixtures"), args.clips, args.audio_seconds, args.files
+    )
+    scenarios = []
+    for fixture_name, paths in fixtures.items():
+        for concurrency in args.concurrency:
+            for pipeline in [False, True] if args.pipeline else [False]:
+                if pipeline and fixture_name.startswith("audio"):
+                    continue
+                name = "{}-c{}{}".format(
+                    fixture_name, concurrency, "-pipeline" if pipeline else ""
+                )
+                scenario_dir = os.path.join(workdir, "runs", name)
+                shutil.rmtree(scenario_dir, ignore_errors=True)
+                os.makedirs(scenario_dir)
+                scenario = {
+                    "name": name,
+                    "fixtures": paths,
+                    "concurrency": concurrency,
+                    "pipeline": pipeline,
+                    "fanout": args.fanout,
+                    "gemini_latency": args.gemini_latency,
+                    "gemini_requests_per_minute": args.gemini_requests_per_minute,
+                    "notion_requests_per_second": args.notion_requests_per_second,
+                    "pushover_latency": args.pushover_latency,
+                    "dropbox_latency": args.dropbox_latency,
+                    "dropbox_bytes_per_second": args.dropbox_bytes_per_second,
+                    "gcs_bytes_per_second": args.gcs_bytes_per_second,
+                    "workdir": scenario_dir,
+                    "result_path": os.path.join(scenario_dir, "result.json"),
+                }
+                # A process per scenario keeps peak RSS, caches and clients separate
+                subprocess.run(
+                    [sys.executable, __file__, "--child", json.dumps(scenario)],
+                    check=True,
+                    stdout=None if args.verbose else subprocess.DEVNULL,
+                    stderr=None if args.verbose else subprocess.DEVNULL,
+                )
+                with open(scenario["result_path"]) as f:
+                    scenarios.append(json.load(f))
+
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    report = {
+        "meta": {
+            "commit": commit,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "args": {
+                k: v for k, v in vars(args).items() if k not in ("child", "verbose")
+            },
+        },
+        "scenarios": scenarios,
+    }
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,721 @@
+"""
+Local stand-ins for external services, for benchmarks and manual testing.
+"""
+
+import datetime
+import json
+import os
+import random
+import shutil
+import threading
+import time
+
+
+class FakeQuotaError(Exception):
+    """Looks like google.api_core.exceptions.ResourceExhausted to the retry logic"""
+
+    code = 429
+
+
+class FakeChunk:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeGenerativeModel:
+    """
+    GenerativeModel stand-in with configurable latency, chunking and 429s.
+    :param response: full text to stream back, or callable(contents) -> text.
+    :param first_chunk_latency: seconds before the first chunk.
+    :param chunk_latency: seconds between chunks.
+    :param chunk_size: characters per chunk.
+    :param quota_error_rate: probability that a call fails with a 429.
+    :param max_concurrent: calls beyond this many in flight fail with a 429.
+    """
+
+    def __init__(
+        self,
+        response="<TITLE> Fake </TITLE>\n<KEYPOINTS>\n- one\n</KEYPOINTS>\n"
+        "<SUMMARY> Fake summary. </SUMMARY>\n<TAGS> fake, test </TAGS>",
+        first_chunk_latency=0.5,
+        chunk_latency=0.05,
+        chunk_size=64,
+        quota_error_rate=0.0,
+        max_concurrent=None,
+        seed=None,
+    ):
+        self.response = response
+        self.first_chunk_latency = first_chunk_latency
+        self.chunk_latency = chunk_latency
+        self.chunk_size = chunk_size
+        self.quota_error_rate = quota_error_rate
+        self.max_concurrent = max_concurrent
+        self.calls = 0
+        self.quota_errors = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def generate_content(self, contents, stream=False, **kwargs):
+        with self._lock:
+            self.calls += 1
+            over_limit = (
+                self.max_concurrent is not None
+                and self.in_flight >= self.max_concurrent
+            )
+            if over_limit or self._random.random() < self.quota_error_rate:
+                self.quota_errors += 1
+                raise FakeQuotaError("429 Quota exceeded (fake)")
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        response = self.response(contents) if callable(self.response) else self.response
+        chunks = self._chunks(response)
+        return chunks if stream else list(chunks)
+
+    def _chunks(self, response):
+        try:
+            time.sleep(self.first_chunk_latency)
+            for start in range(0, len(response), self.chunk_size):
+                if start:
+                    time.sleep(self.chunk_latency)
+                yield FakeChunk(response[start : start + self.chunk_size])
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+
+# Canned answers in the shape each config.VIDEO_PROMPTS parser expects
+PROMPT_RESPONSES = {
+    "summary": "<TITLE> Fake </TITLE>\n<KEYPOINTS>\n- one\n</KEYPOINTS>\n"
+    "<SUMMARY> Fake summary. </SUMMARY>\n<TAGS> fake, test </TAGS>",
+    "action_items": "<ACTION_ITEMS>\n- try it\n</ACTION_ITEMS>\n"
+    "<QUESTIONS>\n- does it scale?\n</QUESTIONS>",
+    "june": '```json\n{"NOTE_PURPOSE": "fake", "NEXT_STEPS": "ship"}\n```',
+}
+
+
+def prompt_responder(video_prompts):
+    """
+    FakeGenerativeModel response callable answering each registered prompt
+    with its PROMPT_RESPONSES entry, and everything else with the summary.
+    """
+
+    def respond(contents):
+        prompt = contents[0] if isinstance(contents, list) else contents
+        for name, entry in video_prompts.items():
+            if name != "summary" and str(prompt).endswith(entry["prompt"]):
+                return PROMPT_RESPONSES.get(name, PROMPT_RESPONSES["summary"])
+        return PROMPT_RESPONSES["summary"]
+
+    return respond
+
+
+class MockNotionServer:
+    """
+    Local HTTP server answering POST /v1/pages and GET /v1/databases/<id> like
+    Notion, with its rate limit. Requests over requests_per_second get a 429
+    with a retry-after header. Pages with rich_text items over 2000 characters
+    or properties the database lacks get a 400, as the real API does.
+    Point a client at it with notion_client.Client(auth="fake", base_url=server.url).
+    """
+
+    COLUMNS = ("Name", "Key points", "Summary", "Tags", "Action items", "June")
+
+    def __init__(self, requests_per_second=3.0, latency=0.05, port=0, columns=None):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        self.requests_per_second = requests_per_second
+        self.latency = latency
+        self.columns = list(self.COLUMNS if columns is None else columns)
+        self.pages = []
+        self.rate_limited = 0
+        self.rejected = 0
+        self.connections = 0
+        self._allowance = requests_per_second
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                with server._lock:
+                    server.connections += 1
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                self.do_POST()
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                status, payload, headers = server._handle(self.command, self.path, body)
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self._server.daemon_threads = True
+        self.url = "http://127.0.0.1:{}".format(self._server.server_address[1])
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _take_token(self):
+        with self._lock:
+            now = time.monotonic()
+            self._allowance = min(
+                self.requests_per_second,
+                self._allowance + (now - self._last) * self.requests_per_second,
+            )
+            self._last = now
+            if self._allowance < 1:
+                self.rate_limited += 1
+                return False
+            self._allowance -= 1
+            return True
+
+    def _handle(self, method, path, body):
+        is_database = method == "GET" and path.startswith("/v1/databases/")
+        if not is_database and (method, path.rstrip("/")) != ("POST", "/v1/pages"):
+            return 404, {"object": "error", "code": "object_not_found"}, {}
+        if not self._take_token():
+            return (
+                429,
+                {
+                    "object": "error",
+                    "status": 429,
+                    "code": "rate_limited",
+                    "message": "Rate limited (fake)",
+                },
+                {"retry-after": "1"},
+            )
+        time.sleep(self.latency)
+        if is_database:
+            return (
+                200,
+                {
+                    "object": "database",
+                    "id": path.rsplit("/", 1)[1],
+                    "properties": {name: {"name": name} for name in self.columns},
+                },
+                {},
+            )
+        page = json.loads(body or b"{}")
+        missing = set(page.get("properties", {})) - set(self.columns)
+        if missing:
+            with self._lock:
+                self.rejected += 1
+            return (
+                400,
+                {
+                    "object": "error",
+                    "status": 400,
+                    "code": "validation_error",
+                    "message": "{} is not a property that exists.".format(
+                        ", ".join(sorted(missing))
+                    ),
+                },
+                {},
+            )
+        for prop in page.get("properties", {}).values():
+            for item in prop.get("rich_text", []) + prop.get("title", []):
+                if len(item["text"]["content"]) > 2000:
+                    with self._lock:
+                        self.rejected += 1
+                    return (
+                        400,
+                        {
+                            "object": "error",
+                            "status": 400,
+                            "code": "validation_error",
+                            "message": "rich_text content over 2000 characters",
+                        },
+                        {},
+                    )
+        with self._lock:
+            self.pages.append(page)
+            page_id = "fake-page-{}".format(len(self.pages))
+        return (
+            200,
+            {
+                "object": "page",
+                "id": page_id,
+                "url": "https://www.notion.so/{}".format(page_id),
+            },
+            {},
+        )
+
+
+class PushoverStub:
+    """
+    Local HTTP server answering POST /1/messages.json like Pushover.
+    :param latency: seconds before each response.
+    :param failure_rate: probability that a request gets a 500.
+    Point a sender at it with notifications.PushoverSender(..., url=stub.url).
+    """
+
+    def __init__(self, latency=0.2, failure_rate=0.0, port=0, seed=None):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        from urllib.parse import parse_qs
+
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.messages = []
+        self.failures = 0
+        self.connections = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                with server._lock:
+                    server.connections += 1
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                fields = {
+                    key: values[0]
+                    for key, values in parse_qs(body.decode("utf-8")).items()
+                }
+                time.sleep(server.latency)
+                with server._lock:
+                    failed = server._random.random() < server.failure_rate
+                    if failed:
+                        server.failures += 1
+                    else:
+                        server.messages.append(fields)
+                status = 500 if failed else 200
+                data = json.dumps({"status": 0 if failed else 1}).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self._server.daemon_threads = True
+        self.url = "http://127.0.0.1:{}/1/messages.json".format(
+            self._server.server_address[1]
+        )
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class FakeDownload:
+    """The requests.Response part of files_download that the pipeline uses"""
+
+    def __init__(self, path, bytes_per_second=None):
+        self.path = path
+        self.bytes_per_second = bytes_per_second
+
+    def iter_content(self, chunk_size=1024 * 1024):
+        with open(self.path, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                if self.bytes_per_second:
+                    time.sleep(len(chunk) / self.bytes_per_second)
+                yield chunk
+
+    @property
+    def content(self):
+        return b"".join(self.iter_content())
+
+    def close(self):
+        pass
+
+
+class FakeDropbox:
+    """
+    dropbox.Dropbox stand-in serving the files under a local directory.
+    Listings return real dropbox.files.FileMetadata with Dropbox content
+    hashes, cursors only report files added or changed since they were
+    issued, and deletes remove the local file.
+    :param root: directory standing in for the Dropbox folder.
+    :param latency: seconds added to every API call.
+    :param bytes_per_second: download bandwidth, unlimited if None.
+    """
+
+    def __init__(self, root, latency=0.0, bytes_per_second=None, page_size=100):
+        self.root = root
+        self.latency = latency
+        self.bytes_per_second = bytes_per_second
+        self.page_size = page_size
+        self.calls = {}
+        self._cursors = {}
+        self._hashes = {}
+        self._link_server = None
+        self._lock = threading.Lock()
+
+    def _call(self, name):
+        with self._lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _local(self, path):
+        return os.path.join(self.root, path.lstrip("/"))
+
+    def _not_found(self, error):
+        import dropbox
+
+        return dropbox.exceptions.ApiError(
+            "fake-request",
+            error(dropbox.files.LookupError.not_found),
+            "not found (fake)",
+            "en",
+        )
+
+    def _metadata(self, local_path):
+        import hashlib
+
+        import dropbox
+
+        import dropbox_sync
+
+        stat = os.stat(local_path)
+        path = "/" + os.path.relpath(local_path, self.root).replace(os.sep, "/")
+        key = (path, stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            content_hash = self._hashes.get(key)
+        if content_hash is None:
+            hasher = dropbox_sync.DropboxContentHasher()
+            with open(local_path, "rb") as f:
+                for chunk in iter(lambda: f.read(4 * 1024 * 1024), b""):
+                    hasher.update(chunk)
+            content_hash = hasher.hexdigest()
+            with self._lock:
+                self._hashes[key] = content_hash
+        modified = datetime.datetime.utcfromtimestamp(int(stat.st_mtime))
+        return dropbox.files.FileMetadata(
+            name=os.path.basename(path),
+            id="id:" + hashlib.sha1(path.encode("utf-8")).hexdigest()[:16],
+            client_modified=modified,
+            server_modified=modified,
+            rev="{:016x}".format(stat.st_mtime_ns),
+            size=stat.st_size,
+            path_lower=path.lower(),
+            path_display=path,
+            content_hash=content_hash,
+        )
+
+    def _files(self):
+        files = []
+        for folder, _, names in os.walk(self.root):
+            for name in sorted(names):
+                files.append(self._metadata(os.path.join(folder, name)))
+        return files
+
+    def _page(self, entries, seen):
+        import dropbox
+
+        with self._lock:
+            cursor = "fake-cursor-{}".format(len(self._cursors))
+            self._cursors[cursor] = (entries[self.page_size :], seen)
+        return dropbox.files.ListFolderResult(
+            entries=entries[: self.page_size],
+            cursor=cursor,
+            has_more=len(entries) > self.page_size,
+        )
+
+    def files_list_folder(self, path="", recursive=False, **kwargs):
+        self._call("files_list_folder")
+        files = self._files()
+        return self._page(files, {(e.id, e.rev) for e in files})
+
+    def files_list_folder_continue(self, cursor):
+        self._call("files_list_folder_continue")
+        with self._lock:
+            remaining, seen = self._cursors[cursor]
+        if remaining:
+            return self._page(remaining, seen)
+        files = self._files()
+        changed = [e for e in files if (e.id, e.rev) not in seen]
+        return self._page(changed, seen | {(e.id, e.rev) for e in files})
+
+    def files_get_metadata(self, path, **kwargs):
+        import dropbox
+
+        self._call("files_get_metadata")
+        if not os.path.exists(self._local(path)):
+            raise self._not_found(dropbox.files.GetMetadataError.path)
+        return self._metadata(self._local(path))
+
+    def files_download(self, path, **kwargs):
+        import dropbox
+
+        self._call("files_download")
+        local_path = self._local(path)
+        if not os.path.exists(local_path):
+            raise self._not_found(dropbox.files.DownloadError.path)
+        return self._metadata(local_path), FakeDownload(
+            local_path, self.bytes_per_second
+        )
+
+    def files_delete(self, path, **kwargs):
+        import dropbox
+
+        self._call("files_delete")
+        try:
+            os.remove(self._local(path))
+        except FileNotFoundError:
+            raise self._not_found(dropbox.files.DeleteError.path_lookup)
+
+    files_delete_v2 = files_delete
+
+    def files_get_temporary_link(self, path):
+        """Link to the file on a local HTTP server that honours Range requests"""
+        import dropbox
+
+        self._call("files_get_temporary_link")
+        local_path = self._local(path)
+        if not os.path.exists(local_path):
+            raise self._not_found(dropbox.files.GetTemporaryLinkError.path)
+        with self._lock:
+            if self._link_server is None:
+                self._link_server = RangeFileServer(self.root, self.bytes_per_second)
+        return dropbox.files.GetTemporaryLinkResult(
+            metadata=self._metadata(local_path),
+            link=self._link_server.url + "/" + path.lstrip("/"),
+        )
+
+    def close(self):
+        if self._link_server is not None:
+            self._link_server.close()
+
+
+class RangeFileServer:
+    """Serves files under root over HTTP with Range support, as ffmpeg expects of a link"""
+
+    def __init__(self, root, bytes_per_second=None):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        from urllib.parse import unquote
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                path = os.path.join(root, unquote(self.path).lstrip("/"))
+                if not os.path.isfile(path):
+                    self.send_error(404)
+                    return
+                size = os.path.getsize(path)
+                start, end = 0, size - 1
+                range_header = self.headers.get("Range", "")
+                if range_header.startswith("bytes="):
+                    first, _, last = range_header[6:].split(",")[0].partition("-")
+                    start = int(first) if first else max(0, size - int(last))
+                    end = int(last) if first and last else size - 1
+                    end = min(end, size - 1)
+                    if start >= size:
+                        self.send_response(416)
+                        self.send_header("Content-Range", "bytes */{}".format(size))
+                        self.send_header("Content-Length", "0")
+                        self.end_headers()
+                        return
+                    self.send_response(206)
+                    self.send_header(
+                        "Content-Range", "bytes {}-{}/{}".format(start, end, size)
+                    )
+                else:
+                    self.send_response(200)
+                self.send_header("Accept-Ranges", "bytes")
+                self.send_header("Content-Type", "application/octet-stream")
+                self.send_header("Content-Length", str(end - start + 1))
+                self.end_headers()
+                remaining = end - start + 1
+                try:
+                    with open(path, "rb") as f:
+                        f.seek(start)
+                        while remaining:
+                            chunk = f.read(min(remaining, 1024 * 1024))
+                            if not chunk:
+                                break
+                            if bytes_per_second:
+                                time.sleep(len(chunk) / bytes_per_second)
+                            self.wfile.write(chunk)
+                            remaining -= len(chunk)
+                except (BrokenPipeError, ConnectionResetError):
+                    # ffmpeg drops the connection when it seeks elsewhere
+                    pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self.url = "http://127.0.0.1:{}".format(self._server.server_address[1])
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class FileBlob:
+    """google.cloud.storage.Blob stand-in stored as a local file"""
+
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+        self.path = os.path.join(bucket.root, name)
+        self.crc32c = None
+        self.md5_hash = None
+        self.size = None
+
+    def _reload(self):
+        import base64
+        import hashlib
+
+        md5 = hashlib.md5()
+        with open(self.path, "rb") as f:
+            for chunk in iter(lambda: f.read(4 * 1024 * 1024), b""):
+                md5.update(chunk)
+        self.md5_hash = base64.b64encode(md5.digest()).decode("utf-8")
+        self.size = os.path.getsize(self.path)
+        return self
+
+    def _throttle(self, size):
+        if self.bucket.bytes_per_second:
+            time.sleep(size / self.bucket.bytes_per_second)
+
+    def upload_from_filename(self, filename, **kwargs):
+        self._throttle(os.path.getsize(filename))
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        shutil.copyfile(filename, self.path)
+        self.bucket.record(self.name, os.path.getsize(self.path))
+
+    def open(self, mode="wb", **kwargs):
+        return FileBlobWriter(self)
+
+
+class FileBlobWriter:
+    """Blob.open("wb") stand-in; the object appears only once closed"""
+
+    def __init__(self, blob):
+        self.blob = blob
+        os.makedirs(os.path.dirname(blob.path), exist_ok=True)
+        self._file = open(blob.path + ".part", "wb")
+
+    def write(self, data):
+        self.blob._throttle(len(data))
+        return self._file.write(data)
+
+    def close(self):
+        self._file.close()
+        os.replace(self.blob.path + ".part", self.blob.path)
+        self.blob.bucket.record(self.blob.name, os.path.getsize(self.blob.path))
+
+
+class FileBucket:
+    def __init__(self, root, bytes_per_second=None):
+        self.root = root
+        self.bytes_per_second = bytes_per_second
+        self.uploads = 0
+        self.bytes_uploaded = 0
+        self._lock = threading.Lock()
+
+    def record(self, name, size):
+        with self._lock:
+            self.uploads += 1
+            self.bytes_uploaded += size
+
+    def blob(self, name, **kwargs):
+        return FileBlob(self, name)
+
+    def get_blob(self, name, **kwargs):
+        blob = FileBlob(self, name)
+        return blob._reload() if os.path.exists(blob.path) else None
+
+
+class FileGCSClient:
+    """
+    google.cloud.storage.Client stand-in keeping every bucket under one
+    local directory, with optional upload bandwidth.
+    """
+
+    def __init__(self, root, bytes_per_second=None):
+        self.root = root
+        self.bytes_per_second = bytes_per_second
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, name):
+        with self._lock:
+            if name not in self._buckets:
+                self._buckets[name] = FileBucket(
+                    os.path.join(self.root, name), self.bytes_per_second
+                )
+            return self._buckets[name]
+
+    def stats(self):
+        with self._lock:
+            buckets = list(self._buckets.values())
+        return {
+            "uploads": sum(b.uploads for b in buckets),
+            "bytes_uploaded": sum(b.bytes_uploaded for b in buckets),
+        }
+
+
+def synthetic_clip(path, seconds, height, fps=30, frequency=220):
+    """
+    A moving test pattern with a tone, standing in for a phone clip or talking head.
+    Clips with different frequencies have different content hashes.
+    """
+    import ffmpeg
+
+    width = height * 16 // 9
+    video = ffmpeg.input(
+        "testsrc2=size={}x{}:rate={}".format(width, height, fps),
+        f="lavfi",
+        t=seconds,
+    )
+    audio = ffmpeg.input(
+        "sine=frequency={}:sample_rate=44100".format(frequency), f="lavfi", t=seconds
+    )
+    ffmpeg.output(
+        video,
+        audio,
+        path,
+        **{"c:v": "libx264", "preset": "ultrafast", "b:v": "8M", "c:a": "aac"},
+        **{"b:a": "128k"}
+    ).overwrite_output().run(quiet=True)
+    return path
+
+
+def looped_audio(path, source, seconds):
+    """source, e.g. example.wav, repeated to last seconds"""
+    import ffmpeg
+
+    ffmpeg.input(source, stream_loop=-1).output(path, t=seconds).overwrite_output().run(
+        quiet=True
+    )
+    return path
@@ -0,0 +1,77 @@
+"""
+Drive GeminiScheduler against FakeGenerativeModel with simulated latency and 429s.
+
+Run from the repository root:
+    python benchmarks/gemini_scheduler.py --requests 40 --concurrency 16 --quota-error-rate 0.2
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import gemini_client  # noqa: E402
+from fakes import FakeGenerativeModel  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests-per-minute", type=float, default=600)
+    parser.add_argument("--max-in-flight", type=int, default=4)
+    parser.add_argument("--model-max-concurrent", type=int, default=None)
+    parser.add_argument("--quota-error-rate", type=float, default=0.1)
+    parser.add_argument("--first-chunk-latency", type=float, default=0.3)
+    args = parser.parse_args()
+
+    model = FakeGenerativeModel(
+        first_chunk_latency=args.first_chunk_latency,
+        quota_error_rate=args.quota_error_rate,
+        max_concurrent=args.model_max_concurrent,
+        seed=0,
+    )
+    scheduler = gemini_client.GeminiScheduler(
+        model,
+        requests_per_minute=args.requests_per_minute,
+        max_in_flight=args.max_in_flight,
+        max_retries=6,
+        backoff_base=0.05,
+        backoff_max=1.0,
+        deadline=30,
+    )
+
+    def one(_):
+        try:
+            scheduler.generate(["prompt"])
+            return True
+        except Exception:
+            return False
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        succeeded = sum(executor.map(one, range(args.requests)))
+    seconds = time.monotonic() - start
+
+    report = {
+        "requests": args.requests,
+        "succeeded": succeeded,
+        "seconds": seconds,
+        "requests_per_second": args.requests / seconds,
+        "model_calls": model.calls,
+        "model_quota_errors": model.quota_errors,
+        "model_peak_in_flight": model.peak_in_flight,
+        "scheduler": scheduler.stats(),
+    }
+    json.dump(report, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Report encode time, output size and upload time for each model input profile.
+
+Run from the repository root (needs ffmpeg on PATH):
+    python benchmarks/input_profiles.py --seconds 20 --height 2160 --fps 60
+Pass --source to use a real clip, and --upload to time real GCS uploads
+(needs the production secrets); otherwise upload time is estimated from
+--upload-mbps.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import config  # noqa: E402
+import encoder  # noqa: E402
+import preprocess  # noqa: E402
+from fakes import synthetic_clip  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--source", default=None)
+    parser.add_argument("--seconds", type=int, default=20)
+    parser.add_argument("--height", type=int, default=2160)
+    parser.add_argument("--fps", type=int, default=60)
+    parser.add_argument(
+        "--profiles", nargs="+", default=list(config.MODEL_INPUT_PROFILES)
+    )
+    parser.add_argument("--size-mb", type=float, default=config.GCS_MAX_FILE_SIZE)
+    parser.add_argument("--upload-mbps", type=float, default=50)
+    parser.add_argument("--upload", action="store_true")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="input_profiles_")
+    try:
+        source = args.source or synthetic_clip(
+            os.path.join(workdir, "clip.mp4"), args.seconds, args.height, args.fps
+        )
+        info = encoder.probe_media(source)
+        report = {
+            "source": {key: info[key] for key in ("size", "duration", "height", "fps")},
+            "profiles": {},
+        }
+        for name in args.profiles:
+            copy = os.path.join(
+                workdir, "{}{}".format(name, os.path.splitext(source)[1])
+            )
+            shutil.copy(source, copy)
+            prepared = preprocess.prepare(
+                copy, info, args.size_mb * 1024, preprocess.get_profile(name)
+            )
+            if prepared is None:
+                report["profiles"][name] = None
+                continue
+            result = {
+                "encode_seconds": prepared["seconds"],
+                "bytes": prepared["bytes"],
+                "parts": [mime_type for _, mime_type in prepared["parts"]],
+                "estimated_upload_seconds": prepared["bytes"]
+                * 8
+                / (args.upload_mbps * 1e6),
+            }
+            if args.upload:
+                import gcs_upload
+
+                start = time.monotonic()
+                for path, _ in prepared["parts"]:
+                    gcs_upload.upload_file(path)
+                result["upload_seconds"] = time.monotonic() - start
+            report["profiles"][name] = result
+    finally:
+        shutil.rmtree(workdir)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
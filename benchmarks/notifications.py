@@ -0,0 +1,106 @@
+"""
+Compare inline notifications with the pooled background dispatcher and its digest mode.
+
+Runs against PushoverStub, a local stand-in for the Pushover API, and
+reports how long callers were blocked, how many requests and connections
+were made, and how many messages arrived.
+
+Run from the repository root:
+    python benchmarks/notifications.py --messages 20 --latency 0.2 --failure-rate 0.1
+"""
+
+import argparse
+import http.client
+import json
+import os
+import sys
+import time
+import urllib.parse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import notifications  # noqa: E402
+from fakes import PushoverStub  # noqa: E402
+
+
+def inline(stub, messages):
+    """The old send_notification: a new connection per message, waited on"""
+    url = urllib.parse.urlsplit(stub.url)
+    blocked = 0.0
+    for message in messages:
+        start = time.monotonic()
+        connection = http.client.HTTPConnection(url.hostname, url.port)
+        connection.request(
+            "POST",
+            url.path,
+            urllib.parse.urlencode({"token": "t", "user": "u", "message": message}),
+            {"Content-type": "application/x-www-form-urlencoded"},
+        )
+        connection.getresponse().read()
+        connection.close()
+        blocked += time.monotonic() - start
+    return {"blocked_seconds": blocked}
+
+
+def dispatched(stub, messages, digest):
+    sender = notifications.PushoverSender(
+        "t", "u", url=stub.url, backoff_base=0.05, backoff_max=0.5
+    )
+    dispatcher = notifications.NotificationDispatcher(sender, enabled=True)
+    blocked = 0.0
+    start = time.monotonic()
+    if digest:
+        with dispatcher.digest(title="benchmark"):
+            for message in messages:
+                call = time.monotonic()
+                dispatcher.notify(message)
+                blocked += time.monotonic() - call
+    else:
+        for message in messages:
+            call = time.monotonic()
+            dispatcher.notify(message)
+            blocked += time.monotonic() - call
+    drained = dispatcher.drain(timeout=60)
+    return {
+        "blocked_seconds": blocked,
+        "drain_seconds": time.monotonic() - start,
+        "drained": drained,
+        "dispatcher": dispatcher.stats(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--messages", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    messages = [
+        "Notion video summary: fake video {}".format(i) for i in range(args.messages)
+    ]
+
+    report = {}
+    for name, run in (
+        ("inline", lambda stub: inline(stub, messages)),
+        ("dispatcher", lambda stub: dispatched(stub, messages, digest=False)),
+        ("digest", lambda stub: dispatched(stub, messages, digest=True)),
+    ):
+        # inline has no retries, so it only gets a stub that doesn't fail
+        failure_rate = 0.0 if name == "inline" else args.failure_rate
+        with PushoverStub(
+            latency=args.latency, failure_rate=failure_rate, seed=0
+        ) as stub:
+            result = run(stub)
+            result.update(
+                stub_messages=len(stub.messages),
+                stub_failures=stub.failures,
+                stub_connections=stub.connections,
+            )
+        report[name] = result
+    json.dump(report, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Measure NotionWriter throughput against a local mock Notion server.
+
+Run from the repository root:
+    python benchmarks/notion_writer.py --pages 30 --concurrency 8 --summary-length 6000
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# The repo root goes first so notion_writer resolves to the module, not this script
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import notion_writer  # noqa: E402
+from fakes import MockNotionServer  # noqa: E402
+
+
+def fake_summary(index, length):
+    sentence = "This sentence pads the summary out to a realistic length. "
+    text = (sentence * (length // len(sentence) + 1))[:length]
+    return {
+        "TITLE": "Fake video {}".format(index),
+        "KEYPOINTS": "- point one\n- point two",
+        "SUMMARY": text,
+        "TAGS": ["fake", "benchmark"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--pages", type=int, default=30)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests-per-second", type=float, default=3)
+    parser.add_argument("--server-requests-per-second", type=float, default=3)
+    parser.add_argument("--summary-length", type=int, default=6000)
+    parser.add_argument("--latency", type=float, default=0.05)
+    args = parser.parse_args()
+
+    from notion_client import Client
+
+    with MockNotionServer(args.server_requests_per_second, args.latency) as server:
+        writer = notion_writer.NotionWriter(
+            Client(auth="fake", base_url=server.url),
+            "fake-database",
+            requests_per_second=args.requests_per_second,
+        )
+        summaries = [fake_summary(i, args.summary_length) for i in range(args.pages)]
+        start = time.monotonic()
+        failed = 0
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            futures = [executor.submit(writer.create_page, s) for s in summaries]
+            for future in futures:
+                if future.exception():
+                    failed += 1
+        elapsed = time.monotonic() - start
+        report = {
+            "pages": args.pages,
+            "failed": failed,
+            "seconds": elapsed,
+            "pages_per_second": args.pages / elapsed if elapsed else 0.0,
+            "writer": writer.stats(),
+            "server": {
+                "pages": len(server.pages),
+                "rate_limited": server.rate_limited,
+                "rejected": server.rejected,
+                "connections": server.connections,
+            },
+        }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
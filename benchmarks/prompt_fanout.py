@@ -0,0 +1,78 @@
+"""
+Time one summary against a fan-out of several prompts over the same upload.
+
+Runs lambda_function.summarize_media against FakeGenerativeModel, so the
+numbers show what an extra analysis adds on top of the summary call.
+
+Run from the repository root:
+    python benchmarks/prompt_fanout.py --prompts action_items june --first-chunk-latency 1.0
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import config  # noqa: E402
+import gemini_client  # noqa: E402
+import lambda_function  # noqa: E402
+import metrics  # noqa: E402
+from fakes import FakeGenerativeModel, prompt_responder  # noqa: E402
+
+
+def run(prompts):
+    config.FANOUT_PROMPTS = prompts
+    metrics.start_invocation()
+    start = time.monotonic()
+    summary_content = lambda_function.summarize_media([("blob.mp4", "video/mp4")])
+    return {
+        "prompts": ["summary"] + prompts,
+        "seconds": time.monotonic() - start,
+        "stages": {
+            record["stage"]: record["wall_seconds"] for record in metrics.records()
+        },
+        "analyses": sorted(summary_content.get("ANALYSES", {})),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--prompts",
+        nargs="+",
+        default=[name for name in config.VIDEO_PROMPTS if name != "summary"],
+    )
+    parser.add_argument("--first-chunk-latency", type=float, default=1.0)
+    args = parser.parse_args()
+
+    model = FakeGenerativeModel(
+        response=prompt_responder(config.VIDEO_PROMPTS),
+        first_chunk_latency=args.first_chunk_latency,
+        seed=0,
+    )
+    config._CLIENTS["GEMINI_SCHEDULER"] = (
+        gemini_client.GeminiScheduler(model, requests_per_minute=600),
+        time.monotonic(),
+    )
+    # The fake model takes any object as a part; vertexai needn't be installed
+    lambda_function.media_parts = lambda media: [blob for blob, _ in media]
+
+    single = run([])
+    fanout = run(args.prompts)
+    report = {
+        "single": single,
+        "fanout": fanout,
+        "extra_seconds": fanout["seconds"] - single["seconds"],
+        "model_calls": model.calls,
+        "model_peak_in_flight": model.peak_in_flight,
+    }
+    json.dump(report, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
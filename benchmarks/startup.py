@@ -0,0 +1,89 @@
+"""
+Measure cold-start cost: module import time in a fresh interpreter and the
+latency of the first and second use of every client in config.CLIENT_FACTORIES.
+
+Run from the repository root, e.g. on two checkouts to compare before/after:
+    python benchmarks/startup.py --runs 5 > startup.json
+Client timings need the AWSKEY/AWSSECRET environment and are skipped without it.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODULES = ["dropbox_webhook_challenge", "config", "lambda_function"]
+
+IMPORT_SNIPPET = """
+import sys, time
+start = time.perf_counter()
+try:
+    import {module}
+except Exception as e:
+    print("error: %s" % e)
+    sys.exit(1)
+print(time.perf_counter() - start)
+"""
+
+
+def time_import(module, runs):
+    """Import time of module in seconds, one fresh interpreter per run"""
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", IMPORT_SNIPPET.format(module=module)],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+        )
+        if output.returncode != 0:
+            return {"error": (output.stdout + output.stderr).strip()[-300:]}
+        samples.append(float(output.stdout.strip()))
+    return {
+        "median_seconds": statistics.median(samples),
+        "min_seconds": min(samples),
+        "runs": runs,
+    }
+
+
+def time_clients():
+    """First (cold) and second (warm) access latency for each client"""
+    sys.path.insert(0, ROOT)
+    import config
+
+    if not hasattr(config, "CLIENT_FACTORIES"):
+        return {"error": "config has no lazy client registry"}
+    results = {}
+    for name in config.CLIENT_FACTORIES:
+        try:
+            start = time.perf_counter()
+            config.get_client(name)
+            first = time.perf_counter() - start
+            start = time.perf_counter()
+            config.get_client(name)
+            second = time.perf_counter() - start
+        except Exception as e:
+            results[name] = {"error": str(e)}
+            continue
+        results[name] = {"first_seconds": first, "warm_seconds": second}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    report = {"imports": {module: time_import(module, args.runs) for module in MODULES}}
+    if "AWSKEY" in os.environ and "AWSSECRET" in os.environ:
+        report["clients"] = time_clients()
+    json.dump(report, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
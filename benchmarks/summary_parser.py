@@ -0,0 +1,115 @@
+"""
+Compare the original concatenate-then-regex parsing of Gemini output with the
+single-pass StreamingTagParser on large synthetic streamed responses.
+
+Run from the repository root:
+    python benchmarks/summary_parser.py --sizes 10000 100000 1000000
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import summary_parser  # noqa: E402
+
+
+def legacy_parse(chunks):
+    """The pre-streaming path: final += chunk, then four uncompiled regex scans"""
+    final = ""
+    for chunk in chunks:
+        final += chunk
+    parsed_content = {"TITLE": "", "KEYPOINTS": "", "SUMMARY": "", "TAGS": []}
+    for tag in ("TITLE", "KEYPOINTS", "SUMMARY"):
+        match = re.search(r"<{0}>(.*?)</{0}>".format(tag), final, re.DOTALL)
+        if match:
+            parsed_content[tag] = match.group(1).strip()
+    match = re.search(r"<TAGS>(.*?)</TAGS>", final, re.DOTALL)
+    if match:
+        parsed_content["TAGS"] = [x.strip() for x in match.group(1).strip().split(",")]
+    return parsed_content
+
+
+def streaming_parse(chunks):
+    parser = summary_parser.StreamingTagParser()
+    for chunk in chunks:
+        parser.feed(chunk)
+    return parser.close()
+
+
+def synthetic_chunks(size, chunk_size):
+    """A response of roughly size characters split into chunk_size pieces"""
+    filler = "Insight about startups & trends, with a < b comparisons. "
+    keypoints = "\n".join(
+        "- " + filler for _ in range(max(1, size // (2 * len(filler))))
+    )
+    summary = filler * max(1, size // (2 * len(filler)))
+    text = (
+        "<TITLE> Synthetic title </TITLE>\n<KEYPOINTS>\n{}\n</KEYPOINTS>\n"
+        "<SUMMARY> {} </SUMMARY>\n<TAGS> ai, startups, trends </TAGS>"
+    ).format(keypoints, summary)
+    return [text[i : i + chunk_size] for i in range(0, len(text), chunk_size)]
+
+
+def first_field_fraction(chunks):
+    """Fraction of the stream consumed before the streaming parser emits its first field"""
+    consumed = {"characters": 0, "first_field": None}
+
+    def on_field(name, value):
+        if consumed["first_field"] is None:
+            consumed["first_field"] = consumed["characters"]
+
+    parser = summary_parser.StreamingTagParser(on_field=on_field)
+    for chunk in chunks:
+        consumed["characters"] += len(chunk)
+        parser.feed(chunk)
+    parser.close()
+    return consumed["first_field"] / consumed["characters"]
+
+
+def best_of(function, chunks, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(chunks)
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[10000, 100000, 1000000]
+    )
+    parser.add_argument("--chunk-size", type=int, default=32)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    report = []
+    for size in args.sizes:
+        chunks = synthetic_chunks(size, args.chunk_size)
+        legacy_seconds, legacy_result = best_of(legacy_parse, chunks, args.repeat)
+        streaming_seconds, streaming_result = best_of(
+            streaming_parse, chunks, args.repeat
+        )
+        report.append(
+            {
+                "characters": sum(len(chunk) for chunk in chunks),
+                "chunks": len(chunks),
+                "legacy_seconds": legacy_seconds,
+                "streaming_seconds": streaming_seconds,
+                "same_result": legacy_result == streaming_result,
+                # The legacy path has nothing until the whole response is in
+                "first_field_after_fraction": first_field_fraction(chunks),
+            }
+        )
+    json.dump(report, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
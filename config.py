@@ -1,12 +1,7 @@
-import http.client
 import json
 import os
-import urllib
-
-import boto3
-from google.cloud import storage
-from google.oauth2 import service_account
-from notion_client import Client
+import threading
+import time
 
 PROMPTS = """You have been tasked with improving a prompt (to be used with ChatGPT). I will provide you with a draft version of a prompt below, and your job is to produce a json formatted output of the following (I've included the example json format):
 {
@@ -49,8 +44,90 @@ Please format your response using HTML tags as follows:
 <SUMMARY> [Your analytical summary here, encompassing the key insights and their wider implications] </SUMMARY>
 <TAGS> [comma seperated 1-word tags that you choose to label the video as] </TAGS>"""
 
+SEGMENT_SUMMARY_PROMPT = (
+    """You are watching part SEGMENT_INDEX_HERE of SEGMENT_COUNT_HERE of a longer video. Summarize only this part; the parts will be combined afterwards.
+
+"""
+    + VIDEO_SUMMARY_PROMPT
+)
+
+AUDIO_MEDIA_NOTE = """The video is provided as its audio track, followed by a few still frames taken from it when it has pictures. Treat them together as the video.
+
+"""
+AUDIO_SUMMARY_PROMPT = AUDIO_MEDIA_NOTE + VIDEO_SUMMARY_PROMPT
+
+FRAMES_MEDIA_NOTE = """The video is provided as still frames taken at each change of scene, in order, followed by its audio track when it has one. Treat them together as the video.
+
+"""
+FRAMES_SUMMARY_PROMPT = FRAMES_MEDIA_NOTE + VIDEO_SUMMARY_PROMPT
+
+VIDEO_ACTION_ITEMS_PROMPT = """You have just watched the attached video. List the concrete actions a founder of an early-stage tech startup could take this week based on what the video covers, and the open questions it leaves that are worth researching further.
+
+Please format your response using HTML tags as follows:
+
+<ACTION_ITEMS>
+- [Action 1]
+- [Action 2]
+</ACTION_ITEMS>
+<QUESTIONS>
+- [Question 1]
+- [Question 2]
+</QUESTIONS>"""
+
+VIDEO_SUMMARY_REDUCE_PROMPT = """Imagine yourself as a visionary leader in the field of technology and innovation, akin to well-known figures like Sam Altman. You have watched a long video in parts and written a summary of each part. Combine the part summaries below into one comprehensive summary of the whole video that includes:
+- a creative title that captures the essence of the whole video
+- 3-5 bullet points highlighting the key takeaways across all parts
+- a 3-5 sentence summary offering a deeper analysis of how these points relate to broader trends and their potential impact on startups and the world at large.
+- 0-3 one-word tags that you choose to label the video as (so that you can categorize and analyze at a later time)
+
+Please format your response using HTML tags as follows:
+
+<TITLE> [Your creative title here] </TITLE>
+<KEYPOINTS>
+- [Key point 1]
+- [Key point 2]
+- [Key point 3]
+</KEYPOINTS>
+<SUMMARY> [Your analytical summary here, encompassing the key insights and their wider implications] </SUMMARY>
+<TAGS> [comma seperated 1-word tags that you choose to label the video as] </TAGS>
+
+Here are the part summaries:
+
+PARTIAL_SUMMARIES_HERE"""
+
+# Analyses that can run against one uploaded video. "parser" is "tags" for
+# <FIELD> tagged responses with the listed fields, or "json"; "property" is
+# the Notion rich_text property an extra analysis is written to. Add that
+# property to the MEDIA_SAVES_DB database before listing the analysis in
+# FANOUT_PROMPTS; until then pages are written without it.
+VIDEO_PROMPTS = {
+    "summary": {
+        "prompt": VIDEO_SUMMARY_PROMPT,
+        "parser": "tags",
+        "fields": ["TITLE", "KEYPOINTS", "SUMMARY", "TAGS"],
+    },
+    "action_items": {
+        "prompt": VIDEO_ACTION_ITEMS_PROMPT,
+        "parser": "tags",
+        "fields": ["ACTION_ITEMS", "QUESTIONS"],
+        "property": "Action items",
+    },
+    "june": {
+        "prompt": JUNE_SYSTEM
+        + "\n\n"
+        + JUNE.replace(
+            "JUNE_DRAFT_HERE",
+            "The note is the attached video; treat what it says as your note.",
+        ),
+        "parser": "json",
+        "property": "June",
+    },
+}
+
 
 def get_secrets():
+    import boto3
+
     secret_name = "notionGPT"
     region_name = "us-east-1"
 
@@ -66,45 +143,381 @@ def get_secrets():
 
 
 def send_notification(message):
-    conn = http.client.HTTPSConnection("api.pushover.net:443")
-    conn.request(
-        "POST",
-        "/1/messages.json",
-        urllib.parse.urlencode(
-            {
-                "token": SECRETS["PUSHOVER_APP"],
-                "user": SECRETS["PUSHOVER_USER"],
-                "message": message,
-            }
-        ),
-        {"Content-type": "application/x-www-form-urlencoded"},
+    """
+    Queue a push notification; it is sent in the background.
+    :return: True if it was queued
+    """
+    return get_client("NOTIFIER").notify(message)
+
+
+def drain_notifications(timeout=None):
+    """Wait for queued notifications to go out, if anything has been notified"""
+    with _CLIENTS_LOCK:
+        cached = _CLIENTS.get("NOTIFIER")
+    if cached is None:
+        return True
+    return cached[0].drain(NOTIFICATION_DRAIN_SECONDS if timeout is None else timeout)
+
+
+def build_s3_client():
+    import boto3
+
+    secrets = get_client("SECRETS")
+    return boto3.client(
+        "s3",
+        aws_access_key_id=secrets["AWS_ACCESS_KEY_ID"],
+        aws_secret_access_key=secrets["AWS_SECRET"],
+    )
+
+
+def build_s3_resource():
+    import boto3
+
+    secrets = get_client("SECRETS")
+    return boto3.resource(
+        "s3",
+        "us-east-1",
+        aws_access_key_id=secrets["AWS_ACCESS_KEY_ID"],
+        aws_secret_access_key=secrets["AWS_SECRET"],
+    )
+
+
+def build_notion_client():
+    from notion_client import Client
+
+    return Client(auth=get_client("SECRETS")["NOTION"])
+
+
+def build_notion_writer():
+    import notion_writer
+
+    return notion_writer.NotionWriter(
+        get_client("NOTION_CLIENT"), get_client("SECRETS")["MEDIA_SAVES_DB"]
+    )
+
+
+def build_notifier():
+    import notifications
+
+    secrets = get_client("SECRETS")
+    return notifications.NotificationDispatcher(
+        notifications.PushoverSender(secrets["PUSHOVER_APP"], secrets["PUSHOVER_USER"])
+    )
+
+
+def build_log_shipper():
+    import lambda_logs
+
+    # Lambda already prints the root logger, so only ship it
+    return lambda_logs.S3LogShipper(LAZY_SETTINGS["S3_LOG_PREFIX"](), console=False)
+
+
+def build_sqs_client():
+    import boto3
+
+    secrets = get_client("SECRETS")
+    return boto3.client(
+        "sqs",
+        "us-east-1",
+        aws_access_key_id=secrets["AWS_ACCESS_KEY_ID"],
+        aws_secret_access_key=secrets["AWS_SECRET"],
+    )
+
+
+def build_gcs_credentials():
+    from google.oauth2 import service_account
+
+    return service_account.Credentials.from_service_account_file("google_auth.json")
+
+
+def build_gcs_client():
+    from google.cloud import storage
+
+    return storage.Client(credentials=get_client("GCS_CREDENTIALS"))
+
+
+def build_dropbox_client():
+    import dropbox
+
+    secrets = get_client("SECRETS")
+    return dropbox.Dropbox(
+        oauth2_refresh_token=secrets["DROPBOX_REFRESH_TOKEN"],
+        app_key=secrets["DROPBOX_CLIENT_ID"],
+        app_secret=secrets["DROPBOX_CLIENT_SECRET"],
+    )
+
+
+def build_gemini_model(model_name=None):
+    from vertexai import init as vertexai_init
+    from vertexai.preview.generative_models import GenerativeModel
+
+    secrets = get_client("SECRETS")
+    vertexai_init(
+        credentials=get_client("GCS_CREDENTIALS"),
+        project=secrets["GOOGLE_PROJECT_ID"],
+        location=secrets["GOOGLE_LOCATION"],
+    )
+    return GenerativeModel(model_name or GEMINI_MODEL_NAME)
+
+
+def build_gemini_scheduler(model_client_name):
+    import gemini_client
+
+    return gemini_client.GeminiScheduler(get_client(model_client_name))
+
+
+def build_summary_cache():
+    import summary_cache
+
+    return summary_cache.SummaryCache(
+        [summary_cache.BACKENDS[name]() for name in SUMMARY_CACHE_BACKENDS]
     )
-    conn.getresponse()
-    return 200
 
 
-SECRETS = get_secrets()
+def build_leases():
+    import dedupe
+
+    return dedupe.Leases(dedupe.BACKENDS[DEDUPE_BACKEND]())
+
+
+def build_job_store():
+    import jobs
+
+    return jobs.JOB_STORES[JOB_STORE_BACKEND]()
+
+
+def build_job_queue():
+    import jobs
+
+    return jobs.JOB_QUEUES[JOB_QUEUE_BACKEND]()
+
+
+def build_scratch_space():
+    import scratch
+
+    return scratch.ScratchSpace()
+
+
+# Clients are built on first use and kept for the life of the container, so
+# cold starts don't pay for SDKs a code path never touches. Secrets are
+# re-fetched once they are older than SECRETS_TTL.
+CLIENT_FACTORIES = {
+    "SECRETS": get_secrets,
+    "S3_CLIENT": build_s3_client,
+    "S3_RESOURCE": build_s3_resource,
+    "SQS_CLIENT": build_sqs_client,
+    "NOTION_CLIENT": build_notion_client,
+    "NOTION_WRITER": build_notion_writer,
+    "NOTIFIER": build_notifier,
+    "GCS_CREDENTIALS": build_gcs_credentials,
+    "GCS_CLIENT": build_gcs_client,
+    "DROPBOX_CLIENT": build_dropbox_client,
+    "LOG_SHIPPER": build_log_shipper,
+    "GEMINI_MODEL": build_gemini_model,
+    "GEMINI_TEXT_MODEL": lambda: build_gemini_model(GEMINI_TEXT_MODEL_NAME),
+    "GEMINI_SCHEDULER": lambda: build_gemini_scheduler("GEMINI_MODEL"),
+    "GEMINI_TEXT_SCHEDULER": lambda: build_gemini_scheduler("GEMINI_TEXT_MODEL"),
+    "SUMMARY_CACHE": build_summary_cache,
+    "LEASES": build_leases,
+    "JOB_STORE": build_job_store,
+    "JOB_QUEUE": build_job_queue,
+    "SCRATCH_SPACE": build_scratch_space,
+}
+CLIENT_TTLS = {"SECRETS": 15 * 60}
+_CLIENTS = {}
+_CLIENTS_LOCK = threading.RLock()
+
+
+def get_client(name):
+    """Return the memoized client for name, building it on first use"""
+    with _CLIENTS_LOCK:
+        cached = _CLIENTS.get(name)
+        ttl = CLIENT_TTLS.get(name)
+        if cached and (ttl is None or time.monotonic() - cached[1] < ttl):
+            return cached[0]
+        client = CLIENT_FACTORIES[name]()
+        _CLIENTS[name] = (client, time.monotonic())
+        return client
+
+
+def reset_clients():
+    """Drop every memoized client, e.g. to swap in fakes"""
+    with _CLIENTS_LOCK:
+        _CLIENTS.clear()
+
+
+def bucket_path(template):
+    return template % get_client("SECRETS")["S3_BUCKET_NAME"]
+
+
+# Settings that depend on secrets are resolved on access as well
+LAZY_SETTINGS = {
+    "S3_LOG_PATH": lambda: bucket_path("s3://%s/uploadMedia.log"),
+    "DROPBOX_CURSOR_S3_PATH": lambda: bucket_path("s3://%s/dropboxCursor.json"),
+    "SUMMARY_CACHE_S3_PREFIX": lambda: bucket_path("s3://%s/summary-cache/"),
+    "S3_LOG_PREFIX": lambda: bucket_path("s3://%s/logs/"),
+    "JOB_S3_PREFIX": lambda: bucket_path("s3://%s/jobs/"),
+    "DEDUPE_S3_PREFIX": lambda: bucket_path("s3://%s/dedupe/"),
+}
+
+
+def __getattr__(name):
+    # PEP 562: keeps config.SECRETS, config.S3_CLIENT etc. working unchanged
+    if name in CLIENT_FACTORIES:
+        return get_client(name)
+    if name in LAZY_SETTINGS:
+        return LAZY_SETTINGS[name]()
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+
 GITHUB_REPO_URL = "git@github.com:takline/automation.git"
-S3_CLIENT = boto3.client(
-    "s3",
-    aws_access_key_id=SECRETS["AWS_ACCESS_KEY_ID"],
-    aws_secret_access_key=SECRETS["AWS_SECRET"],
-)
-S3_RESOURCE = boto3.resource(
-    "s3",
-    "us-east-1",
-    aws_access_key_id=SECRETS["AWS_ACCESS_KEY_ID"],
-    aws_secret_access_key=SECRETS["AWS_SECRET"],
-)
-NOTION_CLIENT = Client(auth=SECRETS["NOTION"])
-GCS_CREDENTIALS = service_account.Credentials.from_service_account_file(
-    "google_auth.json"
-)
-GCS_CLIENT = storage.Client(credentials=GCS_CREDENTIALS)
+GEMINI_MODEL_NAME = "gemini-pro-vision"
+GEMINI_TEXT_MODEL_NAME = "gemini-pro"
 GCS_MAX_FILE_SIZE = 9.5
 GCS_VIDEO_FOLDER = "gs://notion3000/"
 GCS_VIDEO_DEST = "gs://notion3000/video.mp4"
+MEDIA_EXTENSIONS = [
+    ".mp4",
+    ".mov",
+    ".avi",
+    ".mkv",
+    ".wmv",
+    ".flv",
+    ".m4a",
+    ".mp3",
+    ".wav",
+]
+DROPBOX_BATCH_MODE = True
+BATCH_MAX_WORKERS = 3
+ENCODER_PRESET = "veryfast"
+ENCODER_SIZE_MARGIN = 0.95
+ENCODER_MAX_ATTEMPTS = 2
+GCS_UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+GEMINI_REQUESTS_PER_MINUTE = 60
+GEMINI_MAX_IN_FLIGHT = 4
+GEMINI_MAX_RETRIES = 4
+GEMINI_BACKOFF_BASE = 1.0
+GEMINI_BACKOFF_MAX = 30.0
+GEMINI_REQUEST_DEADLINE = 300
+# All attempts of one request, backoff included, share this budget, and it is
+# cut short to the invocation's remaining time less GEMINI_DEADLINE_MARGIN
+# (left for writing the page and flushing logs) so retries can't outlive
+# Lambda's 15 minute timeout
+GEMINI_TOTAL_DEADLINE = 600
+GEMINI_DEADLINE_MARGIN = 30
+NOTIFICATIONS_ENABLED = True
+PUSHOVER_URL = "https://api.pushover.net/1/messages.json"
+NOTIFICATION_POOL_SIZE = 2
+NOTIFICATION_TIMEOUT = 5
+NOTIFICATION_MAX_RETRIES = 3
+NOTIFICATION_BACKOFF_BASE = 0.5
+NOTIFICATION_BACKOFF_MAX = 5.0
+NOTIFICATION_QUEUE_SIZE = 100
+NOTIFICATION_DRAIN_SECONDS = 10
+# Send one notification per batch run instead of one per summary
+NOTIFICATION_DIGEST = True
+NOTION_REQUESTS_PER_SECOND = 3
+NOTION_MAX_RETRIES = 4
+NOTION_BACKOFF_BASE = 0.5
+NOTION_BACKOFF_MAX = 10.0
+# Models that take audio parts; gemini-pro-vision only takes images and video
+AUDIO_INPUT_MODELS = ("gemini-1.5-pro", "gemini-1.5-flash", "gemini-2.0-flash")
+AUDIO_FIRST_MODE = (
+    "auto" if GEMINI_MODEL_NAME.startswith(AUDIO_INPUT_MODELS) else "never"
+)
+AUDIO_FIRST_CODEC = "aac"
+AUDIO_FIRST_BITRATE = 48000
+AUDIO_FIRST_MAX_FPS = 1
+AUDIO_FIRST_FRAMES = 4
+AUDIO_FIRST_FRAME_HEIGHT = 480
+# What get_video_summary is given: "video" profiles cap resolution, frame rate
+# and bits per pixel; "frames" profiles send scene-change stills, plus audio
+# for models in AUDIO_INPUT_MODELS. None uploads the source as-is when it
+# fits; compare profiles with benchmarks/input_profiles.py before picking one.
+MODEL_INPUT_PROFILE = None
+MODEL_INPUT_PROFILES = {
+    "720p": {
+        "mode": "video",
+        "max_height": 720,
+        "max_fps": 15,
+        "max_bits_per_pixel": 0.1,
+    },
+    "480p": {
+        "mode": "video",
+        "max_height": 480,
+        "max_fps": 5,
+        "max_bits_per_pixel": 0.1,
+    },
+    "scenes": {
+        "mode": "frames",
+        "max_height": 480,
+        "scene_threshold": 0.3,
+        "max_frames": 12,
+    },
+}
+SCENE_SAMPLE_FPS = 2
+# Extra VIDEO_PROMPTS run alongside the summary against the same upload,
+# e.g. ["action_items", "june"]; empty keeps to one Gemini call per video
+FANOUT_PROMPTS = []
+FANOUT_MAX_WORKERS = 4
+SEGMENT_MODE = True
+SEGMENT_MIN_DURATION = 10 * 60
+SEGMENT_MIN_SECONDS = 30
+SEGMENT_MAX_SECONDS = 5 * 60
+SEGMENT_MAX_WORKERS = 4
+PIPELINE_MODE = False
+PIPELINE_CHUNK_SIZE = 1024 * 1024
+PIPELINE_QUEUE_CHUNKS = 8
+PIPELINE_UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+S3_PRESIGNED_URL_SECONDS = 60 * 60
+S3_EVENT_MAX_WORKERS = 3
+DROPBOX_STREAM_DOWNLOADS = True
+DROPBOX_CHUNK_SIZE = 4 * 1024 * 1024
+DROPBOX_MAX_FILE_SIZE = 2048
 S3_NOTIONGPT_LOG_FILE = "notionGPT.log"
 S3_TIKTOK_LOG_FILE = "tikTok.log"
 S3_FFMPEG = "ffmpeg-git-amd64-static.tar.xz"
-S3_LOG_PATH = "s3://%s/uploadMedia.log" % SECRETS["S3_BUCKET_NAME"]
+DROPBOX_CURSOR_STORE = "s3"
+DROPBOX_CURSOR_FILE = "/tmp/dropbox_cursor.json"
+SUMMARY_CACHE_BACKENDS = ["memory", "s3"]
+SUMMARY_CACHE_TTL = 30 * 24 * 60 * 60
+SUMMARY_CACHE_MAX_ENTRIES = 256
+SUMMARY_CACHE_S3_MAX_ENTRIES = 5000
+# Listing the prefix to evict costs a request per 1000 entries, so each
+# container does it on its first put and then every this many puts; the
+# prefix can run over max_entries by about this much per busy container
+SUMMARY_CACHE_S3_EVICT_EVERY = 50
+SUMMARY_CACHE_DIR = "/tmp/summary_cache"
+# Return 202 with a job id and leave the work to worker_handler
+JOB_MODE = False
+JOB_QUEUE_BACKEND = "sqs"
+JOB_STORE_BACKEND = "s3"
+JOB_SQLITE_PATH = "/tmp/jobs.sqlite3"
+JOB_WORKER_MAX_JOBS = 10
+# A received SQS job stays hidden this long and is only deleted once it
+# finishes, so a worker that dies mid-job has it redelivered afterwards.
+# Keep it over the worker's timeout.
+JOB_VISIBILITY_SECONDS = 15 * 60
+# Coalesce webhook bursts and lease files by Dropbox id/rev
+DEDUPE_ENABLED = True
+DEDUPE_BACKEND = "s3"
+DEDUPE_FILE = "/tmp/dedupe.json"
+DEDUPE_DEBOUNCE_SECONDS = 5
+DEDUPE_MAX_WAIT_SECONDS = 30
+DEDUPE_LEASE_SECONDS = 15 * 60
+# Per-job working directories, kept under the function's ephemeral storage
+SCRATCH_ROOT = "/tmp/scratch"
+SCRATCH_BUDGET_MB = 400
+SCRATCH_MIN_FREE_MB = 32
+# Source size multiple a local job can have on disk at once: the download,
+# a re-encode of it, and stream-copied segments
+SCRATCH_SIZE_FACTOR = 3
+SCRATCH_SAMPLE_SECONDS = 0.5
+SCRATCH_LEGACY_PATTERNS = ["/tmp/video*", "/tmp/cps_video*", "/tmp/*_2pass-0.log*"]
+LOG_SHIPPING_ENABLED = True
+LOG_SEGMENT_MAX_BYTES = 1024 * 1024
+LOG_SEGMENT_MAX_SECONDS = 60
+LOG_SEGMENT_GZIP = True
+METRICS_ENABLED = True
+METRICS_NAMESPACE = "NotionSummarizer"
+METRICS_HISTORY_SIZE = 500
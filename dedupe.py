@@ -0,0 +1,263 @@
+import fcntl
+import json
+import os
+import threading
+import time
+import uuid
+
+import config
+
+LEASED = "leased"
+DONE = "done"
+
+
+class MemoryLeaseBackend:
+    """Records in a dict, enough for one container and for tests"""
+
+    def __init__(self):
+        self._records = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            record = self._records.get(key)
+            return dict(record) if record else None
+
+    def update(self, key, change):
+        """Atomically replace the record for key with change(current record or None)"""
+        with self._lock:
+            current = self._records.get(key)
+            record = change(dict(current) if current else None)
+            if record is not None:
+                self._records[key] = record
+            return record
+
+
+class FileLeaseBackend:
+    """Records in one JSON file guarded by flock, shared by processes on a host"""
+
+    def __init__(self, path=None):
+        self.path = path or config.DEDUPE_FILE
+        self._lock_path = self.path + ".lock"
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def get(self, key):
+        return self._load().get(key)
+
+    def update(self, key, change):
+        """Atomically replace the record for key with change(current record or None)"""
+        with open(self._lock_path, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                records = self._load()
+                record = change(records.get(key))
+                if record is not None:
+                    records[key] = record
+                    with open(self.path + ".tmp", "w") as f:
+                        json.dump(records, f)
+                    os.replace(self.path + ".tmp", self.path)
+                return record
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+class S3LeaseBackend:
+    """
+    One object per record, updated with S3 conditional writes so concurrent
+    Lambda containers see a single winner: If-None-Match creates, If-Match on
+    the ETag replaces.
+    """
+
+    def __init__(self, s3_prefix=None, max_attempts=5):
+        s3_prefix = s3_prefix or config.DEDUPE_S3_PREFIX
+        self.bucket = s3_prefix.split("/")[2]
+        self.prefix = "/".join(s3_prefix.split("/")[3:])
+        self.max_attempts = max_attempts
+
+    def _read(self, key):
+        s3_client = config.S3_CLIENT
+        try:
+            response = s3_client.get_object(Bucket=self.bucket, Key=self.prefix + key)
+        except s3_client.exceptions.NoSuchKey:
+            return None, None
+        return json.loads(response["Body"].read()), response["ETag"]
+
+    def get(self, key):
+        return self._read(key)[0]
+
+    def update(self, key, change):
+        """Atomically replace the record for key with change(current record or None)"""
+        from botocore.exceptions import ClientError
+
+        for _ in range(self.max_attempts):
+            current, etag = self._read(key)
+            record = change(current)
+            if record is None:
+                return None
+            condition = {"IfMatch": etag} if etag else {"IfNoneMatch": "*"}
+            try:
+                config.S3_CLIENT.put_object(
+                    Bucket=self.bucket,
+                    Key=self.prefix + key,
+                    Body=json.dumps(record),
+                    **condition
+                )
+                return record
+            except ClientError as e:
+                # Someone else wrote first; re-read and decide again
+                if e.response["Error"]["Code"] not in (
+                    "PreconditionFailed",
+                    "ConditionalRequestConflict",
+                ):
+                    raise
+        return None
+
+
+BACKENDS = {
+    "memory": MemoryLeaseBackend,
+    "file": FileLeaseBackend,
+    "s3": S3LeaseBackend,
+}
+
+
+class Leases:
+    """
+    Claims with expiry plus idempotency records on top of a lease backend.
+    A claim succeeds when the key is free, its lease has expired, or the owner
+    already holds it. Completed keys stay done and can't be claimed again.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def claim(self, key, owner, ttl):
+        """Take the lease on key for ttl seconds; False if someone else holds it"""
+        now = time.time()
+
+        def change(record):
+            record = record or {}
+            if record.get("status") == DONE:
+                return None
+            if (
+                record.get("status") == LEASED
+                and record.get("owner") != owner
+                and record.get("expires_at", 0) > now
+            ):
+                return None
+            record.update(status=LEASED, owner=owner, expires_at=now + ttl)
+            return record
+
+        record = self.backend.update(key, change)
+        return record is not None and record.get("owner") == owner
+
+    def release(self, key, owner):
+        """Give up a lease without completing it, so the key can be retried"""
+
+        def change(record):
+            if not record or record.get("owner") != owner:
+                return None
+            if record.get("status") != LEASED:
+                return None
+            record.update(status=None, owner=None, expires_at=0)
+            return record
+
+        self.backend.update(key, change)
+
+    def complete(self, key, owner, result=None):
+        """Mark key done with its result so later claims are refused"""
+
+        def change(record):
+            record = record or {}
+            record.update(status=DONE, owner=owner, result=result, done_at=time.time())
+            return record
+
+        self.backend.update(key, change)
+
+    def result(self, key):
+        """The completion record for key, or None if it isn't done"""
+        record = self.backend.get(key)
+        if record and record.get("status") == DONE:
+            return record
+        return None
+
+    def notify(self, key):
+        """Note that a notification for key arrived now"""
+        now = time.time()
+
+        def change(record):
+            record = record or {}
+            record["notified_at"] = max(now, record.get("notified_at", 0))
+            return record
+
+        self.backend.update(key, change)
+
+    def notified_since(self, key, since):
+        record = self.backend.get(key) or {}
+        return record.get("notified_at", 0) > since
+
+    def wait_for_quiet(self, key, window, max_wait):
+        """
+        Debounce: sleep until no notification for key has arrived for window
+        seconds, or max_wait has passed.
+        """
+        deadline = time.monotonic() + max_wait
+        while True:
+            record = self.backend.get(key) or {}
+            quiet_for = time.time() - record.get("notified_at", 0)
+            remaining = deadline - time.monotonic()
+            if quiet_for >= window or remaining <= 0:
+                return
+            time.sleep(min(window - quiet_for, remaining))
+
+
+def coalesced(
+    key,
+    run,
+    leases=None,
+    window=None,
+    max_wait=None,
+    ttl=None,
+):
+    """
+    Merge a burst of notifications for key into as few run() calls as possible.
+    Every caller records its notification; the one holding the lease waits for
+    the burst to go quiet, runs, and runs again if more notifications arrived
+    meanwhile. Everyone else returns straight away.
+    :return: list of run() results, empty when another invocation has the work
+    """
+    window = config.DEDUPE_DEBOUNCE_SECONDS if window is None else window
+    max_wait = config.DEDUPE_MAX_WAIT_SECONDS if max_wait is None else max_wait
+    ttl = config.DEDUPE_LEASE_SECONDS if ttl is None else ttl
+    leases = leases or get_leases()
+    owner = uuid.uuid4().hex
+    leases.notify(key)
+    results = []
+    # Re-check after releasing, so a notification that lost the claim just
+    # before the release still gets a run
+    while leases.claim(key, owner, ttl):
+        started = time.time()
+        try:
+            leases.wait_for_quiet(key, window, max_wait)
+            started = time.time()
+            results.append(run())
+        finally:
+            leases.release(key, owner)
+        if not leases.notified_since(key, started):
+            break
+    return results
+
+
+def file_key(entry):
+    """Lease key for one revision of a Dropbox file"""
+    return "file/{}@{}".format(entry.id.replace("id:", ""), entry.rev)
+
+
+def get_leases():
+    """The Leases on config.DEDUPE_BACKEND, one per container"""
+    return config.get_client("LEASES")
@@ -0,0 +1,231 @@
+import hashlib
+import json
+import logging
+import os
+import time
+from datetime import datetime
+
+import config
+import lambda_logs
+import metrics
+
+# Dropbox content_hash is computed over fixed 4 MB blocks:
+# https://www.dropbox.com/developers/reference/content-hash
+DROPBOX_HASH_BLOCK_SIZE = 4 * 1024 * 1024
+
+
+class DropboxContentHasher:
+    """Incremental implementation of the Dropbox content_hash algorithm"""
+
+    def __init__(self):
+        self._overall_hasher = hashlib.sha256()
+        self._block_hasher = hashlib.sha256()
+        self._block_pos = 0
+
+    def update(self, data):
+        position = 0
+        while position < len(data):
+            if self._block_pos == DROPBOX_HASH_BLOCK_SIZE:
+                self._overall_hasher.update(self._block_hasher.digest())
+                self._block_hasher = hashlib.sha256()
+                self._block_pos = 0
+            space_in_block = DROPBOX_HASH_BLOCK_SIZE - self._block_pos
+            part = data[position : position + space_in_block]
+            self._block_hasher.update(part)
+            self._block_pos += len(part)
+            position += len(part)
+
+    def hexdigest(self):
+        overall_hasher = self._overall_hasher.copy()
+        if self._block_pos > 0:
+            overall_hasher.update(self._block_hasher.digest())
+        return overall_hasher.hexdigest()
+
+
+def stream_download(
+    dbx,
+    path,
+    local_path,
+    chunk_size=None,
+    max_size_MB=None,
+):
+    """
+    Stream a Dropbox file to disk chunk by chunk.
+    :param dbx: dropbox.Dropbox client.
+    :param path: Dropbox path of the file.
+    :param local_path: Destination path on local disk.
+    :param chunk_size: Bytes read from the HTTP response per iteration.
+    :param max_size_MB: Refuse files larger than this many MB.
+    :return: dict with bytes, content_hash, seconds, bytes_per_second, peak_memory_mb
+    """
+    chunk_size = config.DROPBOX_CHUNK_SIZE if chunk_size is None else chunk_size
+    max_size_MB = config.DROPBOX_MAX_FILE_SIZE if max_size_MB is None else max_size_MB
+    max_bytes = max_size_MB * 1024 * 1024
+    start = time.monotonic()
+    metadata, res = dbx.files_download(path=path)
+    try:
+        if metadata.size > max_bytes:
+            raise ValueError(
+                "Dropbox file {} is {} bytes, over the {} MB limit".format(
+                    path, metadata.size, max_size_MB
+                )
+            )
+        hasher = DropboxContentHasher()
+        written = 0
+        with open(local_path, "wb") as f:
+            for chunk in res.iter_content(chunk_size=chunk_size):
+                if not chunk:
+                    continue
+                written += len(chunk)
+                if written > max_bytes:
+                    raise ValueError(
+                        "Dropbox file {} exceeded the {} MB limit while downloading".format(
+                            path, max_size_MB
+                        )
+                    )
+                hasher.update(chunk)
+                f.write(chunk)
+    except Exception:
+        if os.path.exists(local_path):
+            os.remove(local_path)
+        raise
+    finally:
+        res.close()
+
+    content_hash = hasher.hexdigest()
+    if metadata.content_hash and content_hash != metadata.content_hash:
+        os.remove(local_path)
+        raise ValueError(
+            "Checksum mismatch for {}: expected {}, got {}".format(
+                path, metadata.content_hash, content_hash
+            )
+        )
+
+    seconds = time.monotonic() - start
+    stats = {
+        "bytes": written,
+        "content_hash": content_hash,
+        "seconds": seconds,
+        "bytes_per_second": written / seconds if seconds > 0 else 0.0,
+        "peak_memory_mb": metrics.peak_memory_mb(),
+    }
+    logging.info(
+        "%s Downloaded %s (%s bytes) at %.0f B/s, peak memory %.1f MB",
+        datetime.fromtimestamp(time.time()).strftime("%Y%m%d%H%M%S"),
+        path,
+        stats["bytes"],
+        stats["bytes_per_second"],
+        stats["peak_memory_mb"],
+    )
+    return stats
+
+
+class S3CursorStore:
+    """Persist the list_folder cursor and pending paths as a JSON object in S3"""
+
+    def __init__(self, s3_path=None):
+        self.s3_path = s3_path or config.DROPBOX_CURSOR_S3_PATH
+
+    def load(self):
+        result = lambda_logs.get_content_from_s3(self.s3_path)
+        if not result["success"] or not result["data"]:
+            return {"cursor": None, "pending": []}
+        return json.loads(result["data"])
+
+    def save(self, state):
+        result = lambda_logs.put_content_to_s3(self.s3_path, json.dumps(state))
+        if not result["success"]:
+            raise Exception("Unable to save Dropbox cursor: {0}".format(result["data"]))
+
+
+class FileCursorStore:
+    """Persist the list_folder cursor and pending paths in a local JSON file"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return {"cursor": None, "pending": []}
+        with open(self.path) as f:
+            return json.load(f)
+
+    def save(self, state):
+        with open(self.path, "w") as f:
+            json.dump(state, f)
+
+
+def get_cursor_store():
+    """Build the cursor store selected by config.DROPBOX_CURSOR_STORE"""
+    if config.DROPBOX_CURSOR_STORE == "s3":
+        return S3CursorStore()
+    return FileCursorStore(config.DROPBOX_CURSOR_FILE)
+
+
+def list_folder(dbx, cursor=None, path=""):
+    """
+    List a Dropbox folder, following has_more until the listing is complete.
+    :param dbx: dropbox.Dropbox client.
+    :param cursor: Cursor from a previous listing, or None for a full listing.
+    :param path: Folder to list when no cursor is given.
+    :return: (entries, cursor) where cursor marks the end of this listing
+    """
+    from dropbox.exceptions import ApiError
+
+    if cursor is None:
+        result = dbx.files_list_folder(path, recursive=True)
+    else:
+        try:
+            result = dbx.files_list_folder_continue(cursor)
+        except ApiError as e:
+            if not (hasattr(e.error, "is_reset") and e.error.is_reset()):
+                raise
+            logging.info(
+                "%s Dropbox cursor was reset, falling back to a full listing",
+                datetime.fromtimestamp(time.time()).strftime("%Y%m%d%H%M%S"),
+            )
+            result = dbx.files_list_folder(path, recursive=True)
+
+    entries = list(result.entries)
+    while result.has_more:
+        result = dbx.files_list_folder_continue(result.cursor)
+        entries.extend(result.entries)
+    return entries, result.cursor
+
+
+def list_changes(dbx, cursor_store):
+    """
+    Return files added since the last run plus files that failed last time.
+    :param dbx: dropbox.Dropbox client.
+    :param cursor_store: S3CursorStore or FileCursorStore.
+    :return: (entries, cursor) to be committed with commit_changes
+    """
+    from dropbox.exceptions import ApiError
+    from dropbox.files import FileMetadata
+
+    start = time.monotonic()
+    state = cursor_store.load()
+    entries, cursor = list_folder(dbx, cursor=state.get("cursor"))
+    files = {entry.id: entry for entry in entries if isinstance(entry, FileMetadata)}
+
+    # Retry files a previous run listed but failed to process
+    for path in state.get("pending", []):
+        try:
+            entry = dbx.files_get_metadata(path)
+        except ApiError:
+            continue
+        if isinstance(entry, FileMetadata):
+            files.setdefault(entry.id, entry)
+
+    logging.info(
+        "%s Listed %s Dropbox changes in %.3fs",
+        datetime.fromtimestamp(time.time()).strftime("%Y%m%d%H%M%S"),
+        len(files),
+        time.monotonic() - start,
+    )
+    return list(files.values()), cursor
+
+
+def commit_changes(cursor_store, cursor, pending=()):
+    """Save the cursor and the paths that still need processing"""
+    cursor_store.save({"cursor": cursor, "pending": list(pending)})
@@ -0,0 +1,298 @@
+import logging
+import os
+import time
+from datetime import datetime
+
+import ffmpeg
+
+import config
+
+# Bitrate reference: https://en.wikipedia.org/wiki/Bit_rate#Encoding_bit_rate
+# ffmpeg's "k" is 1000 while our size bounds are in KiB, hence the 1.073741824.
+KIB_PER_KB = 1.073741824
+# mp4 container overhead on top of the elementary streams
+MUXING_OVERHEAD = 0.02
+TOTAL_BITRATE_LOWER_BOUND = 11000
+MIN_AUDIO_BITRATE = 32000
+MAX_AUDIO_BITRATE = 128000
+# Below this many bits per pixel per frame libx264 output turns to mush, so we
+# would rather drop resolution or frame rate than starve the encoder further.
+MIN_BITS_PER_PIXEL = 0.04
+HEIGHT_LADDER = [1080, 720, 540, 480, 360, 240]
+FPS_LADDER = [30, 24, 15]
+
+
+def probe_media(path):
+    """
+    Probe a media file once and pull out what the encoder needs.
+    :param path: media file to probe.
+    :return: dict with duration, size, width, height, fps, audio/video bitrates
+    """
+    probe = ffmpeg.probe(path)
+    # Cover art in audio files shows up as a single-frame video stream
+    video = next(
+        (
+            s
+            for s in probe["streams"]
+            if s["codec_type"] == "video"
+            and not s.get("disposition", {}).get("attached_pic")
+        ),
+        None,
+    )
+    audio = next((s for s in probe["streams"] if s["codec_type"] == "audio"), None)
+    duration = float(probe["format"]["duration"])
+    info = {
+        "duration": duration,
+        "size": int(probe["format"].get("size") or os.path.getsize(path)),
+        "format_bitrate": float(probe["format"].get("bit_rate") or 0),
+        "has_video": video is not None,
+        "has_audio": audio is not None,
+        "width": 0,
+        "height": 0,
+        "fps": 0.0,
+        "video_codec": None,
+        "video_bitrate": 0.0,
+        "audio_codec": None,
+        "audio_bitrate": 0.0,
+    }
+    if video:
+        num, _, den = video.get("avg_frame_rate", "0/1").partition("/")
+        den = float(den or 1)
+        info.update(
+            width=int(video.get("width", 0)),
+            height=int(video.get("height", 0)),
+            fps=float(num) / den if den else 0.0,
+            video_codec=video.get("codec_name"),
+            video_bitrate=float(video.get("bit_rate") or 0),
+        )
+    if audio:
+        info.update(
+            audio_codec=audio.get("codec_name"),
+            audio_bitrate=float(audio.get("bit_rate") or MAX_AUDIO_BITRATE),
+        )
+    return info
+
+
+def plan_encode(
+    info,
+    size_upper_bound,
+    margin=None,
+    max_height=None,
+    max_fps=None,
+    max_bits_per_pixel=None,
+):
+    """
+    Predict the bitrates, resolution and frame rate that land under a size bound.
+    :param info: output of probe_media.
+    :param size_upper_bound: Max output size in KB.
+    :param margin: Fraction of the budget actually aimed for, leaving headroom.
+    :param max_height: Cap on output height, e.g. from a model input profile.
+    :param max_fps: Cap on output frame rate.
+    :param max_bits_per_pixel: Spend at most this much of the budget, so a
+        capped output comes out smaller rather than merely sharper.
+    :return: dict with video_bitrate, audio_bitrate, height and fps, or None
+    """
+    margin = config.ENCODER_SIZE_MARGIN if margin is None else margin
+    duration = info["duration"]
+    target_total_bitrate = (
+        size_upper_bound * 1024 * 8 * margin / (KIB_PER_KB * duration)
+    ) / (1 + MUXING_OVERHEAD)
+    if target_total_bitrate < TOTAL_BITRATE_LOWER_BOUND:
+        return None
+
+    if not info["has_video"]:
+        audio_bitrate = min(info["audio_bitrate"], target_total_bitrate)
+        return {
+            "video_bitrate": 0.0,
+            "audio_bitrate": min(audio_bitrate, MAX_AUDIO_BITRATE),
+            "height": 0,
+            "fps": 0,
+        }
+
+    audio_bitrate = 0.0
+    if info["has_audio"]:
+        audio_bitrate = min(info["audio_bitrate"], target_total_bitrate / 10)
+        audio_bitrate = max(MIN_AUDIO_BITRATE, min(audio_bitrate, MAX_AUDIO_BITRATE))
+
+    video_bitrate = target_total_bitrate - audio_bitrate
+    if video_bitrate < TOTAL_BITRATE_LOWER_BOUND:
+        return None
+
+    plan = {
+        "video_bitrate": video_bitrate,
+        "audio_bitrate": audio_bitrate,
+        "height": info["height"],
+        "fps": info["fps"],
+        "source_height": info["height"],
+        "source_fps": info["fps"],
+    }
+
+    aspect = info["width"] / info["height"] if info["height"] else 16 / 9
+    top_height = min(info["height"], max_height or info["height"])
+    source_fps = min(info["fps"] or FPS_LADDER[0], max_fps or float("inf"))
+    heights = [top_height] + [h for h in HEIGHT_LADDER if h < top_height]
+    capped_fps = min(source_fps, FPS_LADDER[0])
+    # Drop frames above 30fps first, then step down the resolution ladder, and
+    # only cut the frame rate further once the smallest resolution is reached.
+    candidates = [(top_height, source_fps)]
+    candidates += [(height, capped_fps) for height in heights]
+    candidates += [(heights[-1], fps) for fps in FPS_LADDER if fps < capped_fps]
+
+    chosen = candidates[-1]
+    for height, fps in candidates:
+        bits_per_pixel = video_bitrate / (height * height * aspect * fps)
+        if bits_per_pixel >= MIN_BITS_PER_PIXEL:
+            chosen = (height, fps)
+            break
+    height, fps = chosen
+    plan.update(height=height, fps=fps)
+    if max_bits_per_pixel:
+        plan["video_bitrate"] = min(
+            video_bitrate, max_bits_per_pixel * height * height * aspect * fps
+        )
+    return plan
+
+
+def scale_plan(plan, size, limit):
+    """
+    Cut a plan's bitrate by how far an encode at it overshot the limit.
+    Audio-only plans have no video bitrate, so their audio bitrate is cut instead.
+    """
+    factor = (limit / size) * config.ENCODER_SIZE_MARGIN
+    if plan["video_bitrate"]:
+        plan["video_bitrate"] *= factor
+    else:
+        plan["audio_bitrate"] *= factor
+
+
+def build_streams(source, plan, preset=None):
+    """
+    Build the ffmpeg input graph and codec arguments for a plan.
+    :param source: path, URL or "pipe:0" for ffmpeg to read.
+    :param plan: output of plan_encode.
+    :return: (streams, video_args, audio_args)
+    """
+    preset = config.ENCODER_PRESET if preset is None else preset
+    i = ffmpeg.input(source)
+    streams = []
+    video_args = {}
+    if plan.get("height"):
+        v = i.video
+        if plan["height"] != plan.get("source_height"):
+            v = v.filter("scale", -2, plan["height"])
+        if plan["fps"] != plan.get("source_fps"):
+            v = v.filter("fps", fps=plan["fps"])
+        streams.append(v)
+        video_args = {
+            "c:v": "libx264",
+            "preset": preset,
+            "b:v": int(plan["video_bitrate"]),
+            "maxrate": int(plan["video_bitrate"] * 1.5),
+            "bufsize": int(plan["video_bitrate"] * 2),
+        }
+    audio_args = {}
+    if plan.get("audio_bitrate"):
+        streams.append(i.audio)
+        audio_args = {"c:a": "aac", "b:a": int(plan["audio_bitrate"])}
+    return streams, video_args, audio_args
+
+
+def run_encode(source, output, plan, two_pass=False, preset=None):
+    """Encode source into output according to a plan from plan_encode"""
+    preset = config.ENCODER_PRESET if preset is None else preset
+    streams, video_args, audio_args = build_streams(source, plan, preset=preset)
+
+    if two_pass and video_args:
+        pass_log_file = os.path.splitext(output)[0] + "_2pass"
+        try:
+            ffmpeg.output(
+                *streams[:1],
+                os.devnull,
+                **video_args,
+                **{"pass": 1, "passlogfile": pass_log_file, "f": "mp4"},
+            ).overwrite_output().run(quiet=True)
+            ffmpeg.output(
+                *streams,
+                output,
+                **video_args,
+                **audio_args,
+                **{"pass": 2, "passlogfile": pass_log_file, "movflags": "+faststart"},
+            ).overwrite_output().run(quiet=True)
+        finally:
+            # A failed pass leaves its stats behind too
+            for suffix in (
+                "-0.log",
+                "-0.log.mbtree",
+                "-0.log.temp",
+                "-0.log.mbtree.temp",
+            ):
+                if os.path.exists(pass_log_file + suffix):
+                    os.remove(pass_log_file + suffix)
+    else:
+        ffmpeg.output(
+            *streams, output, **video_args, **audio_args, movflags="+faststart"
+        ).overwrite_output().run(quiet=True)
+    return os.path.getsize(output)
+
+
+def encode_to_size(
+    source,
+    output,
+    size_upper_bound,
+    two_pass=False,
+    max_attempts=None,
+    max_height=None,
+    max_fps=None,
+    max_bits_per_pixel=None,
+):
+    """
+    Encode source under size_upper_bound KB, probing once.
+    If the first attempt overshoots, the bitrate is scaled by the measured
+    overshoot and the original source is encoded again; the lossy output is
+    never fed back in. max_height, max_fps and max_bits_per_pixel are passed
+    to plan_encode.
+    :return: dict with output, size, attempts, seconds and the plan used, or None
+    """
+    max_attempts = config.ENCODER_MAX_ATTEMPTS if max_attempts is None else max_attempts
+    start = time.monotonic()
+    info = probe_media(source)
+    plan = plan_encode(
+        info,
+        size_upper_bound,
+        max_height=max_height,
+        max_fps=max_fps,
+        max_bits_per_pixel=max_bits_per_pixel,
+    )
+    if plan is None:
+        logging.info(
+            "%s Bitrate for %s KB over %.0fs is extremely low! Stop compress.",
+            datetime.fromtimestamp(time.time()).strftime("%Y%m%d%H%M%S"),
+            size_upper_bound,
+            info["duration"],
+        )
+        return None
+
+    limit = size_upper_bound * 1024
+    for attempt in range(1, max_attempts + 1):
+        size = run_encode(source, output, plan, two_pass=two_pass)
+        logging.info(
+            "%s Encode attempt %s: %s bytes (limit %s) at %sp%s, %.0f bps video, %.0f bps audio",
+            datetime.fromtimestamp(time.time()).strftime("%Y%m%d%H%M%S"),
+            attempt,
+            size,
+            int(limit),
+            plan["height"],
+            plan["fps"],
+            plan["video_bitrate"],
+            plan["audio_bitrate"],
+        )
+        if size <= limit:
+            return {
+                "output": output,
+                "size": size,
+                "attempts": attempt,
+                "seconds": time.monotonic() - start,
+                "plan": plan,
+            }
+        scale_plan(plan, size, limit)
+    return None
@@ -0,0 +1,130 @@
+import base64
+import hashlib
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+import config
+
+_STATS = {"uploaded_bytes": 0, "skipped_bytes": 0, "upload_seconds": 0.0}
+_STATS_LOCK = threading.Lock()
+
+
+def reset_upload_stats():
+    """Start a fresh set of counters, called once per invocation"""
+    with _STATS_LOCK:
+        _STATS.update(uploaded_bytes=0, skipped_bytes=0, upload_seconds=0.0)
+
+
+def upload_stats():
+    """Uploaded/skipped bytes and throughput since the last reset"""
+    with _STATS_LOCK:
+        stats = dict(_STATS)
+    seconds = stats["upload_seconds"]
+    stats["bytes_per_second"] = stats["uploaded_bytes"] / seconds if seconds else 0.0
+    return stats
+
+
+def record_upload(uploaded=0, skipped=0, seconds=0.0):
+    """Add one upload (or skipped upload) to the invocation counters"""
+    with _STATS_LOCK:
+        _STATS["uploaded_bytes"] += uploaded
+        _STATS["skipped_bytes"] += skipped
+        _STATS["upload_seconds"] += seconds
+
+
+def file_checksums(path, chunk_size=None):
+    """
+    MD5 and CRC32C of a file in one read.
+    :return: dict with md5_hex, plus md5_hash and crc32c base64-encoded the way GCS reports them
+    """
+    import google_crc32c
+
+    chunk_size = config.DROPBOX_CHUNK_SIZE if chunk_size is None else chunk_size
+    md5 = hashlib.md5()
+    crc = google_crc32c.Checksum()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            md5.update(chunk)
+            crc.update(chunk)
+    return {
+        "md5_hex": md5.hexdigest(),
+        "md5_hash": base64.b64encode(md5.digest()).decode("utf-8"),
+        "crc32c": base64.b64encode(crc.digest()).decode("utf-8"),
+    }
+
+
+def content_blob_name(checksums, local_file):
+    """Blob name derived from the file content, so jobs never overwrite each other"""
+    return checksums["md5_hex"] + os.path.splitext(local_file)[1]
+
+
+def source_blob_name(content_hash):
+    """Blob name for output streamed straight from a source with a known hash"""
+    return "src-{}.mp4".format(content_hash)
+
+
+def get_bucket():
+    return config.GCS_CLIENT.bucket(config.SECRETS["GCS_BUCKET_NAME"])
+
+
+def blob_exists(blob_name, max_bytes=None):
+    """
+    Check for a finalized object; resumable uploads only appear once complete.
+    :param max_bytes: treat an object larger than this as missing.
+    """
+    blob = get_bucket().get_blob(blob_name)
+    if blob is None:
+        return False
+    return max_bytes is None or blob.size <= max_bytes
+
+
+def matches(blob, checksums):
+    """Compare an existing blob with local checksums"""
+    # Composite and multipart objects have no MD5, but always carry a CRC32C
+    if blob.crc32c:
+        return blob.crc32c == checksums["crc32c"]
+    return blob.md5_hash == checksums["md5_hash"]
+
+
+def upload_file(local_file, blob_name=None):
+    """
+    Upload a file under a content-addressed name unless an identical object exists.
+    :param local_file: file to upload.
+    :param blob_name: override the content-addressed name.
+    :return: dict with blob_name, bytes, skipped and seconds
+    """
+    size = os.path.getsize(local_file)
+    checksums = file_checksums(local_file)
+    blob_name = blob_name or content_blob_name(checksums, local_file)
+    bucket = get_bucket()
+
+    existing = bucket.get_blob(blob_name)
+    if existing is not None and matches(existing, checksums):
+        record_upload(skipped=size)
+        logging.info(
+            "%s Skipped upload of %s, GCS object %s already has the same content",
+            datetime.fromtimestamp(time.time()).strftime("%Y%m%d%H%M%S"),
+            local_file,
+            blob_name,
+        )
+        return {"blob_name": blob_name, "bytes": size, "skipped": True, "seconds": 0.0}
+
+    start = time.monotonic()
+    blob = bucket.blob(blob_name, chunk_size=config.GCS_UPLOAD_CHUNK_SIZE)
+    # Uploads are capped at GCS_MAX_FILE_SIZE, a few chunks at most, so
+    # parallel composite uploads wouldn't pay for their extra requests
+    blob.upload_from_filename(local_file, checksum="crc32c")
+    seconds = time.monotonic() - start
+    record_upload(uploaded=size, seconds=seconds)
+    logging.info(
+        "%s Uploaded %s as %s (%s bytes at %.0f B/s)",
+        datetime.fromtimestamp(time.time()).strftime("%Y%m%d%H%M%S"),
+        local_file,
+        blob_name,
+        size,
+        size / seconds if seconds else 0.0,
+    )
+    return {"blob_name": blob_name, "bytes": size, "skipped": False, "seconds": seconds}
@@ -0,0 +1,204 @@
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from datetime import datetime
+
+import config
+import rate_limit
+
+# HTTP status codes google.api_core exceptions carry in .code that are worth retrying
+RETRYABLE_CODES = {429, 500, 502, 503, 504}
+RETRYABLE_GRPC_CODES = {"RESOURCE_EXHAUSTED", "UNAVAILABLE", "DEADLINE_EXCEEDED"}
+
+# time.monotonic() by which every request must be done, see limit_to_invocation
+_INVOCATION_END = None
+
+
+def limit_to_invocation(context, margin=None):
+    """
+    Keep requests, retries included, inside the current Lambda invocation.
+    :param context: the handler's Lambda context; None (e.g. locally) lifts the limit.
+    :param margin: seconds left over for the work after the last request.
+    """
+    global _INVOCATION_END
+    margin = config.GEMINI_DEADLINE_MARGIN if margin is None else margin
+    remaining_ms = getattr(context, "get_remaining_time_in_millis", None)
+    if remaining_ms is None:
+        _INVOCATION_END = None
+    else:
+        _INVOCATION_END = time.monotonic() + remaining_ms() / 1000.0 - margin
+
+
+def is_retryable(error):
+    """Quota, overload and timeout errors are retried; anything else is not"""
+    if isinstance(error, TimeoutError):
+        return True
+    code = getattr(error, "code", None)
+    # Raw grpc errors expose code() returning a StatusCode
+    if callable(code):
+        return getattr(code(), "name", None) in RETRYABLE_GRPC_CODES
+    return code in RETRYABLE_CODES
+
+
+class GeminiScheduler:
+    """
+    Wrap a GenerativeModel with a rate limit, an in-flight cap, retries and deadlines.
+    Every request waits for a token and a free slot, streams the response,
+    and is retried with jittered exponential backoff on retryable errors.
+    Each attempt gets deadline seconds, and all of them together total_deadline
+    or whatever is left of the invocation, whichever comes first.
+    """
+
+    def __init__(
+        self,
+        model,
+        requests_per_minute=None,
+        max_in_flight=None,
+        max_retries=None,
+        backoff_base=None,
+        backoff_max=None,
+        deadline=None,
+        total_deadline=None,
+    ):
+        requests_per_minute = (
+            config.GEMINI_REQUESTS_PER_MINUTE
+            if requests_per_minute is None
+            else requests_per_minute
+        )
+        max_in_flight = (
+            config.GEMINI_MAX_IN_FLIGHT if max_in_flight is None else max_in_flight
+        )
+        self.model = model
+        self.bucket = rate_limit.TokenBucket(requests_per_minute / 60.0, max_in_flight)
+        self.slots = threading.BoundedSemaphore(max_in_flight)
+        self.max_retries = (
+            max_retries if max_retries is not None else config.GEMINI_MAX_RETRIES
+        )
+        self.backoff_base = (
+            backoff_base if backoff_base is not None else config.GEMINI_BACKOFF_BASE
+        )
+        self.backoff_max = (
+            backoff_max if backoff_max is not None else config.GEMINI_BACKOFF_MAX
+        )
+        self.deadline = (
+            deadline if deadline is not None else config.GEMINI_REQUEST_DEADLINE
+        )
+        self.total_deadline = (
+            total_deadline
+            if total_deadline is not None
+            else config.GEMINI_TOTAL_DEADLINE
+        )
+        # Calls that overrun their deadline can't be interrupted, only abandoned,
+        # so they run on their own pool instead of holding the caller's thread.
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight * 2)
+        # Bounded so warm containers don't accumulate metrics forever
+        self._metrics = deque(maxlen=1000)
+        self._metrics_lock = threading.Lock()
+
+    def _stream(self, contents, kwargs, on_chunk, timings, attempt):
+        response = self.model.generate_content(contents, stream=True, **kwargs)
+        parts = []
+        for chunk in response:
+            if "first_chunk" not in timings:
+                timings["first_chunk"] = time.monotonic()
+            parts.append(chunk.text)
+            if on_chunk:
+                with attempt["lock"]:
+                    # An abandoned attempt must not feed the retry's consumer
+                    if attempt["abandoned"]:
+                        break
+                    on_chunk(chunk.text)
+        return "".join(parts)
+
+    def generate(self, contents, on_chunk=None, on_retry=None, **kwargs):
+        """
+        Generate a streamed response and return its full text.
+        :param contents: prompt parts passed to generate_content.
+        :param on_chunk: optional callable receiving each chunk of text as it arrives.
+        :param on_retry: optional callable run before a retry, once the failed
+            attempt can no longer call on_chunk, e.g. to reset a parser.
+        :return: response text
+        """
+        metric = {"queue_wait": 0.0, "attempts": 0, "ok": False}
+        lock = threading.Lock()
+        budget_end = time.monotonic() + self.total_deadline
+        if _INVOCATION_END is not None:
+            budget_end = min(budget_end, _INVOCATION_END)
+        try:
+            for attempt in range(self.max_retries + 1):
+                metric["attempts"] = attempt + 1
+                if attempt and on_retry:
+                    on_retry()
+                current = {"lock": lock, "abandoned": False}
+                queued = time.monotonic()
+                self.bucket.acquire()
+                self.slots.acquire()
+                try:
+                    started = time.monotonic()
+                    metric["queue_wait"] += started - queued
+                    timings = {}
+                    deadline = min(self.deadline, budget_end - started)
+                    if deadline <= 0:
+                        raise TimeoutError("Gemini request is out of time")
+                    future = self._executor.submit(
+                        self._stream, contents, kwargs, on_chunk, timings, current
+                    )
+                    try:
+                        text = future.result(timeout=deadline)
+                    except FutureTimeoutError:
+                        raise TimeoutError(
+                            "Gemini request exceeded {:.0f}s deadline".format(deadline)
+                        )
+                    finished = time.monotonic()
+                    metric["time_to_first_chunk"] = (
+                        timings.get("first_chunk", finished) - started
+                    )
+                    metric["generation_seconds"] = finished - started
+                    metric["ok"] = True
+                    return text
+                except Exception as e:
+                    with lock:
+                        current["abandoned"] = True
+                    delay = rate_limit.backoff_delay(
+                        attempt, self.backoff_base, self.backoff_max
+                    )
+                    if (
+                        attempt == self.max_retries
+                        or not is_retryable(e)
+                        # No time left for another attempt after the backoff
+                        or time.monotonic() + delay >= budget_end
+                    ):
+                        metric["error"] = repr(e)
+                        raise
+                    logging.info(
+                        "%s Gemini request failed (%s), retrying in %.1fs",
+                        datetime.fromtimestamp(time.time()).strftime("%Y%m%d%H%M%S"),
+                        e,
+                        delay,
+                    )
+                finally:
+                    self.slots.release()
+                time.sleep(delay)
+        finally:
+            with self._metrics_lock:
+                self._metrics.append(metric)
+
+    def stats(self):
+        """Request counts plus mean/max queue wait, time to first chunk and generation time"""
+        with self._metrics_lock:
+            metrics = list(self._metrics)
+        stats = {
+            "requests": len(metrics),
+            "failed": sum(1 for m in metrics if not m["ok"]),
+            "retries": sum(m["attempts"] - 1 for m in metrics),
+        }
+        for key in ("queue_wait", "time_to_first_chunk", "generation_seconds"):
+            values = [m[key] for m in metrics if key in m]
+            stats[key] = {
+                "mean": sum(values) / len(values) if values else 0.0,
+                "max": max(values, default=0.0),
+            }
+        return stats
@@ -0,0 +1,324 @@
+import json
+import logging
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+
+import config
+import lambda_logs
+import metrics
+import scratch
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+
+def new_job(kind, payload=None):
+    """Job record in its initial queued state"""
+    return {
+        "job_id": uuid.uuid4().hex,
+        "kind": kind,
+        "payload": payload or {},
+        "status": QUEUED,
+        "created_at": time.time(),
+        "transitions": [{"status": QUEUED, "at": time.time()}],
+    }
+
+
+class MemoryJobStore:
+    """Jobs in a dict, for running submitter and worker in one process"""
+
+    def __init__(self):
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return json.loads(json.dumps(job)) if job else None
+
+    def put(self, job):
+        with self._lock:
+            self._jobs[job["job_id"]] = json.loads(json.dumps(job, default=str))
+
+
+class SQLiteJobStore:
+    """Jobs as JSON rows in a SQLite file shared by local processes"""
+
+    def __init__(self, path=None):
+        self.path = path or config.JOB_SQLITE_PATH
+        with self._connect() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS jobs (job_id TEXT PRIMARY KEY, job TEXT)"
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def get(self, job_id):
+        with self._connect() as connection:
+            row = connection.execute(
+                "SELECT job FROM jobs WHERE job_id = ?", (job_id,)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, job):
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO jobs (job_id, job) VALUES (?, ?)",
+                (job["job_id"], json.dumps(job, default=str)),
+            )
+
+
+class S3JobStore:
+    """One JSON object per job under an S3 prefix"""
+
+    def __init__(self, s3_prefix=None):
+        self.s3_prefix = s3_prefix or config.JOB_S3_PREFIX
+
+    def get(self, job_id):
+        result = lambda_logs.get_content_from_s3(self.s3_prefix + job_id + ".json")
+        if not result["success"] or not result["data"]:
+            return None
+        return json.loads(result["data"])
+
+    def put(self, job):
+        result = lambda_logs.put_content_to_s3(
+            self.s3_prefix + job["job_id"] + ".json", json.dumps(job, default=str)
+        )
+        if not result["success"]:
+            raise Exception("Unable to save job: {0}".format(result["data"]))
+
+
+class MemoryQueue:
+    """queue.Queue of job ids, for running submitter and worker in one process"""
+
+    def __init__(self):
+        self._queue = queue.Queue()
+
+    def put(self, job_id):
+        self._queue.put(job_id)
+
+    def get(self, timeout=0):
+        """Next job id, or None once the queue stays empty for timeout seconds"""
+        try:
+            return (
+                self._queue.get(timeout=timeout)
+                if timeout
+                else self._queue.get_nowait()
+            )
+        except queue.Empty:
+            return None
+
+    def ack(self, job_id):
+        """Nothing to do, get already removed it"""
+
+
+class SQLiteQueue:
+    """FIFO of job ids in a SQLite file; each id is handed to one worker only"""
+
+    def __init__(self, path=None):
+        self.path = path or config.JOB_SQLITE_PATH
+        with self._connect() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS job_queue "
+                "(id INTEGER PRIMARY KEY AUTOINCREMENT, job_id TEXT)"
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def put(self, job_id):
+        with self._connect() as connection:
+            connection.execute("INSERT INTO job_queue (job_id) VALUES (?)", (job_id,))
+
+    def get(self, timeout=0):
+        """Next job id, or None once the queue stays empty for timeout seconds"""
+        deadline = time.monotonic() + timeout
+        while True:
+            connection = self._connect()
+            try:
+                # Take the write lock first so two workers can't claim the same row
+                connection.execute("BEGIN IMMEDIATE")
+                row = connection.execute(
+                    "SELECT id, job_id FROM job_queue ORDER BY id LIMIT 1"
+                ).fetchone()
+                if row:
+                    connection.execute("DELETE FROM job_queue WHERE id = ?", (row[0],))
+                connection.execute("COMMIT")
+            finally:
+                connection.close()
+            if row:
+                return row[1]
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(min(0.5, max(0.0, deadline - time.monotonic())))
+
+    def ack(self, job_id):
+        """Nothing to do, get already removed it"""
+
+
+class SQSQueue:
+    """
+    Job ids as SQS messages. In Lambda the worker is usually the queue's event
+    source mapping instead, see job_ids_from_event.
+    A message is only deleted by ack, once its job has finished; until then
+    it is hidden for visibility_seconds and then delivered again.
+    """
+
+    def __init__(self, queue_url=None, visibility_seconds=None):
+        self.queue_url = queue_url or config.SECRETS["JOB_QUEUE_URL"]
+        self.visibility_seconds = (
+            visibility_seconds
+            if visibility_seconds is not None
+            else config.JOB_VISIBILITY_SECONDS
+        )
+        self._receipts = {}
+        self._lock = threading.Lock()
+
+    def put(self, job_id):
+        config.SQS_CLIENT.send_message(
+            QueueUrl=self.queue_url, MessageBody=json.dumps({"job_id": job_id})
+        )
+
+    def get(self, timeout=0):
+        """Next job id, or None once the queue stays empty for timeout seconds"""
+        response = config.SQS_CLIENT.receive_message(
+            QueueUrl=self.queue_url,
+            MaxNumberOfMessages=1,
+            WaitTimeSeconds=min(20, int(timeout)),
+            VisibilityTimeout=int(self.visibility_seconds),
+        )
+        for message in response.get("Messages", []):
+            job_id = json.loads(message["Body"])["job_id"]
+            with self._lock:
+                self._receipts[job_id] = message["ReceiptHandle"]
+            return job_id
+        return None
+
+    def ack(self, job_id):
+        """Delete the message for a job that has finished"""
+        with self._lock:
+            receipt = self._receipts.pop(job_id, None)
+        if receipt:
+            config.SQS_CLIENT.delete_message(
+                QueueUrl=self.queue_url, ReceiptHandle=receipt
+            )
+
+
+JOB_STORES = {"memory": MemoryJobStore, "sqlite": SQLiteJobStore, "s3": S3JobStore}
+JOB_QUEUES = {"memory": MemoryQueue, "sqlite": SQLiteQueue, "sqs": SQSQueue}
+
+
+def get_job_store():
+    """The job store selected by config.JOB_STORE_BACKEND, one per container"""
+    return config.get_client("JOB_STORE")
+
+
+def get_job_queue():
+    """The job queue selected by config.JOB_QUEUE_BACKEND, one per container"""
+    return config.get_client("JOB_QUEUE")
+
+
+def transition(store, job, status, **fields):
+    """Move a job to a new status, recording when it happened"""
+    job.update(fields)
+    job["status"] = status
+    job["transitions"].append({"status": status, "at": time.time()})
+    store.put(job)
+    return job
+
+
+def submit(kind, payload=None, store=None, job_queue=None):
+    """
+    Record a queued job and hand its id to the queue.
+    :param kind: name of the handler the worker should run.
+    :param payload: JSON-serializable arguments for the handler.
+    :return: the job record
+    """
+    store = store or get_job_store()
+    job_queue = job_queue or get_job_queue()
+    job = new_job(kind, payload)
+    store.put(job)
+    job_queue.put(job["job_id"])
+    return job
+
+
+def run_job(job_id, handlers, store=None):
+    """
+    Run one job and record its result, error and stage timings.
+    :param handlers: dict mapping job kind to callable(payload) -> JSON-serializable result.
+    :return: the finished job record, or None for an unknown id
+    """
+    store = store or get_job_store()
+    job = store.get(job_id)
+    if job is None:
+        logging.info(
+            "%s Skipping unknown job %s",
+            datetime.fromtimestamp(time.time()).strftime("%Y%m%d%H%M%S"),
+            job_id,
+        )
+        return None
+    if job["status"] in (SUCCEEDED, FAILED):
+        # Redelivered message for a job that already finished
+        return job
+
+    transition(store, job, RUNNING, started_at=time.time())
+    metrics.start_invocation()
+    try:
+        result = handlers[job["kind"]](job["payload"])
+        status, fields = SUCCEEDED, {"result": result}
+    except Exception as e:
+        logging.exception(
+            "%s Job %s failed",
+            datetime.fromtimestamp(time.time()).strftime("%Y%m%d%H%M%S"),
+            job_id,
+        )
+        status, fields = FAILED, {"error": repr(e)}
+    finally:
+        # One EMF record per job, so a worker draining several still reports each
+        metrics.emit(
+            job_id=job_id,
+            job_kind=job["kind"],
+            scratch=scratch.get_scratch_space().stats(),
+        )
+    return transition(
+        store, job, status, finished_at=time.time(), stages=metrics.records(), **fields
+    )
+
+
+def drain(handlers, store=None, job_queue=None, timeout=0, max_jobs=None):
+    """
+    Run queued jobs one after another until the queue is empty.
+    :param timeout: seconds to wait for more jobs once the queue looks empty.
+    :param max_jobs: stop after this many jobs, e.g. to stay inside a Lambda timeout.
+    :return: list of finished job records
+    """
+    store = store or get_job_store()
+    job_queue = job_queue or get_job_queue()
+    finished = []
+    while max_jobs is None or len(finished) < max_jobs:
+        job_id = job_queue.get(timeout=timeout)
+        if job_id is None:
+            break
+        job = run_job(job_id, handlers, store=store)
+        # Reached only once the job finished or turned out unknown; if the
+        # worker dies first the queue hands the id out again
+        job_queue.ack(job_id)
+        if job is not None:
+            finished.append(job)
+    return finished
+
+
+def job_ids_from_event(event):
+    """Job ids delivered by an SQS event source mapping, empty for other events"""
+    return [
+        json.loads(record["body"])["job_id"]
+        for record in event.get("Records", [])
+        if record.get("eventSource") == "aws:sqs"
+    ]
@@ -1,37 +1,41 @@
+import contextlib
 import json
 import logging
 import os
-import re
 import time
+import urllib.parse
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 
-import dropbox
-import ffmpeg
-from vertexai import init as vertexai_init
-from vertexai.preview.generative_models import GenerativeModel, Part
-
+import audio_first
 import config
+import dedupe
+import dropbox_sync
+import encoder
+import gcs_upload
+import gemini_client
+import jobs
+import metrics
+import pipeline
+import preprocess
+import scratch
+import segments
+import summary_cache
+import summary_parser
 
 logging.getLogger().setLevel(logging.INFO)
 
 
+@metrics.timed("notion")
 def create_notion_page(summary_content):
     """Create a new page in Notion"""
-    response = config.NOTION_CLIENT.pages.create(
-        parent={"database_id": config.SECRETS["MEDIA_SAVES_DB"]},
-        properties={
-            "Name": {"title": [{"text": {"content": summary_content["TITLE"]}}]},
-            "Key points": {
-                "rich_text": [{"text": {"content": summary_content["KEYPOINTS"]}}]
-            },
-            "Summary": {
-                "rich_text": [{"text": {"content": summary_content["SUMMARY"]}}]
-            },
-            "Tags": {
-                "multi_select": [{"name": tag} for tag in summary_content["TAGS"]]
-            },
-        },
-    )
+    response = config.NOTION_WRITER.create_page(summary_content)
+    return notion_page_created(summary_content, response)
+
+
+def notion_page_created(summary_content, response):
+    """Log and notify a page Notion has created, returning its url"""
     logging.info(
         "%s Created Notion page: %s",
         datetime.fromtimestamp(time.time()).strftime("%Y%m%d%H%M%S"),
@@ -45,8 +49,23 @@ def create_notion_page(summary_content):
     return response["url"]
 
 
+@metrics.timed("notion")
+def flush_notion_pages(page_batch):
+    """
+    Write the pages queued on a notion_writer.PageBatch.
+    :return: list of (key, url or the exception raised) in queue order
+    """
+    results = []
+    for key, summary_content, response in page_batch.flush():
+        if isinstance(response, Exception):
+            results.append((key, response))
+        else:
+            results.append((key, notion_page_created(summary_content, response)))
+    return results
+
+
 def compress_video(
-    video_full_path, size_upper_bound, two_pass=True, filename_suffix="cps_"
+    video_full_path, size_upper_bound, two_pass=False, filename_suffix="cps_"
 ):
     """
     Compress video file to max-supported size.
@@ -56,13 +75,10 @@ def compress_video(
     :param filename_suffix: Add a suffix for new video.
     :return: out_put_name or error
     """
-    output_file_name = video_full_path
-
-    # Adjust them to meet your minimum requirements (in bps), or maybe this function will refuse your video!
-    total_bitrate_lower_bound = 11000
-    min_audio_bitrate = 32000
-    max_audio_bitrate = 256000
-    min_video_bitrate = 100000
+    folder, file_name = os.path.split(video_full_path)
+    output_file_name = os.path.join(
+        folder, filename_suffix + os.path.splitext(file_name)[0] + ".mp4"
+    )
     logging.info(
         "%s Compressing video: %s",
         datetime.fromtimestamp(time.time()).strftime("%Y%m%d%H%M%S"),
@@ -70,105 +86,12 @@ def compress_video(
     )
 
     try:
-        # Bitrate reference: https://en.wikipedia.org/wiki/Bit_rate#Encoding_bit_rate
-        probe = ffmpeg.probe(video_full_path)
-        # Video duration, in s.
-        duration = float(probe["format"]["duration"])
-        # Audio bitrate, in bps.
-        audio_bitrate = float(
-            next((s for s in probe["streams"] if s["codec_type"] == "audio"), None)[
-                "bit_rate"
-            ]
-        )
-        # Target total bitrate, in bps.
-        target_total_bitrate = (size_upper_bound * 1024 * 8) / (1.073741824 * duration)
-        if target_total_bitrate < total_bitrate_lower_bound:
-            logging.info(
-                "%s Bitrate is extremely low! Stop compress!",
-                datetime.fromtimestamp(time.time()).strftime("%Y%m%d%H%M%S"),
-            )
-            return False
-
-        # Best min size, in kB.
-        best_min_size = (
-            (min_audio_bitrate + min_video_bitrate)
-            * (1.073741824 * duration)
-            / (8 * 1024)
-        )
-        if size_upper_bound < best_min_size:
-            logging.info(
-                "%s Quality not good! Recommended minimum size: %s KB.",
-                datetime.fromtimestamp(time.time()).strftime("%Y%m%d%H%M%S"),
-                "{:,}".format(int(best_min_size)),
-            )
-            # return False
-
-        # target audio bitrate, in bps
-        if 10 * audio_bitrate > target_total_bitrate:
-            audio_bitrate = target_total_bitrate / 10
-            if audio_bitrate < min_audio_bitrate < target_total_bitrate:
-                audio_bitrate = min_audio_bitrate
-            elif audio_bitrate > max_audio_bitrate:
-                audio_bitrate = max_audio_bitrate
-
-        # Target video bitrate, in bps.
-        video_bitrate = target_total_bitrate - audio_bitrate
-        if video_bitrate < 1000:
-            logging.info(
-                "%s Bitrate %s is extremely low! Stop compress.",
-                datetime.fromtimestamp(time.time()).strftime("%Y%m%d%H%M%S"),
-                video_bitrate,
+        with metrics.stage("compress") as record:
+            record["bytes_in"] = os.path.getsize(video_full_path)
+            result = encoder.encode_to_size(
+                video_full_path, output_file_name, size_upper_bound, two_pass=two_pass
             )
-            return False
-
-        i = ffmpeg.input(video_full_path)
-        if two_pass:
-            ffmpeg.output(
-                i,
-                os.devnull,
-                **{"c:v": "libx264", "b:v": video_bitrate, "pass": 1, "f": "mp4"},
-            ).overwrite_output().run()
-            ffmpeg.output(
-                i,
-                output_file_name,
-                **{
-                    "c:v": "libx264",
-                    "b:v": video_bitrate,
-                    "pass": 2,
-                    "c:a": "aac",
-                    "b:a": audio_bitrate,
-                },
-            ).overwrite_output().run()
-        else:
-            ffmpeg.output(
-                i,
-                output_file_name,
-                **{
-                    "c:v": "libx264",
-                    "b:v": video_bitrate,
-                    "c:a": "aac",
-                    "b:a": audio_bitrate,
-                },
-            ).overwrite_output().run()
-
-        if os.path.getsize(output_file_name) <= size_upper_bound * 1024:
-            logging.info(
-                "%s Compressed video: %s",
-                datetime.fromtimestamp(time.time()).strftime("%Y%m%d%H%M%S"),
-                output_file_name,
-            )
-            return output_file_name
-        elif os.path.getsize(output_file_name) < os.path.getsize(
-            video_full_path
-        ):  # Do it again
-            logging.info(
-                "%s Compressed video: %s",
-                datetime.fromtimestamp(time.time()).strftime("%Y%m%d%H%M%S"),
-                output_file_name,
-            )
-            return compress_video(output_file_name, size_upper_bound)
-        else:
-            return False
+            record["bytes_out"] = result["size"] if result else 0
     except FileNotFoundError:
         logging.info(
             "%s You do not have ffmpeg installed!",
@@ -180,18 +103,31 @@ def compress_video(
         )
         return False
 
+    if result is None:
+        if os.path.exists(output_file_name):
+            os.remove(output_file_name)
+        return False
 
-def upload_to_gcs(local_file):
-    """Uploads a file to the Google Cloud Blob bucket."""
-    bucket = config.GCS_CLIENT.bucket(config.SECRETS["GCS_BUCKET_NAME"])
-    blob = bucket.blob(os.path.basename(local_file))
-    blob.upload_from_filename(local_file)
-
+    # Callers keep using the original path, so the compressed file replaces it
+    os.replace(output_file_name, video_full_path)
     logging.info(
-        datetime.fromtimestamp(time.time()).strftime("%Y%m%d%H%M%S")
-        + " - Uploaded file: "
-        + local_file
+        "%s Compressed video: %s (%s bytes, %s attempt(s), %.1fs)",
+        datetime.fromtimestamp(time.time()).strftime("%Y%m%d%H%M%S"),
+        video_full_path,
+        result["size"],
+        result["attempts"],
+        result["seconds"],
     )
+    return video_full_path
+
+
+def upload_to_gcs(local_file):
+    """Uploads a file to the Google Cloud Blob bucket unless it is already there."""
+    with metrics.stage("gcs_upload") as record:
+        result = gcs_upload.upload_file(local_file)
+        record["bytes_out"] = 0 if result["skipped"] else result["bytes"]
+        record["skipped"] = result["skipped"]
+    return result["blob_name"]
 
 
 def compress_and_upload(filename):
@@ -205,37 +141,42 @@ def compress_and_upload(filename):
             datetime.fromtimestamp(time.time()).strftime("%Y%m%d%H%M%S"),
         )
     else:
-        compress_video(filename, config.GCS_MAX_FILE_SIZE)
+        compress_video(filename, config.GCS_MAX_FILE_SIZE * 1024)
 
-    upload_to_gcs(local_file=filename)
+    blob_name = upload_to_gcs(local_file=filename)
     # Return data for use in future steps
-    return filename
+    return blob_name
 
 
-def get_video_summary(video_file_name):
-    """Generate video summary"""
-    vertexai_init(
-        credentials=config.GCS_CREDENTIALS,
-        project=config.SECRETS["GOOGLE_PROJECT_ID"],
-        location=config.SECRETS["GOOGLE_LOCATION"],
+def get_video_summary(video_file_name, prompt=None, parser=None):
+    """
+    Generate video summary
+    :param video_file_name: GCS object to summarize.
+    :param prompt: defaults to config.VIDEO_SUMMARY_PROMPT.
+    :param parser: optional summary_parser.StreamingTagParser fed each chunk as it arrives.
+    :return: full response text
+    """
+    return get_media_summary(
+        [(video_file_name, "video/mp4")], prompt=prompt, parser=parser
     )
+
+
+def get_media_summary(media, prompt=None, parser=None):
+    """
+    Generate a summary from one or more GCS objects
+    :param media: list of (GCS object, mime_type), e.g. an audio track and still frames.
+    :param prompt: defaults to config.VIDEO_SUMMARY_PROMPT.
+    :param parser: optional summary_parser.StreamingTagParser fed each chunk as it arrives.
+    :return: full response text
+    """
     logging.info(
-        "%s Generating video summary...",
+        "%s Generating video summary from %s...",
         datetime.fromtimestamp(time.time()).strftime("%Y%m%d%H%M%S"),
+        ", ".join(mime_type for _, mime_type in media),
     )
-    gemini_pro_vision_model = GenerativeModel("gemini-pro-vision")
-    response = gemini_pro_vision_model.generate_content(
-        [
-            config.VIDEO_SUMMARY_PROMPT,
-            Part.from_uri(
-                config.GCS_VIDEO_FOLDER + video_file_name, mime_type="video/mp4"
-            ),
-        ],
-        stream=True,
+    final = generate_from_parts(
+        media_parts(media), prompt or config.VIDEO_SUMMARY_PROMPT, parser=parser
     )
-    final = ""
-    for chunk in response:
-        final += chunk.text
     logging.info(
         "%s Video summary generated: %s...",
         datetime.fromtimestamp(time.time()).strftime("%Y%m%d%H%M%S"),
@@ -244,86 +185,764 @@ def get_video_summary(video_file_name):
     return final
 
 
+def media_parts(media):
+    """Part references to GCS objects, built once and shared by every prompt"""
+    from vertexai.preview.generative_models import Part
+
+    return [
+        Part.from_uri(
+            config.GCS_VIDEO_FOLDER + os.path.basename(blob_name),
+            mime_type=mime_type,
+        )
+        for blob_name, mime_type in media
+    ]
+
+
+def generate_from_parts(parts, prompt, parser=None, stage="gemini"):
+    """Run one prompt against media parts, timed as its own metrics stage"""
+    with metrics.stage(stage) as record:
+        final = config.GEMINI_SCHEDULER.generate(
+            [prompt] + parts,
+            on_chunk=parser.feed if parser else None,
+            on_retry=parser.reset if parser else None,
+        )
+        record["bytes_in"] = len(final.encode("utf-8"))
+    return final
+
+
+def run_prompts(media, prompts, max_workers=None):
+    """
+    Run several prompts concurrently against the same uploaded media.
+    Nothing is uploaded again, so each extra prompt costs one generation call.
+    :param media: list of (GCS object, mime_type).
+    :param prompts: dict of name -> (prompt text, parser with feed, reset and close).
+    :param max_workers: Max number of prompts generating at once.
+    :return: dict of name -> (parsed result, or the exception raised, seconds)
+    """
+    max_workers = config.FANOUT_MAX_WORKERS if max_workers is None else max_workers
+    parts = media_parts(media)
+
+    def run(name):
+        prompt, parser = prompts[name]
+        start = time.monotonic()
+        try:
+            generate_from_parts(
+                parts,
+                prompt,
+                parser=parser,
+                stage="gemini" if name == "summary" else "gemini_" + name,
+            )
+            result = parser.close()
+        except Exception as e:
+            result = e
+        return result, time.monotonic() - start
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {name: executor.submit(run, name) for name in prompts}
+    results = {name: future.result() for name, future in futures.items()}
+    logging.info(
+        "%s Ran %s prompt(s) against %s: %s",
+        datetime.fromtimestamp(time.time()).strftime("%Y%m%d%H%M%S"),
+        len(results),
+        ", ".join(blob_name for blob_name, _ in media),
+        ", ".join(
+            "{} {:.1f}s{}".format(
+                name, seconds, " failed" if isinstance(result, Exception) else ""
+            )
+            for name, (result, seconds) in results.items()
+        ),
+    )
+    return results
+
+
+def summarize_media(media, prompt=None, media_note="", on_field=None):
+    """
+    Summarize uploaded media, fanning out to config.FANOUT_PROMPTS over the same upload.
+    :param media: list of (GCS object, mime_type).
+    :param prompt: summary prompt, defaults to the "summary" entry of config.VIDEO_PROMPTS.
+    :param media_note: text put before the extra prompts, saying how the media is split up.
+    :param on_field: optional callable(name, value) called as each summary field completes.
+    :return: parsed summary content, with the extra analyses that succeeded under "ANALYSES"
+    """
+    summary = config.VIDEO_PROMPTS["summary"]
+    prompts = {
+        "summary": (
+            prompt or summary["prompt"],
+            summary_parser.get_parser(summary, on_field=on_field),
+        )
+    }
+    for name in config.FANOUT_PROMPTS:
+        entry = config.VIDEO_PROMPTS[name]
+        prompts[name] = (media_note + entry["prompt"], summary_parser.get_parser(entry))
+    results = run_prompts(media, prompts)
+
+    summary_content, _ = results.pop("summary")
+    if isinstance(summary_content, Exception):
+        raise summary_content
+    analyses = {}
+    for name, (result, _) in results.items():
+        if isinstance(result, Exception):
+            # An extra analysis is not worth failing the summary over
+            logging.info(
+                "%s Skipping %s analysis: %s",
+                datetime.fromtimestamp(time.time()).strftime("%Y%m%d%H%M%S"),
+                name,
+                result,
+            )
+            continue
+        analyses[name] = result
+    if analyses:
+        summary_content["ANALYSES"] = analyses
+    return summary_content
+
+
+def get_text_summary(prompt):
+    """Generate a summary from text alone, used to merge segment summaries"""
+    with metrics.stage("gemini_text") as record:
+        record["bytes_out"] = len(prompt.encode("utf-8"))
+        final = config.GEMINI_TEXT_SCHEDULER.generate(prompt)
+        record["bytes_in"] = len(final.encode("utf-8"))
+    return final
+
+
+def summarize_segment(segment_path, prompt):
+    """Compress, upload and summarize one segment of a long video"""
+    blob_name = compress_and_upload(segment_path)
+    return parse_html_tags(get_video_summary(blob_name, prompt=prompt))
+
+
+def summarize_prepared(prepared, on_field=None):
+    """
+    Upload the parts from audio_first.prepare or preprocess.prepare and summarize them together.
+    :return: (first GCS object, parsed summary content)
+    """
+    try:
+        media = [
+            (upload_to_gcs(local_file=path), mime_type)
+            for path, mime_type in prepared["parts"]
+        ]
+    finally:
+        for path, _ in prepared["parts"]:
+            if os.path.exists(path):
+                os.remove(path)
+    summary_content = summarize_media(
+        media,
+        prompt=prepared["prompt"],
+        media_note=prepared.get("media_note", ""),
+        on_field=on_field,
+    )
+    return media[0][0], summary_content
+
+
 def parse_html_tags(input_string):
     """Extract content from HTML tags"""
-    # Define a dictionary to hold the parsed content
-    parsed_content = {"TITLE": "", "KEYPOINTS": "", "SUMMARY": "", "TAGS": []}
+    return summary_parser.parse(input_string)
+
+
+def get_dropbox_client():
+    """Authenticated Dropbox client, reused across warm invocations"""
+    return config.DROPBOX_CLIENT
 
-    # Define regular expression patterns for each tag
-    title_pattern = r"<TITLE>(.*?)</TITLE>"
-    keypoints_pattern = r"<KEYPOINTS>(.*?)</KEYPOINTS>"
-    summary_pattern = r"<SUMMARY>(.*?)</SUMMARY>"
-    tags_pattern = r"<TAGS>(.*?)</TAGS>"
 
-    # Extract content for each tag
-    title_match = re.search(title_pattern, input_string, re.DOTALL)
-    if title_match:
-        parsed_content["TITLE"] = title_match.group(1).strip()
+def is_media_entry(entry):
+    """Check whether a Dropbox entry is a supported media file"""
+    return any(x in entry.path_display.lower() for x in config.MEDIA_EXTENSIONS)
 
-    keypoints_match = re.search(keypoints_pattern, input_string, re.DOTALL)
-    if keypoints_match:
-        parsed_content["KEYPOINTS"] = keypoints_match.group(1).strip()
 
-    summary_match = re.search(summary_pattern, input_string, re.DOTALL)
-    if summary_match:
-        parsed_content["SUMMARY"] = summary_match.group(1).strip()
+def summarize_file(filename, content_hash=None, on_field=None, cache_checked=False):
+    """
+    Compress, upload and summarize a local file, reusing cached summaries.
+    :param filename: Local media file.
+    :param content_hash: Dropbox content hash of the file, computed if missing.
+    :param on_field: optional callable(name, value) called as each summary field completes.
+    :param cache_checked: the caller already looked content_hash up and missed.
+    :return: parsed summary content
+    """
+    cache = summary_cache.get_summary_cache()
+    content_hash = content_hash or summary_cache.file_content_hash(filename)
+    if not cache_checked:
+        cached = cache.get(content_hash)
+        if cached:
+            return cached["summary"]
+
+    start = time.monotonic()
+    info = None
+    if (
+        config.SEGMENT_MODE
+        or config.AUDIO_FIRST_MODE != "never"
+        or config.MODEL_INPUT_PROFILE
+    ):
+        info = encoder.probe_media(filename)
+    blob_name, summary_content = summarize_source(filename, info, on_field=on_field)
+    cache.put(
+        content_hash,
+        summary_content,
+        gcs_object=blob_name,
+        seconds=time.monotonic() - start,
+    )
+    return summary_content
 
-    tags_match = re.search(tags_pattern, input_string, re.DOTALL)
-    if tags_match:
-        # Split the keypoints into a list
-        tags = tags_match.group(1).strip().split(",")
-        tags = [x.strip() for x in tags]
-        # Clean up each keypoint
-        parsed_content["TAGS"] = tags
 
-    return parsed_content
+def summarize_source(source, info=None, on_field=None, output_path=None, upload=None):
+    """
+    Summarize media through the audio-first, input profile, segment or whole-video path.
+    :param source: local media file, or a URL ffmpeg can read with range requests.
+    :param info: output of encoder.probe_media, None to go straight to the whole video.
+    :param on_field: optional callable(name, value) called as each summary field completes.
+    :param output_path: where working files are named after, defaults to source.
+    :param upload: callable() -> GCS object holding the whole video under the
+        GCS limit, defaults to compressing and uploading source.
+    :return: (GCS object or None when summarized in segments, parsed summary content)
+    """
+    size_upper_bound = config.GCS_MAX_FILE_SIZE * 1024
+    output_base = os.path.splitext(output_path or source)[0]
+    prepared = None
+    if info and audio_first.should_use_audio_path(info, mode=config.AUDIO_FIRST_MODE):
+        with metrics.stage("audio_first") as record:
+            record["bytes_in"] = info["size"]
+            prepared = audio_first.prepare(
+                source, info, size_upper_bound, output_base=output_base
+            )
+            record["bytes_out"] = prepared["bytes"] if prepared else 0
+    elif (
+        info
+        and config.MODEL_INPUT_PROFILE
+        and not segments.should_segment(info, size_upper_bound)
+    ):
+        with metrics.stage("preprocess") as record:
+            record["bytes_in"] = info["size"]
+            record["profile"] = config.MODEL_INPUT_PROFILE
+            prepared = preprocess.prepare(
+                source, info, size_upper_bound, output_base=output_base
+            )
+            record["bytes_out"] = prepared["bytes"] if prepared else 0
+    if prepared:
+        return summarize_prepared(prepared, on_field)
+    if info and segments.should_segment(info, size_upper_bound):
+        return None, segments.map_reduce(
+            source,
+            info,
+            size_upper_bound,
+            summarize_segment,
+            lambda prompt: parse_html_tags(get_text_summary(prompt)),
+            output_path=output_path,
+        )
+    blob_name = upload() if upload else compress_and_upload(source)
+    return blob_name, summarize_media([(blob_name, "video/mp4")], on_field=on_field)
 
 
-def download_or_delete_from_dropbox(download=True, delete=False):
+def download_or_delete_from_dropbox(download=True, delete=False, stream=None):
     """Download or delete files from dropbox"""
+    stream = config.DROPBOX_STREAM_DOWNLOADS if stream is None else stream
     tmp_filename = "/tmp/video.mp4"
-    dbx = dropbox.Dropbox(
-        oauth2_refresh_token=config.SECRETS["DROPBOX_REFRESH_TOKEN"],
-        app_key=config.SECRETS["DROPBOX_CLIENT_ID"],
-        app_secret=config.SECRETS["DROPBOX_CLIENT_SECRET"],
-    )
-    result = dbx.files_list_folder("", recursive=True)
-    for entry in result.entries:
+    dbx = get_dropbox_client()
+    entries, _ = dropbox_sync.list_folder(dbx)
+    for entry in entries:
         file_nm = entry.path_display
         tmp_filename, file_extension = os.path.splitext(entry.path_display)
         tmp_filename = "/tmp/video" + file_extension
-        if any(
-            x in file_nm.lower()
-            for x in [".mp4", ".mov", ".avi", ".mkv", ".wmv", ".flv", ".m4a", ".mp3"]
-        ):
+        if is_media_entry(entry):
             if download:
-                with open(tmp_filename, "wb") as f:
-                    metadata, res = dbx.files_download(path=file_nm)
-                    f.write(res.content)
+                download_from_dropbox(dbx, file_nm, tmp_filename, stream)
             if delete:
                 dbx.files_delete(file_nm)
     return tmp_filename
 
 
+def download_from_dropbox(dbx, path, local_path, stream=None):
+    """Download one Dropbox file to local_path"""
+    stream = config.DROPBOX_STREAM_DOWNLOADS if stream is None else stream
+    with metrics.stage("dropbox_download") as record:
+        if stream:
+            dropbox_sync.stream_download(dbx, path, local_path)
+        else:
+            with open(local_path, "wb") as f:
+                metadata, res = dbx.files_download(path=path)
+                f.write(res.content)
+        record["bytes_in"] = os.path.getsize(local_path)
+
+
+def delete_from_dropbox(dbx, path):
+    """Delete a file, tolerating another invocation having deleted it first"""
+    import dropbox
+
+    try:
+        dbx.files_delete(path)
+    except dropbox.exceptions.ApiError as e:
+        if not (e.error.is_path_lookup() and e.error.get_path_lookup().is_not_found()):
+            raise
+
+
+def working_filename(entry, workspace=None):
+    """Give each Dropbox entry its own file, inside its workspace when it has one"""
+    _, file_extension = os.path.splitext(entry.path_display)
+    filename = "video_{}{}".format(entry.id.replace("id:", ""), file_extension)
+    if workspace is not None:
+        return workspace.path(filename)
+    return os.path.join("/tmp", filename)
+
+
+def stream_to_gcs(content_hash, size, name, transcode):
+    """
+    Stream a source through ffmpeg into GCS unless an earlier run already did.
+    :param content_hash: content hash of the source, keys the blob.
+    :param size: source size in bytes.
+    :param name: what to call the source in errors.
+    :param transcode: callable(blob_name) -> pipeline stats, or None if it can't fit.
+    :return: the GCS object
+    """
+    blob_name = gcs_upload.source_blob_name(content_hash)
+    # Output is only finalized under the limit, but objects written before that
+    # was enforced may not be
+    if gcs_upload.blob_exists(
+        blob_name, max_bytes=config.GCS_MAX_FILE_SIZE * 1024 * 1024
+    ):
+        gcs_upload.record_upload(skipped=size)
+    else:
+        with metrics.stage("pipeline_transcode") as record:
+            record["bytes_in"] = size
+            stats = transcode(blob_name)
+            record["bytes_out"] = stats["bytes_out"] if stats else 0
+        if stats is None:
+            raise ValueError("Unable to fit {} under the GCS limit".format(name))
+        gcs_upload.record_upload(
+            uploaded=stats["bytes_out"], seconds=stats["upload_seconds"]
+        )
+    return blob_name
+
+
+def summarize_stream(content_hash, size, name, transcode):
+    """
+    Stream a source through ffmpeg into GCS and summarize it.
+    :param content_hash: content hash of the source, keys the blob and the cache.
+    :param size: source size in bytes.
+    :param name: what to call the source in errors.
+    :param transcode: callable(blob_name) -> pipeline stats, or None if it can't fit.
+    :return: parsed summary content
+    """
+    start = time.monotonic()
+    blob_name = stream_to_gcs(content_hash, size, name, transcode)
+    summary_content = summarize_media([(blob_name, "video/mp4")])
+    summary_cache.get_summary_cache().put(
+        content_hash,
+        summary_content,
+        gcs_object=blob_name,
+        seconds=time.monotonic() - start,
+    )
+    return summary_content
+
+
+def summarize_dropbox_stream(dbx, entry):
+    """Stream an entry from Dropbox through ffmpeg into GCS and summarize it"""
+    return summarize_stream(
+        entry.content_hash,
+        entry.size,
+        entry.path_display,
+        lambda blob_name: pipeline.transcode_dropbox_to_gcs(dbx, entry, blob_name),
+    )
+
+
+def summarize_dropbox_link(dbx, entry):
+    """
+    Summarize an entry too big to download into scratch from a temporary link.
+    It takes the same audio-first, profile and segment paths as a download:
+    ffmpeg reads the link with range requests, and segments are cut one at a
+    time, so only the working files need scratch space. Without room even for
+    those, the whole video is streamed into one upload.
+    :return: parsed summary content
+    """
+    size_upper_bound = config.GCS_MAX_FILE_SIZE * 1024
+    workspace = scratch.get_scratch_space().workspace(
+        entry.id.replace("id:", ""),
+        size_upper_bound
+        * 1024
+        * config.SCRATCH_SIZE_FACTOR
+        * max(1, config.SEGMENT_MAX_WORKERS),
+    )
+    if workspace is None:
+        logging.info(
+            "%s No scratch space for working files of %s, streaming it whole",
+            datetime.fromtimestamp(time.time()).strftime("%Y%m%d%H%M%S"),
+            entry.path_display,
+        )
+        return summarize_dropbox_stream(dbx, entry)
+
+    logging.info(
+        "%s %s (%s bytes) is too big for scratch, summarizing it from a temporary link",
+        datetime.fromtimestamp(time.time()).strftime("%Y%m%d%H%M%S"),
+        entry.path_display,
+        entry.size,
+    )
+    start = time.monotonic()
+    with workspace:
+        link = dbx.files_get_temporary_link(entry.path_display).link
+        blob_name, summary_content = summarize_source(
+            link,
+            encoder.probe_media(link),
+            output_path=working_filename(entry, workspace),
+            upload=lambda: stream_to_gcs(
+                entry.content_hash,
+                entry.size,
+                entry.path_display,
+                lambda blob_name: pipeline.transcode_dropbox_to_gcs(
+                    dbx, entry, blob_name
+                ),
+            ),
+        )
+    summary_cache.get_summary_cache().put(
+        entry.content_hash,
+        summary_content,
+        gcs_object=blob_name,
+        seconds=time.monotonic() - start,
+    )
+    return summary_content
+
+
+def s3_event_objects(event):
+    """(bucket, key, size, etag) for every media object an S3 ObjectCreated event names"""
+    objects = []
+    for record in event.get("Records", []):
+        if record.get("eventSource") != "aws:s3":
+            continue
+        if not record.get("eventName", "").startswith("ObjectCreated"):
+            continue
+        # Keys arrive URL-encoded, with spaces as "+"
+        key = urllib.parse.unquote_plus(record["s3"]["object"]["key"])
+        if os.path.splitext(key)[1].lower() not in config.MEDIA_EXTENSIONS:
+            continue
+        objects.append(
+            (
+                record["s3"]["bucket"]["name"],
+                key,
+                int(record["s3"]["object"].get("size", 0)),
+                record["s3"]["object"].get("eTag", "").strip('"'),
+            )
+        )
+    return objects
+
+
+def process_s3_object(bucket, key, size, etag):
+    """Summarize one S3 object into Notion, reading it straight from S3"""
+    # ETags are stable per upload of the same bytes, which is all the cache needs
+    content_hash = "s3-{}".format(etag.replace("-", "x"))
+    cached = summary_cache.get_summary_cache().get(content_hash)
+    if cached:
+        return create_notion_page(cached["summary"])
+    summary_content = summarize_stream(
+        content_hash,
+        size,
+        "s3://{}/{}".format(bucket, key),
+        lambda blob_name: pipeline.transcode_s3_to_gcs(bucket, key, size, blob_name),
+    )
+    return create_notion_page(summary_content)
+
+
+def process_s3_event(event, max_workers=None):
+    """
+    Process the objects of an S3 ObjectCreated event concurrently.
+    S3 can deliver an event more than once, so each object version is leased
+    and recorded as done like Dropbox files are.
+    :return: dict with the Notion urls created and the objects that failed or were skipped
+    """
+    max_workers = config.S3_EVENT_MAX_WORKERS if max_workers is None else max_workers
+    gcs_upload.reset_upload_stats()
+    summary_cache.get_summary_cache().reset_stats()
+    leases = dedupe.get_leases() if config.DEDUPE_ENABLED else None
+    owner = uuid.uuid4().hex
+    processed = {"urls": [], "failed": [], "skipped": []}
+    claimed = {}
+    for bucket, key, size, etag in s3_event_objects(event):
+        path = "s3://{}/{}".format(bucket, key)
+        lease_key = "s3/{}/{}@{}".format(bucket, key, etag)
+        if leases and not leases.claim(lease_key, owner, config.DEDUPE_LEASE_SECONDS):
+            processed["skipped"].append(path)
+            continue
+        claimed[(bucket, key, size, etag)] = (path, lease_key)
+
+    with notification_digest(), ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(process_s3_object, *obj): names
+            for obj, names in claimed.items()
+        }
+        for future in as_completed(futures):
+            path, lease_key = futures[future]
+            try:
+                url = future.result()
+            except Exception:
+                logging.exception(
+                    "%s Failed to process %s",
+                    datetime.fromtimestamp(time.time()).strftime("%Y%m%d%H%M%S"),
+                    path,
+                )
+                processed["failed"].append(path)
+                if leases:
+                    leases.release(lease_key, owner)
+                continue
+            processed["urls"].append(url)
+            if leases:
+                leases.complete(lease_key, owner, url)
+    processed["cache"] = summary_cache.get_summary_cache().stats()
+    processed["gcs"] = gcs_upload.upload_stats()
+    return processed
+
+
+def notification_digest():
+    """Batch runs send one notification covering all their summaries"""
+    if not config.NOTIFICATION_DIGEST:
+        return contextlib.nullcontext()
+    return config.NOTIFIER.digest(title="Notion video summaries")
+
+
+def process_dropbox_entry(dbx, entry):
+    """Run the download, compress, summarize and Notion chain for one entry"""
+    return create_notion_page(summarize_dropbox_entry(dbx, entry))
+
+
+def summarize_dropbox_entry(dbx, entry):
+    """Run the download, compress and summarize chain for one entry"""
+    # A cache hit skips the download as well as Gemini
+    cached = summary_cache.get_summary_cache().get(entry.content_hash)
+    if cached:
+        return cached["summary"]
+
+    if config.PIPELINE_MODE:
+        return summarize_dropbox_stream(dbx, entry)
+
+    # Everything derived from the download (compressed copies, segments,
+    # audio, frames) is written next to it, so the workspace holds it all
+    workspace = scratch.get_scratch_space().workspace(
+        entry.id.replace("id:", ""), entry.size * config.SCRATCH_SIZE_FACTOR
+    )
+    if workspace is None:
+        # Too big for the ephemeral storage left; read it from Dropbox instead
+        return summarize_dropbox_link(dbx, entry)
+    with workspace:
+        filename = working_filename(entry, workspace)
+        download_from_dropbox(dbx, entry.path_display, filename)
+        return summarize_file(
+            filename, content_hash=entry.content_hash, cache_checked=True
+        )
+
+
+def process_dropbox_batch(max_workers=None, cursor_store=None):
+    """
+    Process every Dropbox media file added since the last run with a bounded worker pool.
+    :param max_workers: Max number of videos processed concurrently.
+    :param cursor_store: Where the list_folder cursor is persisted between runs.
+    :return: dict with the Notion urls created and the paths that failed
+    """
+    max_workers = config.BATCH_MAX_WORKERS if max_workers is None else max_workers
+    gcs_upload.reset_upload_stats()
+    summary_cache.get_summary_cache().reset_stats()
+    dbx = get_dropbox_client()
+    cursor_store = cursor_store or dropbox_sync.get_cursor_store()
+    changes, cursor = dropbox_sync.list_changes(dbx, cursor_store)
+    entries = [entry for entry in changes if is_media_entry(entry)]
+    logging.info(
+        "%s Processing %s Dropbox files with %s workers",
+        datetime.fromtimestamp(time.time()).strftime("%Y%m%d%H%M%S"),
+        len(entries),
+        max_workers,
+    )
+
+    processed = {"urls": [], "failed": [], "skipped": []}
+    leases = dedupe.get_leases() if config.DEDUPE_ENABLED else None
+    owner = uuid.uuid4().hex
+    claimed = []
+    # Leased elsewhere; kept pending so they're listed again if the holder dies
+    leased_elsewhere = []
+    for entry in entries:
+        if leases is None:
+            claimed.append(entry)
+        elif leases.result(dedupe.file_key(entry)):
+            # Already in Notion; an earlier run stopped before deleting it
+            processed["skipped"].append(entry.path_display)
+            delete_from_dropbox(dbx, entry.path_display)
+        elif leases.claim(dedupe.file_key(entry), owner, config.DEDUPE_LEASE_SECONDS):
+            claimed.append(entry)
+        else:
+            # Another invocation is working on this revision
+            processed["skipped"].append(entry.path_display)
+            leased_elsewhere.append(entry.path_display)
+
+    def failed(entry):
+        processed["failed"].append(entry.path_display)
+        if leases:
+            leases.release(dedupe.file_key(entry), owner)
+
+    # Workers only summarize; the pages are written together afterwards so
+    # the workers never wait on Notion's rate limit
+    page_batch = config.NOTION_WRITER.batch()
+    with notification_digest():
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                executor.submit(summarize_dropbox_entry, dbx, entry): entry
+                for entry in claimed
+            }
+            for future in as_completed(futures):
+                entry = futures[future]
+                try:
+                    page_batch.enqueue(future.result(), key=entry)
+                except Exception:
+                    logging.exception(
+                        "%s Failed to process %s",
+                        datetime.fromtimestamp(time.time()).strftime("%Y%m%d%H%M%S"),
+                        entry.path_display,
+                    )
+                    failed(entry)
+
+        for entry, url in flush_notion_pages(page_batch):
+            if isinstance(url, Exception):
+                logging.error(
+                    "%s Failed to create the Notion page for %s: %s",
+                    datetime.fromtimestamp(time.time()).strftime("%Y%m%d%H%M%S"),
+                    entry.path_display,
+                    url,
+                )
+                failed(entry)
+                continue
+            processed["urls"].append(url)
+            if leases:
+                leases.complete(dedupe.file_key(entry), owner, url)
+            # Only files that made it all the way to Notion are removed
+            delete_from_dropbox(dbx, entry.path_display)
+
+    dropbox_sync.commit_changes(
+        cursor_store, cursor, pending=processed["failed"] + leased_elsewhere
+    )
+    processed["cache"] = summary_cache.get_summary_cache().stats()
+    processed["gcs"] = gcs_upload.upload_stats()
+    logging.info(
+        "%s Summary cache: %s, GCS uploads: %s",
+        datetime.fromtimestamp(time.time()).strftime("%Y%m%d%H%M%S"),
+        processed["cache"],
+        processed["gcs"],
+    )
+    return processed
+
+
 def lambda_handler(event, context):
     """Lambda function handler"""
-    api_key = event.get("headers", {}).get("api-key")
+    metrics.start_invocation()
+    # Built up front so it captures this invocation's records from the start
+    shipper = config.LOG_SHIPPER if config.LOG_SHIPPING_ENABLED else None
+    start_scratch()
+    gemini_client.limit_to_invocation(context)
+    try:
+        return handle_request(event)
+    finally:
+        metrics.emit(
+            request_id=getattr(context, "aws_request_id", None),
+            scratch=scratch.get_scratch_space().stats(),
+        )
+        config.drain_notifications()
+        if shipper:
+            shipper.flush()
+
+
+def start_scratch():
+    """
+    Clear what earlier invocations of this container left in /tmp and start
+    the scratch high-water marks over. Lambda runs one invocation per
+    container at a time, so anything not owned by a live process is stale,
+    typically from an invocation that hit the timeout.
+    """
+    space = scratch.get_scratch_space()
+    space.reset_stats()
+    space.sweep(legacy_patterns=config.SCRATCH_LEGACY_PATTERNS)
+
+
+def process_dropbox(payload=None):
+    """Run the Dropbox -> Notion flow, also the handler for "dropbox" jobs"""
+    if not config.DEDUPE_ENABLED:
+        return sync_dropbox()
+    # Dropbox sends bursts of webhooks per upload; one sync covers them all
+    results = dedupe.coalesced("sync/dropbox", sync_dropbox)
+    if not results:
+        return {"coalesced": True}
+    return results[0] if len(results) == 1 else {"runs": results}
+
+
+def sync_dropbox():
+    """One pass over the Dropbox folder"""
+    if config.DROPBOX_BATCH_MODE:
+        return process_dropbox_batch()
+
+    filename = download_or_delete_from_dropbox(download=True, delete=False)
+    try:
+        summary_content = summarize_file(filename)
+        notion_response = create_notion_page(summary_content)
+    finally:
+        if os.path.exists(filename):
+            os.remove(filename)
+    download_or_delete_from_dropbox(download=False, delete=True)
+    return notion_response
+
+
+JOB_HANDLERS = {"dropbox": process_dropbox}
+
+
+def handle_request(event):
+    """Authenticate the request and run the Dropbox -> Notion flow"""
+    # S3 triggers invoke the function directly, there is no API key to check
+    if any(r.get("eventSource") == "aws:s3" for r in event.get("Records", [])):
+        processed = process_s3_event(event)
+        if processed["failed"]:
+            # Let Lambda's async retry have another go at the failed objects
+            raise RuntimeError("Failed to process {}".format(processed["failed"]))
+        return {"statusCode": 200, "body": json.dumps(processed)}
+
+    api_key = (event.get("headers") or {}).get("api-key")
 
     # Check if the API key is present
     if api_key is None:
         return {"statusCode": 400, "body": "Missing API key"}
     elif api_key == config.SECRETS["API_KEY"]:
-        notion_response = {}
-        filename = download_or_delete_from_dropbox(download=True, delete=False)
-        compress_and_upload(filename)
-        summary = get_video_summary(filename)
-        summary_content = parse_html_tags(summary)
-        notion_response = create_notion_page(summary_content)
-        download_or_delete_from_dropbox(download=False, delete=True)
+        job_id = (event.get("queryStringParameters") or {}).get("job_id")
+        if job_id:
+            job = jobs.get_job_store().get(job_id)
+            if job is None:
+                return {"statusCode": 404, "body": "Unknown job"}
+            return {"statusCode": 200, "body": json.dumps(job)}
+
+        if config.JOB_MODE:
+            job = jobs.submit("dropbox")
+            return {
+                "statusCode": 202,
+                "body": json.dumps({"job_id": job["job_id"], "status": job["status"]}),
+            }
 
         return {
             "statusCode": 200,
-            "body": json.dumps(notion_response),
+            "body": json.dumps(process_dropbox()),
         }
     else:
         return {"statusCode": 401, "body": "Invalid API key"}
+
+
+def worker_handler(event, context):
+    """
+    Worker entry point for jobs submitted in JOB_MODE.
+    Runs the jobs in an SQS event, or drains the configured queue when invoked
+    any other way, e.g. on a schedule or locally.
+    """
+    shipper = config.LOG_SHIPPER if config.LOG_SHIPPING_ENABLED else None
+    start_scratch()
+    gemini_client.limit_to_invocation(context)
+    try:
+        job_ids = jobs.job_ids_from_event(event or {})
+        if job_ids:
+            finished = [jobs.run_job(job_id, JOB_HANDLERS) for job_id in job_ids]
+        else:
+            finished = jobs.drain(JOB_HANDLERS, max_jobs=config.JOB_WORKER_MAX_JOBS)
+        return {
+            "jobs": [
+                {"job_id": job["job_id"], "status": job["status"]}
+                for job in finished
+                if job
+            ]
+        }
+    finally:
+        config.drain_notifications()
+        if shipper:
+            shipper.flush()
@@ -1,13 +1,16 @@
+import gzip
 import io
 import json
 import logging
 import os
 import sys
-import boto3
+import threading
+import time
+import uuid
 import config
 
 
-def get_string_io_logger(log_stringio_obj, logger_name):
+def get_string_io_logger(log_stringio_obj, logger_name, console=True):
     # create logger
     logger = logging.getLogger(logger_name)
     formatter = logging.Formatter(
@@ -15,10 +18,12 @@ def get_string_io_logger(log_stringio_obj, logger_name):
     )
     logger.setLevel(logging.INFO)
 
-    # add normal steam handler to display logs on screen
-    io_log_handler = logging.StreamHandler()
-    io_log_handler.setFormatter(formatter)
-    logger.addHandler(io_log_handler)
+    # add normal steam handler to display logs on screen, unless the logger
+    # already has one (e.g. the root logger in Lambda)
+    if console:
+        io_log_handler = logging.StreamHandler()
+        io_log_handler.setFormatter(formatter)
+        logger.addHandler(io_log_handler)
 
     # create stream handler and initialise it with string io buffer
     string_io_log_handler = logging.StreamHandler(log_stringio_obj)
@@ -64,8 +69,8 @@ def rename_file(key, backup_key, backup_strategy):
 def put_content_to_s3(
     s3_path,
     content,
-    s3_client=config.S3_CLIENT,
-    s3_resource=config.S3_RESOURCE,
+    s3_client=None,
+    s3_resource=None,
     region_name="us-east-1",
     backup_key=None,
     backup_strategy="file",
@@ -76,8 +81,8 @@ def put_content_to_s3(
             s3_path {str} -- s3 path
             content {str} -- string content to be put into s3
     Keyword Arguments:
-            s3_client {boto3.client.s3} (default: {None'})-- boto3 client for s3 , new client will be created if not provided
-            s3_resource {boto3.resource.s3} (default: {None'}) -- boto3 resource for s3 , new resource will be created if not provided
+            s3_client {boto3.client.s3} (default: {None'})-- boto3 client for s3 , config.S3_CLIENT is used if not provided
+            s3_resource {boto3.resource.s3} (default: {None'}) -- boto3 resource for s3 , config.S3_RESOURCE is used if not provided
             region_name {str}(default: {'us-east-1'}) -- AWS region
             backup_key {str} (default: {None}) -- backup key name, if provided and if file already exists in given s3 path a backup of existing content will be taken in same s3 path appedning the sepcified backup_key at the end of file name
     Returns:
@@ -88,19 +93,13 @@ def put_content_to_s3(
         # create s3 client for given s3 path
         bucket = s3_path.split("/")[2]
         key = "/".join(s3_path.split("/")[3:])
-        if not s3_client:
-            s3_client_ = boto3.client("s3", region_name)
-        else:
-            s3_client_ = s3_client
+        s3_client_ = s3_client or config.S3_CLIENT
 
         # if backup_key is specified take backup of old content
         if backup_key:
             results = s3_client_.list_objects(Bucket=bucket, Prefix=key)
             if "Contents" in results:
-                if not s3_resource:
-                    s3_resource_ = boto3.resource("s3", region_name)
-                else:
-                    s3_resource_ = s3_resource
+                s3_resource_ = s3_resource or config.S3_RESOURCE
                 old_content = (
                     s3_resource_.Object(bucket, key)
                     .get()["Body"]
@@ -126,3 +125,253 @@ def put_content_to_s3(
         return_object["data"] = exception_message
     finally:
         return return_object
+
+
+def get_content_from_s3(s3_path, s3_client=None, region_name="us-east-1"):
+    """
+    Function to get string content from s3 for a given s3 path and region
+    Arguments:
+            s3_path {str} -- s3 path
+    Keyword Arguments:
+            s3_client {boto3.client.s3} (default: {None'})-- boto3 client for s3 , config.S3_CLIENT is used if not provided
+            region_name {str}(default: {'us-east-1'}) -- AWS region
+    Returns:
+            return_object {dict} -- return_object['data'] {str} -- object content, empty if the object does not exist, or error message if return_object['success'] is False
+    """
+    return_object = {"success": True, "data": ""}
+    try:
+        bucket = s3_path.split("/")[2]
+        key = "/".join(s3_path.split("/")[3:])
+        s3_client_ = s3_client or config.S3_CLIENT
+
+        try:
+            response = s3_client_.get_object(Bucket=bucket, Key=key)
+        except s3_client_.exceptions.NoSuchKey:
+            return return_object
+        return_object["data"] = response["Body"].read().decode("utf-8")
+
+    except Exception as e:
+        return_object["success"] = False
+        exception_message = "message: {0}\nline no:{1}\n".format(
+            str(e), sys.exc_info()[2].tb_lineno
+        )
+        return_object["data"] = exception_message
+    finally:
+        return return_object
+
+
+class _FlushTrigger(logging.Handler):
+    """Runs after the string io handler so the shipper can check its bounds"""
+
+    def __init__(self, shipper):
+        super().__init__()
+        self.shipper = shipper
+
+    def emit(self, record):
+        self.shipper.maybe_flush()
+
+
+class S3LogShipper:
+    """
+    Buffer log records in memory and ship them to S3 as immutable segments.
+    Segments are written under time partitions, prefix/dt=YYYY-MM-DD/hour=HH/,
+    and are never read or rewritten on the write path, so the cost of a write
+    doesn't grow with the log's history. A segment is shipped once the buffer
+    reaches max_bytes or its oldest record is max_seconds old (checked as
+    records arrive), and on flush() at the end of every invocation.
+    """
+
+    def __init__(
+        self,
+        s3_prefix,
+        logger_name=None,
+        s3_client=None,
+        max_bytes=None,
+        max_seconds=None,
+        compress=None,
+        console=True,
+    ):
+        """
+        Arguments:
+                s3_prefix {str} -- s3 path segments are written under, e.g. s3://bucket/logs/
+        Keyword Arguments:
+                logger_name {str} (default: {None}) -- logger to ship, the root logger if None
+                s3_client {boto3.client.s3} (default: {None}) -- config.S3_CLIENT is used if not provided
+                console {bool} (default: {True}) -- also log to stderr, pass False if the logger already does
+        """
+        self.s3_prefix = s3_prefix.rstrip("/") + "/"
+        self.s3_client = s3_client
+        self.max_bytes = (
+            max_bytes if max_bytes is not None else config.LOG_SEGMENT_MAX_BYTES
+        )
+        self.max_seconds = (
+            max_seconds if max_seconds is not None else config.LOG_SEGMENT_MAX_SECONDS
+        )
+        self.compress = compress if compress is not None else config.LOG_SEGMENT_GZIP
+        self.buffer = io.StringIO()
+        self.logger = get_string_io_logger(self.buffer, logger_name, console=console)
+        self._handler = next(
+            handler
+            for handler in self.logger.handlers
+            if getattr(handler, "stream", None) is self.buffer
+        )
+        self.logger.addHandler(_FlushTrigger(self))
+        self._lock = threading.Lock()
+        self._first_record = None
+        self._failed = []
+        self._flushing = threading.local()
+        self._sequence = 0
+        self.segments_written = 0
+
+    def maybe_flush(self):
+        """Ship the buffer if it is over its size or age bound"""
+        if getattr(self._flushing, "active", False):
+            # Records logged by the S3 client while shipping wait for the next segment
+            return
+        now = time.monotonic()
+        if self._first_record is None:
+            self._first_record = now
+        if (
+            self.buffer.tell() >= self.max_bytes
+            or now - self._first_record >= self.max_seconds
+        ):
+            self.flush()
+
+    def _take_buffer(self):
+        # Hold the handler's lock so no record is half-written into the swap
+        self._handler.acquire()
+        try:
+            content = self.buffer.getvalue()
+            self.buffer.seek(0)
+            self.buffer.truncate()
+            self._first_record = None
+        finally:
+            self._handler.release()
+        return content
+
+    def segment_key(self, timestamp):
+        """Time-partitioned, unique key for a new segment"""
+        with self._lock:
+            self._sequence += 1
+            sequence = self._sequence
+        return "{0}dt={1}/hour={2}/{3}-{4:06d}-{5}.log{6}".format(
+            "/".join(self.s3_prefix.split("/")[3:]),
+            time.strftime("%Y-%m-%d", timestamp),
+            time.strftime("%H", timestamp),
+            time.strftime("%Y%m%dT%H%M%SZ", timestamp),
+            sequence,
+            uuid.uuid4().hex[:8],
+            ".gz" if self.compress else "",
+        )
+
+    def flush(self):
+        """
+        Ship everything buffered as one new segment.
+        Returns:
+                return_object {dict} -- return_object['data'] {str} -- segment s3 path, or error message if return_object['success'] is False
+        """
+        return_object = {"success": True, "data": ""}
+        with self._lock:
+            pending, self._failed = self._failed, []
+        content = "".join(pending) + self._take_buffer()
+        if not content:
+            return return_object
+        self._flushing.active = True
+        try:
+            bucket = self.s3_prefix.split("/")[2]
+            key = self.segment_key(time.gmtime())
+            body = content.encode("utf-8")
+            if self.compress:
+                body = gzip.compress(body)
+            s3_put_response = (self.s3_client or config.S3_CLIENT).put_object(
+                Body=body, Bucket=bucket, Key=key
+            )
+            if s3_put_response["ResponseMetadata"]["HTTPStatusCode"] != 200:
+                raise Exception("Unable to put data to s3: {0}".format(s3_put_response))
+            self.segments_written += 1
+            return_object["data"] = "s3://{0}/{1}".format(bucket, key)
+        except Exception as e:
+            # Keep the records for the next flush rather than losing them
+            with self._lock:
+                self._failed.insert(0, content)
+            return_object["success"] = False
+            return_object["data"] = "message: {0}\nline no:{1}\n".format(
+                str(e), sys.exc_info()[2].tb_lineno
+            )
+        finally:
+            self._flushing.active = False
+        return return_object
+
+
+def read_log_segment(s3_client, bucket, key):
+    """Text of one segment, decompressing .gz segments"""
+    body = s3_client.get_object(Bucket=bucket, Key=key)["Body"].read()
+    if key.endswith(".gz"):
+        body = gzip.decompress(body)
+    return body.decode("utf-8")
+
+
+def compact_log_segments(s3_prefix, s3_client=None, delete=True, compress=True):
+    """
+    Offline utility merging every segment under a partition into one object.
+    Segment keys start with their UTC timestamp, so key order is log order.
+    Arguments:
+            s3_prefix {str} -- partition to compact, e.g. s3://bucket/logs/dt=2024-01-31/
+    Keyword Arguments:
+            s3_client {boto3.client.s3} (default: {None}) -- config.S3_CLIENT is used if not provided
+            delete {bool} (default: {True}) -- delete the merged segments once the compacted object is written
+    Returns:
+            return_object {dict} -- return_object['data'] {dict} -- compacted path and segment count, or error message if return_object['success'] is False
+    """
+    return_object = {"success": True, "data": {"path": None, "segments": 0}}
+    try:
+        bucket = s3_prefix.split("/")[2]
+        prefix = "/".join(s3_prefix.split("/")[3:])
+        s3_client_ = s3_client or config.S3_CLIENT
+
+        keys = []
+        for page in s3_client_.get_paginator("list_objects_v2").paginate(
+            Bucket=bucket, Prefix=prefix
+        ):
+            keys.extend(obj["Key"] for obj in page.get("Contents", []))
+        # Leave earlier compactions alone so re-running is safe
+        keys = sorted(
+            key for key in keys if not os.path.basename(key).startswith("compacted-")
+        )
+        if not keys:
+            return return_object
+
+        content = "".join(read_log_segment(s3_client_, bucket, key) for key in keys)
+        body = content.encode("utf-8")
+        compacted_key = "{0}/compacted-{1}-{2}.log{3}".format(
+            prefix.rstrip("/"),
+            os.path.basename(keys[0]).split(".")[0],
+            os.path.basename(keys[-1]).split(".")[0],
+            ".gz" if compress else "",
+        )
+        s3_client_.put_object(
+            Body=gzip.compress(body) if compress else body,
+            Bucket=bucket,
+            Key=compacted_key,
+        )
+        if delete:
+            for start in range(0, len(keys), 1000):
+                s3_client_.delete_objects(
+                    Bucket=bucket,
+                    Delete={
+                        "Objects": [{"Key": key} for key in keys[start : start + 1000]]
+                    },
+                )
+        return_object["data"] = {
+            "path": "s3://{0}/{1}".format(bucket, compacted_key),
+            "segments": len(keys),
+        }
+
+    except Exception as e:
+        return_object["success"] = False
+        exception_message = "message: {0}\nline no:{1}\n".format(
+            str(e), sys.exc_info()[2].tb_lineno
+        )
+        return_object["data"] = exception_message
+    finally:
+        return return_object
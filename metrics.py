@@ -0,0 +1,167 @@
+import contextlib
+import functools
+import json
+import resource
+import threading
+import time
+from collections import deque
+
+import config
+
+# Stage records for the current invocation, and wall times of every stage seen
+# by this container, kept across warm invocations for the percentiles
+_RECORDS = []
+_HISTORY = {}
+_LOCK = threading.Lock()
+
+
+def peak_memory_mb():
+    """Peak resident set size of this process in MB"""
+    # ru_maxrss is reported in KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class _Discard(dict):
+    """Record handed out while metrics are disabled; writes go nowhere"""
+
+    def __setitem__(self, key, value):
+        pass
+
+
+_DISABLED = contextlib.nullcontext(_Discard())
+
+
+class _Stage:
+    def __init__(self, name):
+        self.record = {"stage": name, "bytes_in": 0, "bytes_out": 0}
+
+    def __enter__(self):
+        self._wall = time.perf_counter()
+        # Per-thread CPU, so batch workers don't count each other's time.
+        # ffmpeg runs in a child process and shows up in wall time only.
+        self._cpu = time.thread_time()
+        return self.record
+
+    def __exit__(self, exc_type, exc, tb):
+        self.record["wall_seconds"] = time.perf_counter() - self._wall
+        self.record["cpu_seconds"] = time.thread_time() - self._cpu
+        self.record["peak_rss_mb"] = peak_memory_mb()
+        self.record["ok"] = exc_type is None
+        with _LOCK:
+            _RECORDS.append(self.record)
+            history = _HISTORY.get(self.record["stage"])
+            if history is None:
+                history = _HISTORY[self.record["stage"]] = deque(
+                    maxlen=config.METRICS_HISTORY_SIZE
+                )
+            history.append(self.record["wall_seconds"])
+        return False
+
+
+def stage(name):
+    """
+    Time a block as one stage of the invocation.
+    The yielded dict takes bytes_in/bytes_out and any other fields to report:
+        with metrics.stage("gcs_upload") as record:
+            record["bytes_out"] = size
+    """
+    if not config.METRICS_ENABLED:
+        return _DISABLED
+    return _Stage(name)
+
+
+def timed(name):
+    """Decorator form of stage() for functions that are a stage as a whole"""
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def start_invocation():
+    """Drop stage records left over from the previous invocation"""
+    with _LOCK:
+        del _RECORDS[:]
+
+
+def records():
+    """Copies of the stage records of the current invocation"""
+    with _LOCK:
+        return [dict(record) for record in _RECORDS]
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a non-empty list"""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def histograms():
+    """p50/p95/p99 wall time per stage over this container's recent invocations"""
+    with _LOCK:
+        history = {name: list(values) for name, values in _HISTORY.items()}
+    return {
+        name: {
+            "count": len(values),
+            "p50": percentile(values, 0.50),
+            "p95": percentile(values, 0.95),
+            "p99": percentile(values, 0.99),
+        }
+        for name, values in history.items()
+    }
+
+
+def invocation_record(**properties):
+    """
+    Build the invocation's CloudWatch Embedded Metric Format record.
+    Each stage contributes <stage>.WallSeconds, .CpuSeconds, .BytesIn and
+    .BytesOut, with one value per time the stage ran.
+    https://docs.aws.amazon.com/AmazonCloudWatch/latest/monitoring/CloudWatch_Embedded_Metric_Format_Specification.html
+    """
+    with _LOCK:
+        records = list(_RECORDS)
+    record = {"stages": records, "histograms": histograms()}
+    record.update(properties)
+    definitions = []
+    for field, metric, unit in (
+        ("wall_seconds", "WallSeconds", "Seconds"),
+        ("cpu_seconds", "CpuSeconds", "Seconds"),
+        ("bytes_in", "BytesIn", "Bytes"),
+        ("bytes_out", "BytesOut", "Bytes"),
+    ):
+        for name in sorted({r["stage"] for r in records}):
+            key = "{}.{}".format(name, metric)
+            record[key] = [r[field] for r in records if r["stage"] == name]
+            definitions.append({"Name": key, "Unit": unit})
+    record["PeakRssMB"] = peak_memory_mb()
+    definitions.append({"Name": "PeakRssMB", "Unit": "Megabytes"})
+    record["_aws"] = {
+        "Timestamp": int(time.time() * 1000),
+        "CloudWatchMetrics": [
+            {
+                "Namespace": config.METRICS_NAMESPACE,
+                "Dimensions": [[]],
+                "Metrics": definitions,
+            }
+        ],
+    }
+    return record
+
+
+def emit(**properties):
+    """
+    Print the invocation record to stdout, where Lambda picks up EMF records.
+    :param properties: extra fields to attach, e.g. request_id.
+    :return: the record, or None when metrics are disabled
+    """
+    if not config.METRICS_ENABLED:
+        return None
+    record = invocation_record(**properties)
+    print(json.dumps(record, default=str))
+    return record
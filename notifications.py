@@ -0,0 +1,282 @@
+import http.client
+import logging
+import queue
+import threading
+import time
+import urllib.parse
+from contextlib import contextmanager
+from datetime import datetime
+
+import config
+import rate_limit
+
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+# Pushover rejects messages over 1024 characters
+# https://pushover.net/api#limits
+MESSAGE_LIMIT = 1024
+
+
+class ConnectionPool:
+    """
+    Keep-alive HTTP(S) connections to one host. A connection goes back to the
+    pool once its response has been read, and is dropped on any error.
+    """
+
+    def __init__(self, url, size=None, timeout=None):
+        size = config.NOTIFICATION_POOL_SIZE if size is None else size
+        parsed = urllib.parse.urlsplit(url)
+        self.scheme = parsed.scheme
+        self.host = parsed.hostname
+        self.port = parsed.port
+        self.timeout = timeout or config.NOTIFICATION_TIMEOUT
+        self._idle = queue.LifoQueue(maxsize=size)
+        self.connections_opened = 0
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        connection_class = (
+            http.client.HTTPSConnection
+            if self.scheme == "https"
+            else http.client.HTTPConnection
+        )
+        with self._lock:
+            self.connections_opened += 1
+        return connection_class(self.host, self.port, timeout=self.timeout)
+
+    def request(self, method, path, body=None, headers=None):
+        """
+        Send one request on a pooled connection.
+        :return: (status, response body)
+        """
+        try:
+            connection = self._idle.get_nowait()
+        except queue.Empty:
+            connection = self._connect()
+        try:
+            connection.request(method, path, body, headers or {})
+            response = connection.getresponse()
+            # Reading the body to the end is what frees the connection for reuse
+            data = response.read()
+        except Exception:
+            connection.close()
+            raise
+        if response.will_close:
+            connection.close()
+        else:
+            try:
+                self._idle.put_nowait(connection)
+            except queue.Full:
+                connection.close()
+        return response.status, data
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class PushoverSender:
+    """Posts messages to the Pushover API, retrying rate limits, server and connection errors"""
+
+    def __init__(
+        self,
+        token,
+        user,
+        url=None,
+        pool=None,
+        max_retries=None,
+        backoff_base=None,
+        backoff_max=None,
+    ):
+        url = config.PUSHOVER_URL if url is None else url
+        self.token = token
+        self.user = user
+        self.path = urllib.parse.urlsplit(url).path
+        self.pool = pool or ConnectionPool(url)
+        self.max_retries = (
+            max_retries if max_retries is not None else config.NOTIFICATION_MAX_RETRIES
+        )
+        self.backoff_base = (
+            backoff_base
+            if backoff_base is not None
+            else config.NOTIFICATION_BACKOFF_BASE
+        )
+        self.backoff_max = (
+            backoff_max if backoff_max is not None else config.NOTIFICATION_BACKOFF_MAX
+        )
+        self.retries = 0
+
+    def send(self, message, title=None):
+        """
+        Post one message.
+        :return: the HTTP status of the last attempt
+        """
+        fields = {"token": self.token, "user": self.user, "message": message}
+        if title:
+            fields["title"] = title
+        body = urllib.parse.urlencode(fields)
+        headers = {"Content-type": "application/x-www-form-urlencoded"}
+        for attempt in range(self.max_retries + 1):
+            try:
+                status, _ = self.pool.request("POST", self.path, body, headers)
+            except (OSError, http.client.HTTPException):
+                # Covers timeouts and keep-alive connections the server has closed
+                if attempt == self.max_retries:
+                    raise
+                status = None
+            if status is not None and status not in RETRYABLE_STATUSES:
+                return status
+            if attempt == self.max_retries:
+                return status
+            self.retries += 1
+            time.sleep(
+                rate_limit.backoff_delay(attempt, self.backoff_base, self.backoff_max)
+            )
+
+
+def digest_message(messages, limit=MESSAGE_LIMIT):
+    """One message listing many, cut to fit Pushover's limit with a count of the rest"""
+    lines = ["{} updates:".format(len(messages))]
+    for index, message in enumerate(messages):
+        rest = len(messages) - index - 1
+        # Leave room to say how many didn't fit
+        tail = ["+{} more".format(rest)] if rest else []
+        if len("\n".join(lines + ["- " + message] + tail)) > limit:
+            lines.append("+{} more".format(rest + 1))
+            break
+        lines.append("- " + message)
+    return "\n".join(lines)[:limit]
+
+
+class NotificationDispatcher:
+    """
+    Sends notifications from a background thread so callers never wait on
+    the network. Inside digest() blocks, e.g. around a batch run, messages
+    are collected and go out as one when the outermost block ends.
+    Lambda freezes background threads once the handler returns, so handlers
+    call drain() before returning.
+    """
+
+    def __init__(
+        self,
+        sender,
+        queue_size=None,
+        enabled=None,
+    ):
+        queue_size = (
+            config.NOTIFICATION_QUEUE_SIZE if queue_size is None else queue_size
+        )
+        self.sender = sender
+        self.enabled = enabled if enabled is not None else config.NOTIFICATIONS_ENABLED
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._digest_depth = 0
+        self._digest = []
+        self._worker = None
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        self.digests = 0
+
+    def notify(self, message, title=None):
+        """
+        Queue a message without blocking.
+        :return: True if it was queued or added to the current digest
+        """
+        if not self.enabled:
+            return False
+        with self._lock:
+            if self._digest_depth:
+                self._digest.append(message)
+                return True
+        return self._enqueue(message, title)
+
+    def _enqueue(self, message, title=None):
+        try:
+            self._queue.put_nowait((message, title))
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            logging.info(
+                "%s Notification queue full, dropping: %s",
+                datetime.fromtimestamp(time.time()).strftime("%Y%m%d%H%M%S"),
+                message,
+            )
+            return False
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, daemon=True)
+                self._worker.start()
+        return True
+
+    def _run(self):
+        while True:
+            message, title = self._queue.get()
+            try:
+                status = self.sender.send(message, title=title)
+                ok = status is not None and 200 <= status < 300
+            except Exception as e:
+                status, ok = e, False
+            with self._lock:
+                if ok:
+                    self.sent += 1
+                else:
+                    self.failed += 1
+            if not ok:
+                logging.info(
+                    "%s Notification failed (%s): %s",
+                    datetime.fromtimestamp(time.time()).strftime("%Y%m%d%H%M%S"),
+                    status,
+                    message,
+                )
+            self._queue.task_done()
+
+    @contextmanager
+    def digest(self, title=None):
+        """Collect the messages sent inside the block into one"""
+        with self._lock:
+            self._digest_depth += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._digest_depth -= 1
+                messages = []
+                if not self._digest_depth:
+                    messages, self._digest = self._digest, []
+            if len(messages) == 1:
+                self._enqueue(messages[0], title)
+            elif messages:
+                with self._lock:
+                    self.digests += 1
+                self._enqueue(digest_message(messages), title)
+
+    def drain(self, timeout=None):
+        """
+        Wait up to timeout seconds for queued notifications to be sent.
+        :return: True if the queue emptied in time
+        """
+        timeout = config.NOTIFICATION_DRAIN_SECONDS if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        # Queue.join has no timeout, so poll its unfinished count instead
+        while self._queue.unfinished_tasks:
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def stats(self):
+        with self._lock:
+            return {
+                "sent": self.sent,
+                "failed": self.failed,
+                "dropped": self.dropped,
+                "digests": self.digests,
+                "queued": self._queue.unfinished_tasks,
+                "retries": getattr(self.sender, "retries", 0),
+                "connections_opened": getattr(
+                    getattr(self.sender, "pool", None), "connections_opened", 0
+                ),
+            }
@@ -0,0 +1,247 @@
+import logging
+import threading
+import time
+from datetime import datetime
+
+import config
+import rate_limit
+
+# Notion rejects rich_text items over 2000 characters and arrays over 100 items
+# https://developers.notion.com/reference/request-limits
+RICH_TEXT_LIMIT = 2000
+RICH_TEXT_MAX_ITEMS = 100
+# Statuses Notion returns only for requests it did not apply. A timeout or a
+# 5xx may come after the page was created, and pages.create isn't idempotent,
+# so retrying those could write the page twice.
+# https://developers.notion.com/reference/status-codes
+NOT_APPLIED_STATUSES = {409, 429}
+
+
+def chunk_rich_text(text, limit=RICH_TEXT_LIMIT):
+    """
+    Split text into rich_text items under Notion's per-item limit.
+    Splits prefer line breaks, then spaces, so words and bullets stay whole.
+    """
+    items = []
+    while text and len(items) < RICH_TEXT_MAX_ITEMS:
+        if len(text) <= limit:
+            piece, text = text, ""
+        else:
+            # Keep the separator at the end of the piece it follows
+            end = text.rfind("\n", 0, limit) + 1
+            if end <= 1:
+                end = text.rfind(" ", 0, limit) + 1
+            if end <= 1:
+                end = limit
+            piece, text = text[:end], text[end:]
+        items.append({"text": {"content": piece}})
+    return items
+
+
+def render_analysis(value):
+    """Plain text for a parsed analysis: fields on their own lines, lists as bullets"""
+    if isinstance(value, dict):
+        return "\n\n".join(
+            "{}:\n{}".format(key, render_analysis(item))
+            for key, item in value.items()
+            if item
+        )
+    if isinstance(value, list):
+        return "\n".join("- {}".format(render_analysis(item)) for item in value)
+    return str(value).strip()
+
+
+def page_properties(summary_content, columns=None):
+    """
+    Notion page properties for a parsed summary, plus a rich_text property
+    per extra analysis in summary_content["ANALYSES"] (see config.VIDEO_PROMPTS)
+    :param columns: property names the database has; analyses whose property
+        isn't among them are left out, as Notion rejects the whole page otherwise.
+    """
+    properties = {
+        "Name": {
+            "title": chunk_rich_text(summary_content["TITLE"])[:1]
+            or [{"text": {"content": ""}}]
+        },
+        "Key points": {"rich_text": chunk_rich_text(summary_content["KEYPOINTS"])},
+        "Summary": {"rich_text": chunk_rich_text(summary_content["SUMMARY"])},
+        "Tags": {
+            # Notion also caps select option names at 100 characters
+            "multi_select": [{"name": tag[:100]} for tag in summary_content["TAGS"]]
+        },
+    }
+    for name, analysis in summary_content.get("ANALYSES", {}).items():
+        entry = config.VIDEO_PROMPTS.get(name)
+        if not entry or not entry.get("property"):
+            continue
+        if columns is not None and entry["property"] not in columns:
+            logging.info(
+                "%s Notion database has no %r property, leaving out the %s analysis",
+                datetime.fromtimestamp(time.time()).strftime("%Y%m%d%H%M%S"),
+                entry["property"],
+                name,
+            )
+            continue
+        properties[entry["property"]] = {
+            "rich_text": chunk_rich_text(render_analysis(analysis))
+        }
+    return properties
+
+
+def is_retryable(error):
+    """Rate limits and conflicts are retried, as Notion applied nothing"""
+    return (
+        getattr(error, "code", None) == "rate_limited"
+        or getattr(error, "status", None) in NOT_APPLIED_STATUSES
+    )
+
+
+def retry_after(error):
+    """Seconds Notion asked us to wait, if it said"""
+    headers = getattr(error, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class NotionWriter:
+    """
+    Rate-limited, retrying writer for Notion pages.
+    One writer per container shares a token bucket across threads, so batch
+    workers stay under Notion's ~3 requests/second together, and its single
+    client keeps the HTTP connection alive between pages.
+    """
+
+    def __init__(
+        self,
+        client,
+        database_id,
+        requests_per_second=None,
+        max_retries=None,
+        backoff_base=None,
+        backoff_max=None,
+    ):
+        requests_per_second = (
+            config.NOTION_REQUESTS_PER_SECOND
+            if requests_per_second is None
+            else requests_per_second
+        )
+        self.client = client
+        self.database_id = database_id
+        self.bucket = rate_limit.TokenBucket(requests_per_second, 1)
+        self.max_retries = (
+            max_retries if max_retries is not None else config.NOTION_MAX_RETRIES
+        )
+        self.backoff_base = (
+            backoff_base if backoff_base is not None else config.NOTION_BACKOFF_BASE
+        )
+        self.backoff_max = (
+            backoff_max if backoff_max is not None else config.NOTION_BACKOFF_MAX
+        )
+        self.pages_written = 0
+        self.retries = 0
+        self._columns = None
+        self._lock = threading.Lock()
+
+    def _call(self, method, **kwargs):
+        for attempt in range(self.max_retries + 1):
+            self.bucket.acquire()
+            try:
+                return method(**kwargs)
+            except Exception as e:
+                if attempt == self.max_retries or not is_retryable(e):
+                    raise
+                delay = retry_after(e) or rate_limit.backoff_delay(
+                    attempt, self.backoff_base, self.backoff_max
+                )
+                with self._lock:
+                    self.retries += 1
+                logging.info(
+                    "%s Notion request failed (%s), retrying in %.1fs",
+                    datetime.fromtimestamp(time.time()).strftime("%Y%m%d%H%M%S"),
+                    e,
+                    delay,
+                )
+                time.sleep(delay)
+
+    def columns(self):
+        """
+        Property names of the database, fetched once per writer.
+        :return: set of names, empty if the database couldn't be read
+        """
+        with self._lock:
+            if self._columns is not None:
+                return self._columns
+        try:
+            database = self._call(
+                self.client.databases.retrieve, database_id=self.database_id
+            )
+        except Exception as e:
+            logging.info(
+                "%s Could not read the Notion database schema: %s",
+                datetime.fromtimestamp(time.time()).strftime("%Y%m%d%H%M%S"),
+                e,
+            )
+            return set()
+        with self._lock:
+            self._columns = set(database.get("properties", {}))
+            return self._columns
+
+    def create_page(self, summary_content):
+        """Create one page now and return its response"""
+        # Only analyses need the schema; plain summaries skip the extra request
+        columns = self.columns() if summary_content.get("ANALYSES") else None
+        response = self._call(
+            self.client.pages.create,
+            parent={"database_id": self.database_id},
+            properties=page_properties(summary_content, columns),
+        )
+        with self._lock:
+            self.pages_written += 1
+        return response
+
+    def batch(self):
+        """A PageBatch writing through this writer"""
+        return PageBatch(self)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "pages_written": self.pages_written,
+                "retries": self.retries,
+            }
+
+
+class PageBatch:
+    """
+    Pages queued while a batch run summarizes, written together by flush.
+    Workers hand their summaries over instead of waiting on Notion's rate
+    limit themselves, and the pages go out one after another on one connection.
+    """
+
+    def __init__(self, writer):
+        self.writer = writer
+        self._pending = []
+        self._lock = threading.Lock()
+
+    def enqueue(self, summary_content, key=None):
+        """Queue a page for the next flush; key identifies it in the results"""
+        with self._lock:
+            self._pending.append((key, summary_content))
+
+    def flush(self):
+        """
+        Write every queued page at the writer's rate limit.
+        :return: list of (key, summary_content, response or the exception raised) in queue order
+        """
+        with self._lock:
+            pending, self._pending = self._pending, []
+        results = []
+        for key, summary_content in pending:
+            try:
+                response = self.writer.create_page(summary_content)
+            except Exception as e:
+                response = e
+            results.append((key, summary_content, response))
+        return results
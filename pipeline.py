@@ -0,0 +1,365 @@
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+import ffmpeg
+
+import config
+import encoder
+
+# ffmpeg cannot seek back into a pipe to write the moov atom, so streamed
+# output is fragmented mp4 with the header written up front.
+FRAGMENTED_MP4_FLAGS = "frag_keyframe+empty_moov+default_base_moof"
+
+
+class FileSink:
+    """Write the transcoded stream to a local file, standing in for GCS"""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "wb")
+
+    def write(self, data):
+        self._file.write(data)
+
+    def close(self):
+        self._file.close()
+
+    def abort(self):
+        self._file.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class GCSSink:
+    """Chunked resumable upload of the transcoded stream to a GCS blob"""
+
+    def __init__(self, blob_name, chunk_size=None):
+        chunk_size = (
+            config.PIPELINE_UPLOAD_CHUNK_SIZE if chunk_size is None else chunk_size
+        )
+        bucket = config.GCS_CLIENT.bucket(config.SECRETS["GCS_BUCKET_NAME"])
+        self.blob = bucket.blob(blob_name)
+        self._writer = self.blob.open(
+            "wb", chunk_size=chunk_size, content_type="video/mp4"
+        )
+
+    def write(self, data):
+        self._writer.write(data)
+
+    def close(self):
+        self._writer.close()
+
+    def abort(self):
+        # An unfinalized resumable session is discarded by GCS, nothing to delete
+        self._writer = None
+
+
+def file_chunks(path, chunk_size=None):
+    """Yield a local file in chunks, standing in for a Dropbox download stream"""
+    chunk_size = config.DROPBOX_CHUNK_SIZE if chunk_size is None else chunk_size
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            yield chunk
+
+
+def dropbox_chunks(dbx, path, chunk_size=None):
+    """Yield a Dropbox file in chunks as it downloads"""
+    chunk_size = config.DROPBOX_CHUNK_SIZE if chunk_size is None else chunk_size
+    metadata, res = dbx.files_download(path=path)
+    try:
+        for chunk in res.iter_content(chunk_size=chunk_size):
+            if chunk:
+                yield chunk
+    finally:
+        res.close()
+
+
+def s3_chunks(bucket, key, chunk_size=None, s3_client=None):
+    """Yield an S3 object in chunks from a streaming GetObject"""
+    chunk_size = config.DROPBOX_CHUNK_SIZE if chunk_size is None else chunk_size
+    body = (s3_client or config.S3_CLIENT).get_object(Bucket=bucket, Key=key)["Body"]
+    try:
+        for chunk in body.iter_chunks(chunk_size=chunk_size):
+            if chunk:
+                yield chunk
+    finally:
+        body.close()
+
+
+def _put(q, item, stop):
+    """Blocking put that gives up once another stage has failed"""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _get(q, stop):
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            continue
+    return None
+
+
+class StreamingPipeline:
+    """
+    Download -> ffmpeg -> upload with bounded queues between the stages.
+    Each stage runs in its own thread and blocks when the next stage's
+    queue is full, so memory stays at roughly queue_chunks * chunk_size per
+    queue and wall time approaches the slowest stage instead of the sum.
+    """
+
+    def __init__(
+        self,
+        chunk_size=None,
+        queue_chunks=None,
+    ):
+        self.chunk_size = (
+            chunk_size if chunk_size is not None else config.PIPELINE_CHUNK_SIZE
+        )
+        self.queue_chunks = (
+            queue_chunks if queue_chunks is not None else config.PIPELINE_QUEUE_CHUNKS
+        )
+
+    def run(self, chunks, sink, plan=None, input_source="pipe:0", max_bytes=None):
+        """
+        Stream chunks through ffmpeg into sink.
+        :param chunks: iterable of source bytes, or None when ffmpeg reads input_source itself.
+        :param sink: object with write, close and abort.
+        :param plan: encoder plan; None copies the source bytes straight to the sink.
+        :param input_source: what ffmpeg reads, "pipe:0" to read the chunks.
+        :param max_bytes: abort the sink instead of closing it if more than this was written.
+        :return: dict with bytes in/out and per-stage busy seconds
+        """
+        stop = threading.Event()
+        errors = []
+        stats = {
+            "bytes_in": 0,
+            "bytes_out": 0,
+            "download_seconds": 0.0,
+            "transcode_seconds": 0.0,
+            "upload_seconds": 0.0,
+        }
+        to_transcode = queue.Queue(maxsize=self.queue_chunks)
+        to_upload = queue.Queue(maxsize=self.queue_chunks)
+        threads = []
+
+        def stage(target, *args):
+            def wrapped():
+                try:
+                    target(*args)
+                except Exception as e:
+                    errors.append(e)
+                    stop.set()
+
+            thread = threading.Thread(target=wrapped, daemon=True)
+            threads.append(thread)
+            thread.start()
+
+        def download():
+            started = time.monotonic()
+            for chunk in chunks:
+                stats["bytes_in"] += len(chunk)
+                stats["download_seconds"] += time.monotonic() - started
+                if not _put(to_transcode, chunk, stop):
+                    return
+                started = time.monotonic()
+            _put(to_transcode, None, stop)
+
+        def upload():
+            while True:
+                chunk = _get(to_upload, stop)
+                if chunk is None:
+                    return
+                started = time.monotonic()
+                sink.write(chunk)
+                stats["upload_seconds"] += time.monotonic() - started
+                stats["bytes_out"] += len(chunk)
+
+        start = time.monotonic()
+        if chunks is not None:
+            stage(download)
+        stage(upload)
+
+        process = None
+        try:
+            if plan is None:
+                # Already small enough: pass the bytes through untouched
+                while True:
+                    chunk = _get(to_transcode, stop)
+                    if chunk is None or not _put(to_upload, chunk, stop):
+                        break
+            else:
+                process = self._start_ffmpeg(input_source, plan, chunks is not None)
+                if chunks is not None:
+                    stage(self._feed_ffmpeg, process, to_transcode, stop)
+                stderr = []
+                stage(lambda: stderr.append(process.stderr.read()))
+                started = time.monotonic()
+                while True:
+                    data = process.stdout.read(self.chunk_size)
+                    if not data or not _put(to_upload, data, stop):
+                        break
+                stats["transcode_seconds"] = time.monotonic() - started
+                if stop.is_set():
+                    # Nobody is draining stdout any more, don't wait on ffmpeg
+                    process.kill()
+                if process.wait() != 0 and not stop.is_set():
+                    raise RuntimeError(
+                        "ffmpeg failed: {}".format(
+                            b"".join(stderr).decode("utf-8", "replace")[-500:]
+                        )
+                    )
+            _put(to_upload, None, stop)
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            if process is not None and process.poll() is None:
+                process.kill()
+            for thread in threads:
+                thread.join()
+
+        if errors:
+            sink.abort()
+            raise errors[0]
+        stats["seconds"] = time.monotonic() - start
+        if max_bytes is not None and stats["bytes_out"] > max_bytes:
+            # Never finalize output that is over the limit, so nothing can reuse it
+            sink.abort()
+            logging.info(
+                "%s Discarded %s bytes of output, over the %s byte limit",
+                datetime.fromtimestamp(time.time()).strftime("%Y%m%d%H%M%S"),
+                stats["bytes_out"],
+                max_bytes,
+            )
+            return stats
+        sink.close()
+        logging.info(
+            "%s Streamed %s bytes in, %s bytes out in %.1fs "
+            "(download %.1fs, transcode %.1fs, upload %.1fs)",
+            datetime.fromtimestamp(time.time()).strftime("%Y%m%d%H%M%S"),
+            stats["bytes_in"],
+            stats["bytes_out"],
+            stats["seconds"],
+            stats["download_seconds"],
+            stats["transcode_seconds"],
+            stats["upload_seconds"],
+        )
+        return stats
+
+    def _start_ffmpeg(self, input_source, plan, pipe_stdin):
+        streams, video_args, audio_args = encoder.build_streams(input_source, plan)
+        return (
+            ffmpeg.output(
+                *streams,
+                "pipe:1",
+                **video_args,
+                **audio_args,
+                f="mp4",
+                movflags=FRAGMENTED_MP4_FLAGS,
+            )
+            .global_args("-loglevel", "error")
+            .run_async(pipe_stdin=pipe_stdin, pipe_stdout=True, pipe_stderr=True)
+        )
+
+    @staticmethod
+    def _feed_ffmpeg(process, to_transcode, stop):
+        try:
+            while True:
+                chunk = _get(to_transcode, stop)
+                if chunk is None:
+                    return
+                process.stdin.write(chunk)
+        except BrokenPipeError:
+            # ffmpeg exited early; its exit status carries the real error
+            pass
+        finally:
+            process.stdin.close()
+
+
+def stream_to_sink(
+    source, size, sink_factory, size_upper_bound, chunks=None, pipe_input=False
+):
+    """
+    Transcode source into a sink under size_upper_bound KB without staging to /tmp.
+    :param source: path or URL ffmpeg can read and probe (e.g. a Dropbox temporary link).
+    :param size: source size in bytes.
+    :param sink_factory: callable returning a fresh sink for each attempt.
+    :param size_upper_bound: Max output size in KB.
+    :param chunks: callable returning an iterable of source bytes, used to
+        pass small files straight through; defaults to reading source locally.
+    :param pipe_input: Feed chunks to ffmpeg's stdin instead of letting it
+        read source, for sources that are only available as a stream.
+    :return: dict of pipeline stats, or None if no bitrate fits
+    """
+    pipeline = StreamingPipeline()
+    chunks = chunks or (lambda: file_chunks(source))
+    limit = size_upper_bound * 1024
+    if size <= limit:
+        return pipeline.run(chunks(), sink_factory(), plan=None)
+
+    info = encoder.probe_media(source)
+    plan = encoder.plan_encode(info, size_upper_bound)
+    if plan is None:
+        return None
+    for attempt in range(1, config.ENCODER_MAX_ATTEMPTS + 1):
+        if pipe_input:
+            stats = pipeline.run(chunks(), sink_factory(), plan=plan, max_bytes=limit)
+        else:
+            stats = pipeline.run(
+                None, sink_factory(), plan=plan, input_source=source, max_bytes=limit
+            )
+        stats["attempts"] = attempt
+        if stats["bytes_out"] <= limit:
+            return stats
+        # Same fallback as encoder.encode_to_size: scale from the measured size
+        encoder.scale_plan(plan, stats["bytes_out"], limit)
+    return None
+
+
+def transcode_dropbox_to_gcs(dbx, entry, blob_name):
+    """
+    Stream a Dropbox entry through ffmpeg into GCS under blob_name.
+    ffmpeg reads a temporary link over HTTP, which lets it seek to a trailing
+    moov atom that a plain pipe could not reach.
+    """
+    link = dbx.files_get_temporary_link(entry.path_display).link
+    return stream_to_sink(
+        link,
+        entry.size,
+        lambda: GCSSink(blob_name),
+        config.GCS_MAX_FILE_SIZE * 1024,
+        chunks=lambda: dropbox_chunks(dbx, entry.path_display),
+    )
+
+
+def transcode_s3_to_gcs(bucket, key, size, blob_name, s3_client=None):
+    """
+    Stream an S3 object through ffmpeg into GCS under blob_name.
+    ffmpeg reads a presigned URL with ranged GETs, so it can seek to a trailing
+    moov atom; objects already under the GCS limit are copied from a streaming
+    GetObject. Nothing is staged to /tmp either way.
+    """
+    s3_client = s3_client or config.S3_CLIENT
+    url = s3_client.generate_presigned_url(
+        "get_object",
+        Params={"Bucket": bucket, "Key": key},
+        ExpiresIn=config.S3_PRESIGNED_URL_SECONDS,
+    )
+    return stream_to_sink(
+        url,
+        size,
+        lambda: GCSSink(blob_name),
+        config.GCS_MAX_FILE_SIZE * 1024,
+        chunks=lambda: s3_chunks(bucket, key, s3_client=s3_client),
+    )
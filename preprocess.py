@@ -0,0 +1,147 @@
+import glob
+import logging
+import os
+import re
+import time
+from datetime import datetime
+
+import ffmpeg
+
+import audio_first
+import config
+import encoder
+
+PTS_TIME = re.compile(r"pts_time:\s*([0-9.]+)")
+
+
+def get_profile(name=None):
+    """Model input profile by name, config.MODEL_INPUT_PROFILE by default"""
+    name = name or config.MODEL_INPUT_PROFILE
+    if not name:
+        return None
+    return dict(config.MODEL_INPUT_PROFILES[name], name=name)
+
+
+def within_caps(info, profile):
+    """Whether a probed video already fits a profile's resolution and frame rate"""
+    return info["height"] <= profile["max_height"] and info["fps"] <= profile.get(
+        "max_fps", float("inf")
+    )
+
+
+def scene_frames(source, info, output_base, profile):
+    """
+    Pick representative frames with ffmpeg's scene-change score in one pass.
+    The first frame is always kept. Frames are decimated and scaled down before
+    scoring, which keeps the scoring cheap on 4K sources.
+    :return: list of (timestamp, JPEG path) in order, at most max_frames long
+    """
+    pattern = "{}_scene%03d.jpg".format(output_base)
+    stream = ffmpeg.input(source).video
+    stream = stream.filter("fps", fps=config.SCENE_SAMPLE_FPS)
+    stream = stream.filter("scale", -2, min(info["height"], profile["max_height"]))
+    stream = stream.filter(
+        "select", "eq(n,0)+gt(scene,{})".format(profile["scene_threshold"])
+    )
+    stream = stream.filter("showinfo")
+    _, stderr = (
+        ffmpeg.output(stream, pattern, vsync="vfr", **{"q:v": 4})
+        .overwrite_output()
+        .run(quiet=True, capture_stderr=True)
+    )
+    timestamps = [
+        float(match)
+        for line in stderr.decode("utf-8", "replace").splitlines()
+        if "Parsed_showinfo" in line
+        for match in PTS_TIME.findall(line)
+    ]
+    paths = sorted(glob.glob("{}_scene[0-9][0-9][0-9].jpg".format(output_base)))
+    frames = list(zip(timestamps, paths))
+    max_frames = profile["max_frames"]
+    if len(frames) > max_frames:
+        # Keep an even spread of the detected scenes rather than the first few
+        step = (len(frames) - 1) / max(max_frames - 1, 1)
+        keep = {round(i * step) for i in range(max_frames)}
+        for index, (_, path) in enumerate(frames):
+            if index not in keep:
+                os.remove(path)
+        frames = [frame for index, frame in enumerate(frames) if index in keep]
+    return frames
+
+
+def prepare(source, info, size_upper_bound, profile=None, output_base=None):
+    """
+    Shrink a video to what the model needs according to an input profile.
+    "video" profiles cap resolution, frame rate and bits per pixel and
+    re-encode; "frames" profiles replace the video with scene-change stills
+    plus the audio track.
+    :param source: local video file, or a URL ffmpeg can read.
+    :param info: output of encoder.probe_media.
+    :param size_upper_bound: Max size of the upload in KB.
+    :param profile: output of get_profile, defaults to the configured profile.
+    :param output_base: path prefix for the parts, defaults to source without its extension.
+    :return: dict with parts, a list of (path, mime_type), prompt, media_note
+        (what other prompts need to be told about the parts), profile, bytes
+        and seconds; or None to fall back to the plain video path
+    """
+    profile = profile or get_profile()
+    if profile is None or not info["has_video"]:
+        return None
+    start = time.monotonic()
+    output_base = "{}_{}".format(
+        output_base or os.path.splitext(source)[0], profile["name"]
+    )
+
+    if profile["mode"] == "frames":
+        frames = scene_frames(source, info, output_base, profile)
+        parts = [(path, "image/jpeg") for _, path in frames]
+        plan = (
+            audio_first.audio_plan(info, size_upper_bound)
+            if info["has_audio"]
+            and config.GEMINI_MODEL_NAME.startswith(config.AUDIO_INPUT_MODELS)
+            else None
+        )
+        if plan:
+            audio = audio_first.extract_audio(source, output_base + "_audio", plan)
+            parts.append((audio, plan["mime_type"]))
+        prompt = config.FRAMES_SUMMARY_PROMPT
+        media_note = config.FRAMES_MEDIA_NOTE
+    else:
+        if within_caps(info, profile):
+            return None
+        output = output_base + ".mp4"
+        result = encoder.encode_to_size(
+            source,
+            output,
+            size_upper_bound,
+            max_height=profile["max_height"],
+            max_fps=profile.get("max_fps"),
+            max_bits_per_pixel=profile.get("max_bits_per_pixel"),
+        )
+        if result is None:
+            if os.path.exists(output):
+                os.remove(output)
+            return None
+        parts = [(output, "video/mp4")]
+        prompt = config.VIDEO_SUMMARY_PROMPT
+        media_note = ""
+
+    prepared = {
+        "parts": parts,
+        "prompt": prompt,
+        "media_note": media_note,
+        "profile": profile["name"],
+        "bytes": sum(os.path.getsize(path) for path, _ in parts),
+        "seconds": time.monotonic() - start,
+    }
+    logging.info(
+        "%s Prepared %s with profile %s: %s parts, %s bytes (from %s) in %.1fs",
+        datetime.fromtimestamp(time.time()).strftime("%Y%m%d%H%M%S"),
+        source,
+        profile["name"],
+        len(parts),
+        prepared["bytes"],
+        info["size"],
+        prepared["seconds"],
+    )
+    return prepared
@@ -0,0 +1,272 @@
+import glob
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from datetime import datetime
+
+import config
+
+
+def directory_size(path):
+    """Bytes used by the files under path, 0 if it is gone"""
+    total = 0
+    for folder, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(folder, name)).st_size
+            except FileNotFoundError:
+                # Removed between the listing and the stat
+                pass
+    return total
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class Workspace:
+    """
+    A private directory for one job's working files, holding a reservation
+    against the scratch budget. Closing it removes the directory whatever is
+    left in it, so use it as a context manager.
+    """
+
+    def __init__(self, space, directory, reserved):
+        self.space = space
+        self.directory = directory
+        self.reserved = reserved
+        self.peak = 0
+
+    def path(self, filename):
+        """Path for a working file inside this workspace"""
+        return os.path.join(self.directory, os.path.basename(filename))
+
+    def usage(self):
+        return directory_size(self.directory)
+
+    def close(self):
+        self.space.release(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+class ScratchSpace:
+    """
+    Hands out per-job workspaces under root while keeping the bytes reserved
+    by open workspaces under a budget, and samples disk use in the background
+    so the high-water marks can be reported.
+    """
+
+    def __init__(
+        self,
+        root=None,
+        budget_bytes=None,
+        min_free_bytes=None,
+        sample_seconds=None,
+    ):
+        self.root = root or config.SCRATCH_ROOT
+        self.budget_bytes = (
+            budget_bytes
+            if budget_bytes is not None
+            else config.SCRATCH_BUDGET_MB * 1024 * 1024
+        )
+        self.min_free_bytes = (
+            min_free_bytes
+            if min_free_bytes is not None
+            else config.SCRATCH_MIN_FREE_MB * 1024 * 1024
+        )
+        self.sample_seconds = sample_seconds or config.SCRATCH_SAMPLE_SECONDS
+        self._workspaces = {}
+        self._lock = threading.Lock()
+        # Held from the budget check to the reservation, so concurrent jobs
+        # can't both squeeze into the same free space
+        self._reserve_lock = threading.Lock()
+        self._sampler = None
+        self.reset_stats()
+
+    def reset_stats(self):
+        """Start the high-water marks and counters over, e.g. per invocation"""
+        with self._lock:
+            self._stats = {
+                "workspaces": 0,
+                "refused": 0,
+                "peak_reserved_bytes": sum(
+                    w.reserved for w in self._workspaces.values()
+                ),
+                "peak_used_bytes": 0,
+                "peak_filesystem_used_bytes": 0,
+                "swept_bytes": 0,
+            }
+
+    def reserved_bytes(self):
+        with self._lock:
+            return sum(w.reserved for w in self._workspaces.values())
+
+    def available_bytes(self):
+        """Bytes a new workspace could reserve right now"""
+        os.makedirs(self.root, exist_ok=True)
+        with self._lock:
+            workspaces = list(self._workspaces.values())
+        reserved = sum(w.reserved for w in workspaces)
+        # Reserved space the open workspaces haven't written yet is spoken for
+        # even though the filesystem still reports it free
+        outstanding = sum(max(0, w.reserved - w.usage()) for w in workspaces)
+        free = shutil.disk_usage(self.root).free - outstanding - self.min_free_bytes
+        return max(0, min(self.budget_bytes - reserved, free))
+
+    def workspace(self, job, expected_bytes):
+        """
+        Open a workspace for a job if its expected footprint fits.
+        :param job: name of the job, used in the directory name.
+        :param expected_bytes: most the job will have on disk at once.
+        :return: a Workspace, or None when the job should take a streaming path
+        """
+        expected_bytes = int(expected_bytes)
+        with self._reserve_lock:
+            return self._reserve(job, expected_bytes)
+
+    def _reserve(self, job, expected_bytes):
+        if expected_bytes > self.available_bytes():
+            with self._lock:
+                self._stats["refused"] += 1
+            logging.info(
+                "%s Scratch budget can't fit %s (%s bytes, %s reserved of %s)",
+                datetime.fromtimestamp(time.time()).strftime("%Y%m%d%H%M%S"),
+                job,
+                expected_bytes,
+                self.reserved_bytes(),
+                self.budget_bytes,
+            )
+            return None
+        name = "{}-{}-{}".format(
+            os.getpid(),
+            re.sub(r"[^A-Za-z0-9_.-]", "_", str(job))[:64],
+            uuid.uuid4().hex[:8],
+        )
+        directory = os.path.join(self.root, name)
+        os.makedirs(directory)
+        workspace = Workspace(self, directory, expected_bytes)
+        with self._lock:
+            self._workspaces[name] = workspace
+            self._stats["workspaces"] += 1
+            self._stats["peak_reserved_bytes"] = max(
+                self._stats["peak_reserved_bytes"],
+                sum(w.reserved for w in self._workspaces.values()),
+            )
+            if self._sampler is None:
+                self._sampler = threading.Thread(target=self._sample_loop, daemon=True)
+                self._sampler.start()
+        return workspace
+
+    def release(self, workspace):
+        """Remove a workspace's directory and return its reservation"""
+        self.sample()
+        shutil.rmtree(workspace.directory, ignore_errors=True)
+        with self._lock:
+            self._workspaces.pop(os.path.basename(workspace.directory), None)
+        logging.info(
+            "%s Released scratch workspace %s (peak %s of %s reserved bytes)",
+            datetime.fromtimestamp(time.time()).strftime("%Y%m%d%H%M%S"),
+            workspace.directory,
+            workspace.peak,
+            workspace.reserved,
+        )
+
+    def sample(self):
+        """Measure the open workspaces and the filesystem and update the peaks"""
+        with self._lock:
+            workspaces = list(self._workspaces.values())
+        used = 0
+        for workspace in workspaces:
+            usage = workspace.usage()
+            workspace.peak = max(workspace.peak, usage)
+            used += usage
+        filesystem_used = shutil.disk_usage(self.root).used
+        with self._lock:
+            self._stats["peak_used_bytes"] = max(self._stats["peak_used_bytes"], used)
+            self._stats["peak_filesystem_used_bytes"] = max(
+                self._stats["peak_filesystem_used_bytes"], filesystem_used
+            )
+
+    def _sample_loop(self):
+        # ffmpeg writes outputs while the inputs still exist, so the peaks fall
+        # in the middle of stages rather than at their edges
+        while True:
+            time.sleep(self.sample_seconds)
+            with self._lock:
+                if not self._workspaces:
+                    self._sampler = None
+                    return
+            self.sample()
+
+    def sweep(self, legacy_patterns=()):
+        """
+        Remove workspaces left behind by runs that never got to close them,
+        such as invocations killed by the Lambda timeout in a warm container.
+        Workspaces open in this process or owned by a live process are kept.
+        :param legacy_patterns: globs of other leftovers to remove as well.
+        :return: bytes freed
+        """
+        if not os.path.isdir(self.root):
+            names = []
+        else:
+            names = os.listdir(self.root)
+        with self._lock:
+            active = set(self._workspaces)
+        stale = []
+        for name in names:
+            if name in active:
+                continue
+            pid = name.split("-", 1)[0]
+            if pid.isdigit() and int(pid) != os.getpid() and _pid_alive(int(pid)):
+                continue
+            stale.append(os.path.join(self.root, name))
+        for pattern in legacy_patterns:
+            stale.extend(glob.glob(pattern))
+
+        freed = 0
+        for path in stale:
+            if os.path.isdir(path):
+                freed += directory_size(path)
+                shutil.rmtree(path, ignore_errors=True)
+            elif os.path.exists(path):
+                freed += os.path.getsize(path)
+                os.remove(path)
+        if stale:
+            logging.info(
+                "%s Swept %s stale scratch paths, %s bytes",
+                datetime.fromtimestamp(time.time()).strftime("%Y%m%d%H%M%S"),
+                len(stale),
+                freed,
+            )
+        with self._lock:
+            self._stats["swept_bytes"] += freed
+        return freed
+
+    def stats(self):
+        """Counters and disk high-water marks since the last reset_stats"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["reserved_bytes"] = sum(w.reserved for w in self._workspaces.values())
+        stats["budget_bytes"] = self.budget_bytes
+        return stats
+
+
+def get_scratch_space():
+    """The ScratchSpace under config.SCRATCH_ROOT, one per container"""
+    return config.get_client("SCRATCH_SPACE")
@@ -0,0 +1,184 @@
+import glob
+import logging
+import math
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import ffmpeg
+
+import config
+import metrics
+
+
+def should_segment(info, size_upper_bound):
+    """
+    Decide whether a probed file is long enough to summarize in segments.
+    :param info: output of encoder.probe_media.
+    :param size_upper_bound: Max upload size in KB.
+    """
+    return config.SEGMENT_MODE and (
+        info["duration"] > config.SEGMENT_MIN_DURATION
+        and info["size"] > size_upper_bound * 1024
+    )
+
+
+def segment_seconds_for(info, size_upper_bound):
+    """
+    Pick a segment length so stream-copied segments fit under the bound as-is.
+    Segments never exceed SEGMENT_MAX_SECONDS so per-segment latency stays flat.
+    """
+    seconds_that_fit = info["duration"] * (size_upper_bound * 1024) / info["size"]
+    # Keyframes land where they land, leave room for segments running long
+    seconds_that_fit *= config.ENCODER_SIZE_MARGIN
+    return max(
+        config.SEGMENT_MIN_SECONDS, min(config.SEGMENT_MAX_SECONDS, seconds_that_fit)
+    )
+
+
+def split_video(video_full_path, segment_seconds, has_audio=True, has_video=True):
+    """
+    Split a video at keyframes with stream copy, no re-encode.
+    :param video_full_path: the video, or audio-only file, to split.
+    :param segment_seconds: target segment length; cuts happen at the next keyframe.
+    :param has_audio: Whether the source has an audio stream to keep.
+    :param has_video: Whether the source has a video stream to keep.
+    :return: sorted list of segment paths next to the source
+    """
+    base, extension = os.path.splitext(video_full_path)
+    pattern = "{}_seg%03d{}".format(base, extension)
+    start = time.monotonic()
+    i = ffmpeg.input(video_full_path)
+    # Only map audio/video: phone recordings carry data tracks the segment
+    # muxer can't copy
+    streams = ([i.video] if has_video else []) + ([i.audio] if has_audio else [])
+    with metrics.stage("segment_split") as record:
+        record["bytes_in"] = os.path.getsize(video_full_path)
+        ffmpeg.output(
+            *streams,
+            pattern,
+            f="segment",
+            segment_time=segment_seconds,
+            reset_timestamps=1,
+            c="copy",
+        ).overwrite_output().run(quiet=True)
+        paths = sorted(glob.glob("{}_seg[0-9][0-9][0-9]{}".format(base, extension)))
+        record["bytes_out"] = sum(os.path.getsize(path) for path in paths)
+    logging.info(
+        "%s Split %s into %s segments of ~%.0fs in %.1fs",
+        datetime.fromtimestamp(time.time()).strftime("%Y%m%d%H%M%S"),
+        video_full_path,
+        len(paths),
+        segment_seconds,
+        time.monotonic() - start,
+    )
+    return paths
+
+
+def cut_segment(source, start, seconds, path, has_audio=True, has_video=True):
+    """
+    Stream copy one stretch of source into path. ffmpeg seeks with range
+    requests, so a remote source is never read in full.
+    :param start: where the segment starts; the cut snaps back to the keyframe before it.
+    :return: path
+    """
+    i = ffmpeg.input(source, ss=start, t=seconds)
+    streams = ([i.video] if has_video else []) + ([i.audio] if has_audio else [])
+    ffmpeg.output(
+        *streams, path, c="copy", avoid_negative_ts="make_zero"
+    ).overwrite_output().run(quiet=True)
+    return path
+
+
+def segment_prompt(index, count):
+    """Map prompt for one segment"""
+    return config.SEGMENT_SUMMARY_PROMPT.replace(
+        "SEGMENT_INDEX_HERE", str(index + 1)
+    ).replace("SEGMENT_COUNT_HERE", str(count))
+
+
+def reduce_prompt(partials):
+    """Reduce prompt that merges parsed segment summaries"""
+    sections = []
+    for index, partial in enumerate(partials):
+        sections.append(
+            "Part {}: {}\nKey points:\n{}\nSummary: {}\nTags: {}".format(
+                index + 1,
+                partial["TITLE"],
+                partial["KEYPOINTS"],
+                partial["SUMMARY"],
+                ", ".join(partial["TAGS"]),
+            )
+        )
+    return config.VIDEO_SUMMARY_REDUCE_PROMPT.replace(
+        "PARTIAL_SUMMARIES_HERE", "\n\n".join(sections)
+    )
+
+
+def map_reduce(
+    video_full_path,
+    info,
+    size_upper_bound,
+    summarize_segment,
+    merge,
+    max_workers=None,
+    output_path=None,
+):
+    """
+    Summarize a long video segment by segment, then merge the results.
+    :param video_full_path: the video to summarize, a local file or a URL.
+    :param info: output of encoder.probe_media for the video.
+    :param size_upper_bound: Max upload size per segment in KB.
+    :param summarize_segment: callable(segment_path, prompt) -> parsed summary.
+    :param merge: callable(prompt) -> parsed summary.
+    :param max_workers: Max number of segments summarized concurrently.
+    :param output_path: name segments after this path and cut each one from
+        the source just before it is summarized, so at most max_workers are on
+        disk at once; for sources too big to stage. By default the video is
+        split next to itself in one pass.
+    :return: parsed summary content in the parse_html_tags shape
+    """
+    max_workers = config.SEGMENT_MAX_WORKERS if max_workers is None else max_workers
+    segment_seconds = segment_seconds_for(info, size_upper_bound)
+    if output_path is None:
+        paths = split_video(
+            video_full_path,
+            segment_seconds,
+            has_audio=info["has_audio"],
+            has_video=info["has_video"],
+        )
+    else:
+        base, extension = os.path.splitext(output_path)
+        paths = [
+            "{}_seg{:03d}{}".format(base, index, extension)
+            for index in range(max(1, math.ceil(info["duration"] / segment_seconds)))
+        ]
+
+    def summarize(index):
+        path = paths[index]
+        try:
+            if output_path is not None:
+                cut_segment(
+                    video_full_path,
+                    index * segment_seconds,
+                    segment_seconds,
+                    path,
+                    has_audio=info["has_audio"],
+                    has_video=info["has_video"],
+                )
+            return summarize_segment(path, segment_prompt(index, len(paths)))
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            partials = list(executor.map(summarize, range(len(paths))))
+    finally:
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+    if len(partials) == 1:
+        return partials[0]
+    return merge(reduce_prompt(partials))
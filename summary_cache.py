@@ -0,0 +1,265 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+import config
+import dropbox_sync
+import lambda_logs
+
+
+def prompt_version(prompt=None, fanout=None):
+    """
+    Short fingerprint of the prompts so edited prompts don't reuse old summaries.
+    The fan-out analyses are part of it, since cached entries carry their results.
+    """
+    prompt = config.VIDEO_SUMMARY_PROMPT if prompt is None else prompt
+    fanout = config.FANOUT_PROMPTS if fanout is None else fanout
+    hasher = hashlib.sha256(prompt.encode("utf-8"))
+    for name in sorted(fanout):
+        entry = config.VIDEO_PROMPTS.get(name, {})
+        hasher.update(b"\0" + name.encode("utf-8"))
+        hasher.update(b"\0" + entry.get("prompt", "").encode("utf-8"))
+    return hasher.hexdigest()[:12]
+
+
+def file_content_hash(path, chunk_size=None):
+    """Dropbox-compatible content hash of a local file"""
+    chunk_size = config.DROPBOX_CHUNK_SIZE if chunk_size is None else chunk_size
+    hasher = dropbox_sync.DropboxContentHasher()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+class MemoryBackend:
+    """In-process LRU, survives between warm invocations of the same container"""
+
+    def __init__(self, max_entries=None):
+        self.max_entries = (
+            max_entries if max_entries is not None else config.SUMMARY_CACHE_MAX_ENTRIES
+        )
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+def _mtime(path):
+    try:
+        return os.path.getmtime(path)
+    except FileNotFoundError:
+        # Evicted by another process since the listing
+        return 0
+
+
+class LocalDirectoryBackend:
+    """One JSON file per entry, oldest files evicted past max_entries"""
+
+    def __init__(self, path=None, max_entries=None):
+        self.path = path or config.SUMMARY_CACHE_DIR
+        self.max_entries = (
+            max_entries if max_entries is not None else config.SUMMARY_CACHE_MAX_ENTRIES
+        )
+        os.makedirs(self.path, exist_ok=True)
+
+    def _file(self, key):
+        return os.path.join(self.path, key + ".json")
+
+    def get(self, key):
+        try:
+            with open(self._file(key)) as f:
+                value = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        os.utime(self._file(key))
+        return value
+
+    def put(self, key, value):
+        with open(self._file(key), "w") as f:
+            json.dump(value, f)
+        files = sorted(
+            (os.path.join(self.path, name) for name in os.listdir(self.path)),
+            key=_mtime,
+        )
+        for stale in files[: max(0, len(files) - self.max_entries)]:
+            try:
+                os.remove(stale)
+            except FileNotFoundError:
+                pass
+
+    def delete(self, key):
+        try:
+            os.remove(self._file(key))
+        except FileNotFoundError:
+            pass
+
+
+class S3Backend:
+    """
+    One JSON object per entry under an S3 prefix, the oldest written evicted
+    past max_entries. Reads don't touch LastModified, so unlike the other
+    backends eviction is by age rather than last use. Eviction lists the whole
+    prefix, so it runs on the first put and then every evict_every puts.
+    """
+
+    def __init__(self, s3_prefix=None, max_entries=None, evict_every=None):
+        self.s3_prefix = s3_prefix or config.SUMMARY_CACHE_S3_PREFIX
+        self.max_entries = (
+            max_entries
+            if max_entries is not None
+            else config.SUMMARY_CACHE_S3_MAX_ENTRIES
+        )
+        self.evict_every = (
+            evict_every
+            if evict_every is not None
+            else config.SUMMARY_CACHE_S3_EVICT_EVERY
+        )
+        self.puts = 0
+        self._lock = threading.Lock()
+        self.bucket = self.s3_prefix.split("/")[2]
+        self.prefix = "/".join(self.s3_prefix.split("/")[3:])
+
+    def get(self, key):
+        result = lambda_logs.get_content_from_s3(self.s3_prefix + key + ".json")
+        if not result["success"] or not result["data"]:
+            return None
+        return json.loads(result["data"])
+
+    def put(self, key, value):
+        lambda_logs.put_content_to_s3(self.s3_prefix + key + ".json", json.dumps(value))
+        with self._lock:
+            evict = self.puts % max(1, self.evict_every) == 0
+            self.puts += 1
+        if evict:
+            self._evict()
+
+    def delete(self, key):
+        config.S3_CLIENT.delete_object(
+            Bucket=self.bucket, Key=self.prefix + key + ".json"
+        )
+
+    def _evict(self):
+        paginator = config.S3_CLIENT.get_paginator("list_objects_v2")
+        objects = [
+            item
+            for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix)
+            for item in page.get("Contents", [])
+        ]
+        if len(objects) <= self.max_entries:
+            return
+        objects.sort(key=lambda item: item["LastModified"])
+        stale = objects[: len(objects) - self.max_entries]
+        # delete_objects takes at most 1000 keys per call
+        for start in range(0, len(stale), 1000):
+            config.S3_CLIENT.delete_objects(
+                Bucket=self.bucket,
+                Delete={
+                    "Objects": [
+                        {"Key": item["Key"]} for item in stale[start : start + 1000]
+                    ],
+                    "Quiet": True,
+                },
+            )
+
+
+BACKENDS = {
+    "memory": MemoryBackend,
+    "directory": LocalDirectoryBackend,
+    "s3": S3Backend,
+}
+
+
+class SummaryCache:
+    """
+    Content-addressed cache of parsed summaries.
+    Backends are checked in order and a hit is copied into the earlier ones,
+    so a memory backend in front of s3 keeps warm containers off the network.
+    """
+
+    def __init__(self, backends, ttl=None):
+        self.backends = backends
+        self.ttl = ttl if ttl is not None else config.SUMMARY_CACHE_TTL
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self):
+        """Start the hit/miss counters over, called once per invocation"""
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+            self.saved_seconds = 0.0
+
+    @staticmethod
+    def key(content_hash, version=None):
+        return "{}_{}".format(content_hash, version or prompt_version())
+
+    def get(self, content_hash):
+        key = self.key(content_hash)
+        for index, backend in enumerate(self.backends):
+            value = backend.get(key)
+            if value is None:
+                continue
+            if self.ttl and time.time() - value["created"] > self.ttl:
+                backend.delete(key)
+                continue
+            for earlier in self.backends[:index]:
+                earlier.put(key, value)
+            with self._lock:
+                self.hits += 1
+                self.saved_seconds += value.get("seconds", 0.0)
+            logging.info(
+                "%s Summary cache hit for %s",
+                datetime.fromtimestamp(time.time()).strftime("%Y%m%d%H%M%S"),
+                content_hash,
+            )
+            return value
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, content_hash, summary_content, gcs_object, seconds):
+        value = {
+            "summary": summary_content,
+            "gcs_object": gcs_object,
+            "prompt_version": prompt_version(),
+            "created": time.time(),
+            "seconds": seconds,
+        }
+        key = self.key(content_hash)
+        for backend in self.backends:
+            backend.put(key, value)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "saved_seconds": self.saved_seconds,
+            }
+
+
+def get_summary_cache():
+    """Shared per container, so warm invocations keep the memory backend"""
+    return config.get_client("SUMMARY_CACHE")
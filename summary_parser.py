@@ -0,0 +1,151 @@
+import json
+import re
+
+SUMMARY_FIELDS = ("TITLE", "KEYPOINTS", "SUMMARY", "TAGS")
+JSON_OBJECT = re.compile(r"\{.*\}", re.DOTALL)
+
+
+def split_tags(value):
+    """Split a comma separated TAGS value, dropping blanks"""
+    return [tag.strip() for tag in value.split(",") if tag.strip()]
+
+
+class StreamingTagParser:
+    """
+    Single-pass parser for <TITLE>...</TITLE> style fields in streamed text.
+    Chunks are scanned once as they arrive and each field is emitted through
+    on_field as soon as its closing tag is seen. A field left open by a
+    missing closing tag ends at the next known opening tag, or at the end
+    of the response; the first occurrence of a field wins, as with re.search.
+    """
+
+    def __init__(self, on_field=None, fields=SUMMARY_FIELDS):
+        self.on_field = on_field
+        self.fields = fields
+        self._max_tag_length = max(len(field) for field in fields) + 3
+        self.reset()
+
+    def reset(self):
+        """
+        Forget everything fed so far, e.g. before a retried request streams
+        the response again. Fields already passed to on_field are emitted
+        again as the new response completes them.
+        """
+        self.values = {}
+        self._pending = ""
+        self._current = None
+        self._parts = []
+
+    def feed(self, text):
+        """Consume the next chunk of the response"""
+        buffer = self._pending + text
+        position = 0
+        while True:
+            start = buffer.find("<", position)
+            if start == -1:
+                self._content(buffer[position:])
+                self._pending = ""
+                return
+            self._content(buffer[position:start])
+            end = buffer.find(">", start, start + self._max_tag_length + 1)
+            if end == -1:
+                if len(buffer) - start <= self._max_tag_length:
+                    # Possibly a tag split across chunks, wait for more text
+                    self._pending = buffer[start:]
+                    return
+                self._content("<")
+                position = start + 1
+                continue
+            name = buffer[start + 1 : end]
+            if "<" in name:
+                # A stray "<" in the text, the real tag starts further on
+                self._content("<")
+                position = start + 1
+                continue
+            self._tag(name, buffer[start : end + 1])
+            position = end + 1
+
+    def _content(self, text):
+        if self._current is not None and text:
+            self._parts.append(text)
+
+    def _tag(self, name, raw):
+        closing = name.startswith("/")
+        name = name.lstrip("/").strip().upper()
+        if name not in self.fields:
+            self._content(raw)
+        elif closing:
+            if name == self._current:
+                self._close()
+        else:
+            if self._current is not None:
+                self._close()
+            if name not in self.values:
+                self._current = name
+                self._parts = []
+
+    def _close(self):
+        name, value = self._current, "".join(self._parts).strip()
+        self._current = None
+        self._parts = []
+        if name == "TAGS":
+            value = split_tags(value)
+        self.values[name] = value
+        if self.on_field:
+            self.on_field(name, value)
+
+    def close(self):
+        """Flush any unterminated field and return the parsed fields"""
+        if self._pending:
+            pending, self._pending = self._pending, ""
+            self._content(pending)
+        if self._current is not None:
+            self._close()
+        result = {field: [] if field == "TAGS" else "" for field in self.fields}
+        result.update(self.values)
+        return result
+
+
+def parse(text):
+    """Parse a complete response in one pass"""
+    parser = StreamingTagParser()
+    parser.feed(text)
+    return parser.close()
+
+
+class JsonResponseParser:
+    """
+    Collects a streamed response holding one JSON object, e.g. the JUNE
+    prompt's, tolerating prose or code fences around it. A response that
+    doesn't parse is kept as {"TEXT": response} rather than lost.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self._parts = []
+
+    def feed(self, text):
+        self._parts.append(text)
+
+    def close(self):
+        text = "".join(self._parts)
+        match = JSON_OBJECT.search(text)
+        if match:
+            try:
+                value = json.loads(match.group(0))
+                if isinstance(value, dict):
+                    return value
+            except ValueError:
+                pass
+        return {"TEXT": text.strip()}
+
+
+def get_parser(entry, on_field=None):
+    """Fresh parser for a config.VIDEO_PROMPTS entry"""
+    if entry.get("parser") == "json":
+        return JsonResponseParser()
+    return StreamingTagParser(
+        on_field=on_field, fields=tuple(entry.get("fields", SUMMARY_FIELDS))
+    )
@@ -0,0 +1,46 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config  # noqa: E402
+
+BUCKET = "notion-gpt-tests"
+SECRETS = {
+    "API_KEY": "test-key",
+    "AWS_ACCESS_KEY_ID": "testing",
+    "AWS_SECRET": "testing",
+    "S3_BUCKET_NAME": BUCKET,
+    "PUSHOVER_APP": "app",
+    "PUSHOVER_USER": "user",
+}
+
+
+@pytest.fixture(autouse=True)
+def clients(monkeypatch):
+    """Fake secrets and freshly built clients for every test"""
+    monkeypatch.setitem(config.CLIENT_FACTORIES, "SECRETS", lambda: dict(SECRETS))
+    config.reset_clients()
+    yield
+    config.reset_clients()
+
+
+@pytest.fixture
+def aws(monkeypatch):
+    """Every boto3 call goes to moto's in-memory AWS"""
+    from moto import mock_aws
+
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    with mock_aws():
+        yield
+
+
+@pytest.fixture
+def s3(aws):
+    """config.S3_CLIENT, built as in production but against moto, with the bucket created"""
+    config.S3_CLIENT.create_bucket(Bucket=BUCKET)
+    return config.S3_CLIENT
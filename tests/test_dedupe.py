@@ -0,0 +1,137 @@
+import json
+import threading
+import time
+
+import pytest
+
+import dedupe
+from conftest import BUCKET
+
+PREFIX = "s3://{}/dedupe/".format(BUCKET)
+
+
+@pytest.fixture(params=["memory", "file", "s3"])
+def leases(request, tmp_path):
+    """Leases on each backend; the S3 one runs against moto"""
+    if request.param == "memory":
+        backend = dedupe.MemoryLeaseBackend()
+    elif request.param == "file":
+        backend = dedupe.FileLeaseBackend(str(tmp_path / "dedupe.json"))
+    else:
+        request.getfixturevalue("s3")
+        backend = dedupe.S3LeaseBackend(PREFIX)
+    return dedupe.Leases(backend)
+
+
+def test_claim_is_refused_while_another_owner_holds_the_lease(leases):
+    assert leases.claim("file/a@1", "one", ttl=60)
+    assert not leases.claim("file/a@1", "two", ttl=60)
+    # The holder can renew its own lease
+    assert leases.claim("file/a@1", "one", ttl=60)
+
+
+def test_expired_lease_can_be_reclaimed(leases):
+    assert leases.claim("file/a@1", "one", ttl=0.05)
+    time.sleep(0.1)
+    assert leases.claim("file/a@1", "two", ttl=60)
+    assert not leases.claim("file/a@1", "one", ttl=60)
+
+
+def test_release_frees_the_key_only_for_its_owner(leases):
+    assert leases.claim("file/a@1", "one", ttl=60)
+    leases.release("file/a@1", "two")
+    assert not leases.claim("file/a@1", "two", ttl=60)
+    leases.release("file/a@1", "one")
+    assert leases.claim("file/a@1", "two", ttl=60)
+
+
+def test_completed_key_keeps_its_result_and_refuses_claims(leases):
+    assert leases.result("file/a@1") is None
+    assert leases.claim("file/a@1", "one", ttl=60)
+    leases.complete("file/a@1", "one", result={"page": "abc"})
+
+    record = leases.result("file/a@1")
+    assert record["status"] == dedupe.DONE
+    assert record["result"] == {"page": "abc"}
+    assert not leases.claim("file/a@1", "one", ttl=60)
+    assert not leases.claim("file/a@1", "two", ttl=60)
+    # Releasing a completed key doesn't reopen it
+    leases.release("file/a@1", "one")
+    assert leases.result("file/a@1") is not None
+
+
+def test_keys_are_independent(leases):
+    assert leases.claim("file/a@1", "one", ttl=60)
+    assert leases.claim("file/a@2", "two", ttl=60)
+
+
+def test_coalesced_runs_once_for_a_burst(leases):
+    runs = []
+    results = dedupe.coalesced(
+        "folder", lambda: runs.append(1) or len(runs), leases=leases, window=0.05
+    )
+    assert results == [1]
+    # A caller arriving while the lease is held leaves the work to the holder
+    assert leases.claim("folder", "holder", ttl=60)
+    assert dedupe.coalesced("folder", lambda: runs.append(1), leases=leases) == []
+    assert runs == [1]
+
+
+def test_coalesced_runs_again_for_a_notification_during_the_run(leases):
+    runs = []
+
+    def run():
+        runs.append(1)
+        if len(runs) == 1:
+            # Arrives mid-run and loses the claim to the current holder
+            assert dedupe.coalesced("folder", run, leases=leases, window=0) == []
+        return len(runs)
+
+    assert dedupe.coalesced("folder", run, leases=leases, window=0) == [1, 2]
+
+
+def test_s3_backend_retries_after_losing_a_conditional_write(s3):
+    backend = dedupe.S3LeaseBackend(PREFIX)
+    leases = dedupe.Leases(backend)
+    assert leases.claim("file/a@1", "one", ttl=60)
+    original_read = backend._read
+    reads = []
+
+    def read(key):
+        current = original_read(key)
+        reads.append(key)
+        if len(reads) == 1:
+            # Another container changes the object between our read and write
+            s3.put_object(
+                Bucket=BUCKET,
+                Key="dedupe/" + key,
+                Body=json.dumps({"status": dedupe.LEASED, "owner": "two"}),
+            )
+        return current
+
+    backend._read = read
+    leases.complete("file/a@1", "one", result="done")
+
+    # The first write was refused on its stale ETag and the retry won
+    assert len(reads) == 2
+    assert leases.result("file/a@1")["owner"] == "one"
+
+
+def test_s3_backend_has_a_single_winner_for_a_new_key(s3):
+    leases = dedupe.Leases(dedupe.S3LeaseBackend(PREFIX, max_attempts=10))
+    start = threading.Barrier(8)
+    won = []
+
+    def claim(owner):
+        start.wait()
+        if leases.claim("file/a@1", owner, ttl=60):
+            won.append(owner)
+
+    threads = [threading.Thread(target=claim, args=(str(i),)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(won) == 1
+    assert dedupe.S3LeaseBackend(PREFIX).get("file/a@1")["owner"] == won[0]
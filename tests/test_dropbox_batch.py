@@ -0,0 +1,144 @@
+import os
+from types import SimpleNamespace
+
+import pytest
+
+import config
+import dedupe
+import dropbox_sync
+import lambda_function
+import notion_writer
+from benchmarks.fakes import FakeDropbox
+
+
+@pytest.fixture
+def batch(tmp_path, monkeypatch):
+    """
+    process_dropbox_batch over a local folder, with summarizing stubbed:
+    entries named in failing raise, the rest get a page whose url ends in
+    the name, unless it is in notion_failing too.
+    """
+    root = tmp_path / "dropbox"
+    root.mkdir()
+    dbx = FakeDropbox(str(root))
+    monkeypatch.setitem(config.CLIENT_FACTORIES, "DROPBOX_CLIENT", lambda: dbx)
+    monkeypatch.setattr(config, "DEDUPE_ENABLED", True)
+    monkeypatch.setattr(config, "DEDUPE_BACKEND", "memory")
+    monkeypatch.setattr(config, "SUMMARY_CACHE_BACKENDS", ["memory"])
+    monkeypatch.setattr(config, "NOTIFICATION_DIGEST", False)
+    cursor_store = dropbox_sync.FileCursorStore(str(tmp_path / "cursor.json"))
+    failing = set()
+    notion_failing = set()
+    processed = []
+    pages = []
+
+    def summarize_dropbox_entry(dbx, entry):
+        processed.append(entry.name)
+        if entry.name in failing:
+            raise RuntimeError("Gemini said no")
+        return {"TITLE": entry.name, "KEYPOINTS": "", "SUMMARY": "", "TAGS": []}
+
+    def create(parent, properties):
+        name = properties["Name"]["title"][0]["text"]["content"]
+        if name in notion_failing:
+            raise RuntimeError("Notion said no")
+        pages.append(name)
+        return {"url": "https://notion.so/" + name}
+
+    client = SimpleNamespace(pages=SimpleNamespace(create=create))
+    writer = notion_writer.NotionWriter(client, "db", requests_per_second=1000)
+    monkeypatch.setitem(config.CLIENT_FACTORIES, "NOTION_WRITER", lambda: writer)
+    monkeypatch.setattr(
+        lambda_function, "summarize_dropbox_entry", summarize_dropbox_entry
+    )
+
+    def add(*names):
+        for name in names:
+            (root / name).write_bytes(name.encode("utf-8"))
+
+    def run():
+        processed.clear()
+        return lambda_function.process_dropbox_batch(cursor_store=cursor_store)
+
+    def remaining():
+        return sorted(os.listdir(root))
+
+    return SimpleNamespace(
+        run=run,
+        add=add,
+        remaining=remaining,
+        dbx=dbx,
+        failing=failing,
+        notion_failing=notion_failing,
+        processed=processed,
+        pages=pages,
+        cursor_store=cursor_store,
+    )
+
+
+def test_file_leased_elsewhere_stays_pending_until_processed(batch):
+    batch.add("a.mp4", "b.mp4")
+    entry = batch.dbx.files_get_metadata("/b.mp4")
+    leases = dedupe.get_leases()
+    assert leases.claim(dedupe.file_key(entry), "other", ttl=60)
+
+    result = batch.run()
+
+    assert result["urls"] == ["https://notion.so/a.mp4"]
+    assert result["skipped"] == ["/b.mp4"]
+    assert batch.remaining() == ["b.mp4"]
+    assert batch.cursor_store.load()["pending"] == ["/b.mp4"]
+
+    # The holder died without finishing, so its lease lapses
+    leases.release(dedupe.file_key(entry), "other")
+    result = batch.run()
+
+    assert batch.processed == ["b.mp4"]
+    assert result["urls"] == ["https://notion.so/b.mp4"]
+    assert batch.remaining() == []
+    assert batch.cursor_store.load()["pending"] == []
+
+
+def test_pages_are_written_after_summarizing_and_failures_stay_pending(batch):
+    batch.add("a.mp4", "b.mp4", "c.mp4")
+    batch.notion_failing.add("c.mp4")
+
+    result = batch.run()
+
+    assert sorted(batch.processed) == ["a.mp4", "b.mp4", "c.mp4"]
+    assert sorted(batch.pages) == ["a.mp4", "b.mp4"]
+    assert sorted(result["urls"]) == [
+        "https://notion.so/a.mp4",
+        "https://notion.so/b.mp4",
+    ]
+    assert result["failed"] == ["/c.mp4"]
+    assert batch.remaining() == ["c.mp4"]
+    assert batch.cursor_store.load()["pending"] == ["/c.mp4"]
+    # The lease was released, so the next run writes it
+    batch.notion_failing.clear()
+    assert batch.run()["urls"] == ["https://notion.so/c.mp4"]
+    assert batch.remaining() == []
+
+
+def test_only_entries_that_succeeded_are_deleted(batch):
+    batch.add("a.mp4", "b.mp4", "c.mp4", "notes.txt")
+    batch.failing.add("b.mp4")
+
+    result = batch.run()
+
+    assert sorted(batch.processed) == ["a.mp4", "b.mp4", "c.mp4"]
+    assert sorted(result["urls"]) == [
+        "https://notion.so/a.mp4",
+        "https://notion.so/c.mp4",
+    ]
+    assert result["failed"] == ["/b.mp4"]
+    assert batch.remaining() == ["b.mp4", "notes.txt"]
+    assert batch.cursor_store.load()["pending"] == ["/b.mp4"]
+
+    # The failure is listed again on the next run even though the cursor moved on
+    batch.failing.clear()
+    result = batch.run()
+
+    assert batch.processed == ["b.mp4"]
+    assert result["urls"] == ["https://notion.so/b.mp4"]
+    assert batch.remaining() == ["notes.txt"]
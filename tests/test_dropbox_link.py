@@ -0,0 +1,77 @@
+import os
+
+import pytest
+
+import config
+import gemini_client
+import lambda_function
+from benchmarks.fakes import (
+    FakeDropbox,
+    FakeGenerativeModel,
+    FileGCSClient,
+    synthetic_clip,
+)
+from conftest import SECRETS
+
+
+@pytest.fixture
+def dropbox(tmp_path, monkeypatch):
+    """A FakeDropbox holding a 15s clip, with GCS and Gemini faked as well"""
+    root = tmp_path / "dropbox"
+    root.mkdir()
+    synthetic_clip(str(root / "long.mp4"), 15, 240)
+    dbx = FakeDropbox(str(root))
+    gcs = FileGCSClient(str(tmp_path / "gcs"))
+    model = FakeGenerativeModel(first_chunk_latency=0, chunk_latency=0)
+    secrets = dict(SECRETS, GCS_BUCKET_NAME="videos")
+    monkeypatch.setitem(config.CLIENT_FACTORIES, "SECRETS", lambda: dict(secrets))
+    monkeypatch.setitem(config.CLIENT_FACTORIES, "DROPBOX_CLIENT", lambda: dbx)
+    monkeypatch.setitem(config.CLIENT_FACTORIES, "GCS_CLIENT", lambda: gcs)
+    for name in ("GEMINI_SCHEDULER", "GEMINI_TEXT_SCHEDULER"):
+        monkeypatch.setitem(
+            config.CLIENT_FACTORIES,
+            name,
+            lambda: gemini_client.GeminiScheduler(model),
+        )
+    monkeypatch.setattr(config, "SUMMARY_CACHE_BACKENDS", ["memory"])
+    monkeypatch.setattr(config, "NOTIFICATIONS_ENABLED", False)
+    monkeypatch.setattr(config, "AUDIO_FIRST_MODE", "never")
+    monkeypatch.setattr(config, "MODEL_INPUT_PROFILE", None)
+    monkeypatch.setattr(config, "SEGMENT_MIN_DURATION", 10)
+    monkeypatch.setattr(config, "SEGMENT_MIN_SECONDS", 5)
+    monkeypatch.setattr(config, "GCS_MAX_FILE_SIZE", 1)
+    monkeypatch.setattr(config, "SCRATCH_ROOT", str(tmp_path / "scratch"))
+    monkeypatch.setattr(config, "SCRATCH_MIN_FREE_MB", 0)
+    monkeypatch.setattr(
+        lambda_function, "media_parts", lambda media: [blob for blob, _ in media]
+    )
+    yield dbx, model
+    dbx.close()
+
+
+def test_file_too_big_for_scratch_is_still_summarized_in_segments(dropbox, monkeypatch):
+    dbx, model = dropbox
+    entry = dbx.files_get_metadata("/long.mp4")
+    # Room for a few segments at a time, but not for the download
+    budget_mb = 1 * 3 * config.SEGMENT_MAX_WORKERS + 1
+    assert entry.size * config.SCRATCH_SIZE_FACTOR > budget_mb * 1024 * 1024
+    monkeypatch.setattr(config, "SCRATCH_BUDGET_MB", budget_mb)
+
+    summary = lambda_function.summarize_dropbox_link(dbx, entry)
+
+    assert summary["TITLE"] == "Fake"
+    # One call per segment plus the merge
+    assert model.calls > 2
+    assert "files_download" not in dbx.calls
+    assert os.listdir(config.SCRATCH_ROOT) == []
+
+
+def test_file_without_room_for_working_files_is_streamed_whole(dropbox, monkeypatch):
+    dbx, model = dropbox
+    monkeypatch.setattr(config, "SCRATCH_BUDGET_MB", 1)
+    entry = dbx.files_get_metadata("/long.mp4")
+
+    summary = lambda_function.summarize_dropbox_link(dbx, entry)
+
+    assert summary["TITLE"] == "Fake"
+    assert model.calls == 1
@@ -0,0 +1,168 @@
+import hashlib
+import types
+
+import pytest
+from dropbox.exceptions import ApiError
+from dropbox.files import (
+    FileMetadata,
+    FolderMetadata,
+    GetMetadataError,
+    ListFolderContinueError,
+    LookupError,
+)
+
+import dropbox_sync
+from conftest import BUCKET
+
+
+def file_entry(name, id_=None):
+    return FileMetadata(
+        name=name,
+        id=id_ or "id:" + name,
+        path_display="/" + name,
+        path_lower="/" + name.lower(),
+        size=10,
+        rev="0123456789a",
+    )
+
+
+class FakeDropbox:
+    """
+    files_list_folder(_continue) over a list of changes. Each cursor is the
+    number of changes it has seen, listings come back page_size at a time.
+    """
+
+    def __init__(self, changes, page_size=2):
+        self.changes = changes
+        self.page_size = page_size
+        self.reset_cursors = set()
+        self.full_listings = 0
+        self.continued_from = []
+
+    def _page(self, start):
+        end = min(start + self.page_size, len(self.changes))
+        return types.SimpleNamespace(
+            entries=self.changes[start:end],
+            cursor=str(end),
+            has_more=end < len(self.changes),
+        )
+
+    def files_list_folder(self, path, recursive=False):
+        self.full_listings += 1
+        return self._page(0)
+
+    def files_list_folder_continue(self, cursor):
+        self.continued_from.append(cursor)
+        if cursor in self.reset_cursors:
+            raise ApiError("request", ListFolderContinueError.reset, "reset", None)
+        return self._page(int(cursor))
+
+    def files_get_metadata(self, path):
+        for entry in self.changes:
+            if entry.path_display == path:
+                return entry
+        raise ApiError(
+            "request",
+            GetMetadataError.path(LookupError.not_found),
+            "not found",
+            None,
+        )
+
+
+@pytest.fixture
+def store(tmp_path):
+    return dropbox_sync.FileCursorStore(str(tmp_path / "cursor.json"))
+
+
+def test_first_run_lists_everything_and_follows_has_more(store):
+    dbx = FakeDropbox(
+        [file_entry("a.mp4"), FolderMetadata(name="f", id="id:f"), file_entry("b.mp4")]
+    )
+    entries, cursor = dropbox_sync.list_changes(dbx, store)
+    assert sorted(e.name for e in entries) == ["a.mp4", "b.mp4"]
+    assert cursor == "3"
+    assert dbx.full_listings == 1
+
+
+def test_next_run_only_sees_changes_since_the_committed_cursor(store):
+    dbx = FakeDropbox([file_entry("a.mp4")])
+    entries, cursor = dropbox_sync.list_changes(dbx, store)
+    dropbox_sync.commit_changes(store, cursor)
+
+    dbx.changes.append(file_entry("b.mp4"))
+    entries, cursor = dropbox_sync.list_changes(dbx, store)
+    assert [e.name for e in entries] == ["b.mp4"]
+    assert dbx.full_listings == 1
+    assert dbx.continued_from == ["1"]
+
+
+def test_uncommitted_listing_is_seen_again(store):
+    dbx = FakeDropbox([file_entry("a.mp4")])
+    dropbox_sync.list_changes(dbx, store)
+    entries, _ = dropbox_sync.list_changes(dbx, store)
+    assert [e.name for e in entries] == ["a.mp4"]
+
+
+def test_pending_paths_are_retried_and_vanished_ones_dropped(store):
+    dbx = FakeDropbox([file_entry("a.mp4")])
+    _, cursor = dropbox_sync.list_changes(dbx, store)
+    dropbox_sync.commit_changes(store, cursor, pending=["/a.mp4", "/gone.mp4"])
+
+    entries, _ = dropbox_sync.list_changes(dbx, store)
+    assert [e.name for e in entries] == ["a.mp4"]
+
+
+def test_pending_file_listed_again_appears_once(store):
+    dbx = FakeDropbox([file_entry("a.mp4")])
+    dropbox_sync.commit_changes(store, None, pending=["/a.mp4"])
+    entries, _ = dropbox_sync.list_changes(dbx, store)
+    assert [e.name for e in entries] == ["a.mp4"]
+
+
+def test_reset_cursor_falls_back_to_a_full_listing(store):
+    dbx = FakeDropbox([file_entry("a.mp4"), file_entry("b.mp4")], page_size=5)
+    dbx.reset_cursors.add("stale")
+    dropbox_sync.commit_changes(store, "stale")
+
+    entries, cursor = dropbox_sync.list_changes(dbx, store)
+    assert sorted(e.name for e in entries) == ["a.mp4", "b.mp4"]
+    assert cursor == "2"
+    assert dbx.full_listings == 1
+
+
+def test_file_store_starts_empty_and_round_trips(store):
+    assert store.load() == {"cursor": None, "pending": []}
+    store.save({"cursor": "abc", "pending": ["/a.mp4"]})
+    assert dropbox_sync.FileCursorStore(store.path).load() == {
+        "cursor": "abc",
+        "pending": ["/a.mp4"],
+    }
+
+
+def test_s3_store_round_trips(s3):
+    store = dropbox_sync.S3CursorStore("s3://{}/dropboxCursor.json".format(BUCKET))
+    assert store.load() == {"cursor": None, "pending": []}
+    dropbox_sync.commit_changes(store, "abc", pending=["/a.mp4"])
+    assert dropbox_sync.S3CursorStore(store.s3_path).load() == {
+        "cursor": "abc",
+        "pending": ["/a.mp4"],
+    }
+
+
+def test_s3_store_defaults_to_the_configured_path(s3):
+    dropbox_sync.get_cursor_store().save({"cursor": "abc", "pending": []})
+    body = s3.get_object(Bucket=BUCKET, Key="dropboxCursor.json")["Body"].read()
+    assert b'"abc"' in body
+
+
+def test_content_hasher_hashes_4mb_blocks_across_chunk_boundaries():
+    # https://www.dropbox.com/developers/reference/content-hash
+    block = dropbox_sync.DROPBOX_HASH_BLOCK_SIZE
+    data = b"a" * block + b"b" * 10
+    expected = hashlib.sha256(
+        hashlib.sha256(b"a" * block).digest() + hashlib.sha256(b"b" * 10).digest()
+    ).hexdigest()
+    hasher = dropbox_sync.DropboxContentHasher()
+    for start in range(0, len(data), 1000003):
+        hasher.update(data[start : start + 1000003])
+    assert hasher.hexdigest() == expected
@@ -0,0 +1,102 @@
+import pytest
+
+import config
+import encoder
+
+SIZE_KB = 9.5 * 1024
+
+
+def media(duration, height=1080, fps=60, has_audio=True, has_video=True):
+    return {
+        "duration": duration,
+        "width": height * 16 // 9,
+        "height": height,
+        "fps": fps,
+        "has_audio": has_audio,
+        "has_video": has_video,
+        "audio_bitrate": 192000,
+    }
+
+
+def bits_per_pixel(plan, info):
+    aspect = info["width"] / info["height"]
+    return plan["video_bitrate"] / (
+        plan["height"] * plan["height"] * aspect * plan["fps"]
+    )
+
+
+def test_short_clip_keeps_its_resolution_and_frame_rate():
+    plan = encoder.plan_encode(media(10), SIZE_KB)
+
+    assert (plan["height"], plan["fps"]) == (1080, 60)
+    assert plan["audio_bitrate"] == encoder.MAX_AUDIO_BITRATE
+
+
+@pytest.mark.parametrize(
+    "duration, rung",
+    [
+        # Frames above 30fps go first, then resolution, then frame rate
+        (20, (1080, 30)),
+        (60, (540, 30)),
+        (500, (240, 24)),
+        (1200, (240, 15)),
+    ],
+)
+def test_ladder_steps_down_until_the_bitrate_suffices(duration, rung):
+    info = media(duration)
+    plan = encoder.plan_encode(info, SIZE_KB)
+
+    assert (plan["height"], plan["fps"]) == rung
+    if rung != (240, 15):
+        assert bits_per_pixel(plan, info) >= encoder.MIN_BITS_PER_PIXEL
+
+
+def expected_bytes():
+    limit = SIZE_KB * 1024 / encoder.KIB_PER_KB
+    return limit * config.ENCODER_SIZE_MARGIN / (1 + encoder.MUXING_OVERHEAD)
+
+
+def test_budget_fills_the_bound_with_headroom():
+    info = media(60)
+    plan = encoder.plan_encode(info, SIZE_KB)
+
+    total = (plan["video_bitrate"] + plan["audio_bitrate"]) * info["duration"] / 8
+    assert total == pytest.approx(expected_bytes())
+
+
+def test_too_long_for_the_bound_has_no_plan():
+    assert encoder.plan_encode(media(3600), SIZE_KB) is None
+
+
+def test_caps_from_a_profile_limit_the_rung_and_the_bitrate():
+    info = media(10)
+    plan = encoder.plan_encode(
+        info, SIZE_KB, max_height=480, max_fps=15, max_bits_per_pixel=0.05
+    )
+
+    assert (plan["height"], plan["fps"]) == (480, 15)
+    assert bits_per_pixel(plan, info) == pytest.approx(0.05)
+
+
+def test_audio_only_plan():
+    plan = encoder.plan_encode(media(600, has_video=False), SIZE_KB)
+
+    assert plan["video_bitrate"] == 0.0
+    # The whole budget, which is under the source's 192 kbps
+    assert plan["audio_bitrate"] * 600 / 8 == pytest.approx(expected_bytes())
+    assert (plan["height"], plan["fps"]) == (0, 0)
+
+
+def test_scale_plan_cuts_the_bitrate_by_the_overshoot():
+    plan = {"video_bitrate": 1000000.0, "audio_bitrate": 64000.0}
+
+    encoder.scale_plan(plan, size=12000, limit=10000)
+
+    assert plan["video_bitrate"] == pytest.approx(
+        1000000 * 10000 / 12000 * config.ENCODER_SIZE_MARGIN
+    )
+    assert plan["audio_bitrate"] == 64000.0
+
+    plan = {"video_bitrate": 0.0, "audio_bitrate": 64000.0}
+    encoder.scale_plan(plan, size=20000, limit=10000)
+    assert plan["audio_bitrate"] == pytest.approx(32000 * config.ENCODER_SIZE_MARGIN)
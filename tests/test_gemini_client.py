@@ -0,0 +1,183 @@
+import threading
+import time
+
+import pytest
+
+import gemini_client
+import summary_parser
+
+
+class Chunk:
+    def __init__(self, text):
+        self.text = text
+
+
+class QuotaError(Exception):
+    code = 429
+
+
+class BadRequest(Exception):
+    code = 400
+
+
+class FakeModel:
+    """generate_content that plays one scripted response per call"""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.calls = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self._lock = threading.Lock()
+
+    def generate_content(self, contents, stream=True, **kwargs):
+        with self._lock:
+            response = self.responses[min(self.calls, len(self.responses) - 1)]
+            self.calls += 1
+        return self._stream(response)
+
+    def _stream(self, response):
+        with self._lock:
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            for item in response:
+                if isinstance(item, Exception):
+                    raise item
+                if isinstance(item, (int, float)):
+                    time.sleep(item)
+                    continue
+                yield Chunk(item)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+
+def scheduler(model, **kwargs):
+    options = dict(
+        requests_per_minute=60000,
+        max_in_flight=2,
+        max_retries=3,
+        backoff_base=0.001,
+        backoff_max=0.01,
+        deadline=5,
+    )
+    options.update(kwargs)
+    return gemini_client.GeminiScheduler(model, **options)
+
+
+def test_streams_chunks_and_returns_the_full_text():
+    chunks = []
+    result = scheduler(FakeModel(["a", "b", "c"])).generate(
+        ["prompt"], on_chunk=chunks.append
+    )
+    assert result == "abc"
+    assert chunks == ["a", "b", "c"]
+
+
+def test_retryable_errors_are_retried_with_backoff():
+    model = FakeModel([QuotaError()], [QuotaError()], ["ok"])
+    client = scheduler(model)
+    assert client.generate(["prompt"]) == "ok"
+    assert model.calls == 3
+    stats = client.stats()
+    assert stats["requests"] == 1
+    assert stats["retries"] == 2
+    assert stats["failed"] == 0
+
+
+def test_other_errors_are_raised_without_retrying():
+    model = FakeModel([BadRequest()])
+    client = scheduler(model)
+    with pytest.raises(BadRequest):
+        client.generate(["prompt"])
+    assert model.calls == 1
+    assert client.stats()["failed"] == 1
+
+
+def test_gives_up_after_max_retries():
+    model = FakeModel([QuotaError()])
+    with pytest.raises(QuotaError):
+        scheduler(model, max_retries=2).generate(["prompt"])
+    assert model.calls == 3
+
+
+def test_deadline_abandons_a_stuck_request_and_retries():
+    model = FakeModel(["slow", 1.0, " rest"], ["fast"])
+    assert scheduler(model, deadline=0.2).generate(["prompt"]) == "fast"
+
+
+def test_retries_stop_when_the_total_deadline_runs_out():
+    model = FakeModel([1, "slow"])
+    client = scheduler(model, max_retries=10, deadline=0.2, total_deadline=0.5)
+    start = time.monotonic()
+    with pytest.raises(TimeoutError):
+        client.generate(["prompt"])
+    assert time.monotonic() - start < 0.8
+    assert model.calls <= 3
+
+
+def test_requests_stay_inside_the_invocation(monkeypatch):
+    class Context:
+        def get_remaining_time_in_millis(self):
+            return 1300
+
+    monkeypatch.setattr(gemini_client, "_INVOCATION_END", None)
+    gemini_client.limit_to_invocation(Context(), margin=1)
+    model = FakeModel([1, "slow"])
+    start = time.monotonic()
+    with pytest.raises(TimeoutError):
+        scheduler(model, max_retries=10, deadline=5).generate(["prompt"])
+    assert time.monotonic() - start < 0.6
+
+    gemini_client.limit_to_invocation(None)
+    assert gemini_client._INVOCATION_END is None
+
+
+def test_retry_resets_the_parser_instead_of_feeding_it_twice():
+    # Fails mid-stream, then times out mid-stream, then succeeds
+    model = FakeModel(
+        ["<TITLE>t</TITLE><KEYPOINTS>a", QuotaError()],
+        ["<TITLE>t</TITLE><KEYPOINTS>a", 0.5, " late"],
+        ["<TITLE>t</TITLE><KEYPOINTS>a", " b</KEYPOINTS>"],
+    )
+    parser = summary_parser.StreamingTagParser()
+    text = scheduler(model, deadline=0.2).generate(
+        ["prompt"], on_chunk=parser.feed, on_retry=parser.reset
+    )
+    # Let the abandoned attempt reach its late chunk
+    time.sleep(0.6)
+    assert text == "<TITLE>t</TITLE><KEYPOINTS>a b</KEYPOINTS>"
+    assert parser.close()["KEYPOINTS"] == "a b"
+    assert parser.close()["TITLE"] == "t"
+
+
+def test_in_flight_requests_are_capped():
+    model = FakeModel(["x", 0.1, "y"])
+    client = scheduler(model, max_in_flight=2)
+    threads = [
+        threading.Thread(target=client.generate, args=(["prompt"],)) for _ in range(6)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert model.calls == 6
+    assert model.peak_in_flight == 2
+
+
+def test_requests_wait_for_the_rate_limit():
+    client = scheduler(FakeModel(["x"]), requests_per_minute=600, max_in_flight=1)
+    start = time.monotonic()
+    for _ in range(3):
+        client.generate(["prompt"])
+    # One request up front, then two at 10/s
+    assert time.monotonic() - start >= 0.18
+    assert client.stats()["queue_wait"]["max"] > 0.05
+
+
+def test_is_retryable():
+    assert gemini_client.is_retryable(TimeoutError())
+    assert gemini_client.is_retryable(QuotaError())
+    assert not gemini_client.is_retryable(BadRequest())
+    assert not gemini_client.is_retryable(ValueError())
@@ -0,0 +1,181 @@
+import json
+import multiprocessing
+
+import pytest
+
+import config
+import jobs
+import lambda_function
+
+
+@pytest.fixture
+def sqlite_backends(tmp_path, monkeypatch):
+    """Job store and queue sharing one SQLite file, as the local worker uses them"""
+    path = str(tmp_path / "jobs.sqlite3")
+    monkeypatch.setattr(config, "JOB_STORE_BACKEND", "sqlite")
+    monkeypatch.setattr(config, "JOB_QUEUE_BACKEND", "sqlite")
+    monkeypatch.setattr(config, "JOB_SQLITE_PATH", path)
+    return jobs.get_job_store(), jobs.get_job_queue()
+
+
+def test_submit_records_a_queued_job_and_queues_its_id(sqlite_backends):
+    store, job_queue = sqlite_backends
+
+    job = jobs.submit("dropbox", {"folder": "/inbox"})
+
+    saved = store.get(job["job_id"])
+    assert saved["status"] == jobs.QUEUED
+    assert saved["payload"] == {"folder": "/inbox"}
+    assert [t["status"] for t in saved["transitions"]] == [jobs.QUEUED]
+    assert job_queue.get() == job["job_id"]
+    assert job_queue.get() is None
+
+
+def test_sqlite_queue_is_fifo_and_shared_between_instances(sqlite_backends):
+    _, job_queue = sqlite_backends
+    for job_id in ("a", "b", "c"):
+        job_queue.put(job_id)
+
+    other = jobs.SQLiteQueue(job_queue.path)
+    assert [other.get(), job_queue.get(), other.get()] == ["a", "b", "c"]
+    assert job_queue.get(timeout=0.1) is None
+
+
+def _take_all(path, results):
+    job_queue = jobs.SQLiteQueue(path)
+    while True:
+        job_id = job_queue.get()
+        if job_id is None:
+            return
+        results.put(job_id)
+
+
+def test_sqlite_queue_hands_each_id_to_one_worker(sqlite_backends):
+    _, job_queue = sqlite_backends
+    for index in range(50):
+        job_queue.put(str(index))
+
+    results = multiprocessing.Queue()
+    workers = [
+        multiprocessing.Process(target=_take_all, args=(job_queue.path, results))
+        for _ in range(4)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    taken = [results.get(timeout=5) for _ in range(50)]
+
+    assert sorted(taken, key=int) == [str(index) for index in range(50)]
+
+
+def test_run_job_records_result_and_transitions(sqlite_backends):
+    store, _ = sqlite_backends
+    job = jobs.submit("echo", {"value": 1})
+
+    finished = jobs.run_job(job["job_id"], {"echo": lambda payload: payload})
+
+    assert finished["status"] == jobs.SUCCEEDED
+    assert finished["result"] == {"value": 1}
+    saved = store.get(job["job_id"])
+    assert saved == json.loads(json.dumps(finished))
+    assert [t["status"] for t in saved["transitions"]] == [
+        jobs.QUEUED,
+        jobs.RUNNING,
+        jobs.SUCCEEDED,
+    ]
+    assert saved["started_at"] <= saved["finished_at"]
+
+
+def test_run_job_records_a_failure(sqlite_backends):
+    store, _ = sqlite_backends
+    job = jobs.submit("boom")
+
+    def boom(payload):
+        raise ValueError("no videos")
+
+    finished = jobs.run_job(job["job_id"], {"boom": boom})
+
+    assert finished["status"] == jobs.FAILED
+    assert "no videos" in store.get(job["job_id"])["error"]
+
+
+def test_run_job_skips_unknown_and_finished_jobs(sqlite_backends):
+    calls = []
+    handlers = {"echo": lambda payload: calls.append(payload)}
+    assert jobs.run_job("missing", handlers) is None
+
+    job = jobs.submit("echo")
+    jobs.run_job(job["job_id"], handlers)
+    # A redelivered id for a finished job doesn't run it again
+    assert jobs.run_job(job["job_id"], handlers)["status"] == jobs.SUCCEEDED
+    assert len(calls) == 1
+
+
+def test_drain_runs_queued_jobs_in_order(sqlite_backends):
+    store, _ = sqlite_backends
+    submitted = [jobs.submit("echo", {"n": n}) for n in range(3)]
+
+    finished = jobs.drain({"echo": lambda payload: payload["n"]}, max_jobs=2)
+    assert [job["result"] for job in finished] == [0, 1]
+    assert store.get(submitted[2]["job_id"])["status"] == jobs.QUEUED
+
+    finished = jobs.drain({"echo": lambda payload: payload["n"]})
+    assert [job["result"] for job in finished] == [2]
+    assert jobs.drain({"echo": lambda payload: payload["n"]}) == []
+
+
+def test_api_submits_a_job_and_reports_its_status(sqlite_backends, monkeypatch):
+    monkeypatch.setattr(config, "JOB_MODE", True)
+    monkeypatch.setitem(
+        lambda_function.JOB_HANDLERS, "dropbox", lambda payload: {"urls": ["u"]}
+    )
+    headers = {"api-key": "test-key"}
+
+    response = lambda_function.handle_request({"headers": headers})
+    assert response["statusCode"] == 202
+    body = json.loads(response["body"])
+    assert body["status"] == jobs.QUEUED
+
+    def status():
+        return lambda_function.handle_request(
+            {"headers": headers, "queryStringParameters": {"job_id": body["job_id"]}}
+        )
+
+    response = status()
+    assert response["statusCode"] == 200
+    assert json.loads(response["body"])["status"] == jobs.QUEUED
+
+    jobs.drain(lambda_function.JOB_HANDLERS)
+
+    job = json.loads(status()["body"])
+    assert job["status"] == jobs.SUCCEEDED
+    assert job["result"] == {"urls": ["u"]}
+
+
+def test_api_returns_404_for_an_unknown_job(sqlite_backends):
+    response = lambda_function.handle_request(
+        {"headers": {"api-key": "test-key"}, "queryStringParameters": {"job_id": "x"}}
+    )
+    assert response["statusCode"] == 404
+
+
+@pytest.fixture
+def sqs_queue(aws, monkeypatch):
+    """An SQSQueue on moto whose unacknowledged messages come back straight away"""
+    queue_url = config.SQS_CLIENT.create_queue(QueueName="jobs")["QueueUrl"]
+    monkeypatch.setattr(config, "JOB_STORE_BACKEND", "memory")
+    return jobs.SQSQueue(queue_url, visibility_seconds=0)
+
+
+def test_sqs_message_is_kept_until_its_job_finishes(sqs_queue):
+    job = jobs.submit("echo", job_queue=sqs_queue)
+
+    # A worker that died before finishing never acked, so it's delivered again
+    assert sqs_queue.get() == job["job_id"]
+    assert sqs_queue.get() == job["job_id"]
+
+    finished = jobs.drain({"echo": lambda payload: "done"}, job_queue=sqs_queue)
+
+    assert [job["result"] for job in finished] == ["done"]
+    assert sqs_queue.get() is None
@@ -0,0 +1,180 @@
+import gzip
+import re
+import time
+import uuid
+
+import pytest
+
+import lambda_logs
+from conftest import BUCKET
+
+PREFIX = "s3://{}/logs/".format(BUCKET)
+
+
+@pytest.fixture
+def make_shipper(s3):
+    """S3LogShippers on throwaway loggers, detached again after the test"""
+    loggers = []
+
+    def make(**kwargs):
+        kwargs.setdefault("console", False)
+        shipper = lambda_logs.S3LogShipper(
+            PREFIX, logger_name="test-" + uuid.uuid4().hex, s3_client=s3, **kwargs
+        )
+        shipper.logger.propagate = False
+        loggers.append(shipper.logger)
+        return shipper
+
+    yield make
+    for logger in loggers:
+        for handler in list(logger.handlers):
+            logger.removeHandler(handler)
+
+
+def segment_keys(s3, prefix="logs/"):
+    response = s3.list_objects_v2(Bucket=BUCKET, Prefix=prefix)
+    return sorted(item["Key"] for item in response.get("Contents", []))
+
+
+def test_flush_writes_a_gzipped_segment_under_a_time_partition(s3, make_shipper):
+    shipper = make_shipper()
+    shipper.logger.info("first record")
+    shipper.logger.info("second record")
+    result = shipper.flush()
+
+    assert result["success"]
+    (key,) = segment_keys(s3)
+    assert result["data"] == "s3://{}/{}".format(BUCKET, key)
+    now = time.gmtime()
+    assert re.fullmatch(
+        r"logs/dt={}/hour=\d\d/\d{{8}}T\d{{6}}Z-000001-[0-9a-f]{{8}}\.log\.gz".format(
+            time.strftime("%Y-%m-%d", now)
+        ),
+        key,
+    )
+    body = s3.get_object(Bucket=BUCKET, Key=key)["Body"].read()
+    text = gzip.decompress(body).decode("utf-8")
+    assert "first record" in text and "second record" in text
+    assert text.index("first record") < text.index("second record")
+
+
+def test_uncompressed_segments_are_plain_text(s3, make_shipper):
+    shipper = make_shipper(compress=False)
+    shipper.logger.info("plain record")
+    shipper.flush()
+    (key,) = segment_keys(s3)
+    assert key.endswith(".log")
+    assert b"plain record" in s3.get_object(Bucket=BUCKET, Key=key)["Body"].read()
+
+
+def test_flush_with_nothing_buffered_writes_nothing(s3, make_shipper):
+    assert make_shipper().flush()["success"]
+    assert segment_keys(s3) == []
+
+
+def test_buffer_rolls_over_to_a_new_segment_at_max_bytes(s3, make_shipper):
+    shipper = make_shipper(max_bytes=500, max_seconds=3600)
+    for index in range(20):
+        shipper.logger.info("record %02d %s", index, "x" * 50)
+    written = shipper.segments_written
+    assert written >= 2
+    shipper.flush()
+
+    keys = segment_keys(s3)
+    assert len(keys) == written + 1
+    # Segment keys sort in write order and every record lands exactly once
+    text = "".join(lambda_logs.read_log_segment(s3, BUCKET, key) for key in keys)
+    assert re.findall(r"record (\d\d)", text) == ["%02d" % i for i in range(20)]
+
+
+def test_buffer_rolls_over_once_its_oldest_record_is_max_seconds_old(s3, make_shipper):
+    shipper = make_shipper(max_bytes=10**6, max_seconds=0.1)
+    shipper.logger.info("old record")
+    assert segment_keys(s3) == []
+    time.sleep(0.15)
+    shipper.logger.info("new record")
+    (key,) = segment_keys(s3)
+    assert "old record" in lambda_logs.read_log_segment(s3, BUCKET, key)
+
+
+def test_records_from_a_failed_put_go_out_with_the_next_segment(s3, make_shipper):
+    class Unavailable:
+        def put_object(self, **kwargs):
+            raise ConnectionError("S3 is down")
+
+    shipper = make_shipper()
+    shipper.s3_client = Unavailable()
+    shipper.logger.info("kept record")
+    assert not shipper.flush()["success"]
+
+    shipper.s3_client = s3
+    shipper.logger.info("later record")
+    assert shipper.flush()["success"]
+    (key,) = segment_keys(s3)
+    text = lambda_logs.read_log_segment(s3, BUCKET, key)
+    assert text.index("kept record") < text.index("later record")
+
+
+def test_compaction_merges_a_partition_in_order_and_deletes_segments(s3, make_shipper):
+    shipper = make_shipper()
+    for index in range(3):
+        shipper.logger.info("segment %s", index)
+        shipper.flush()
+    keys = segment_keys(s3)
+    partition = "s3://{}/{}/".format(BUCKET, keys[0].rsplit("/", 1)[0])
+
+    result = lambda_logs.compact_log_segments(partition, s3_client=s3)
+
+    assert result["success"]
+    assert result["data"]["segments"] == 3
+    (compacted,) = segment_keys(s3)
+    assert result["data"]["path"] == "s3://{}/{}".format(BUCKET, compacted)
+    assert compacted.rsplit("/", 1)[1].startswith("compacted-")
+    assert compacted.endswith(".log.gz")
+    text = lambda_logs.read_log_segment(s3, BUCKET, compacted)
+    assert re.findall(r"segment (\d)", text) == ["0", "1", "2"]
+
+
+def test_compaction_leaves_earlier_compactions_alone(s3, make_shipper):
+    shipper = make_shipper()
+    shipper.logger.info("first batch")
+    shipper.flush()
+    partition = "s3://{}/logs/".format(BUCKET)
+    lambda_logs.compact_log_segments(partition, s3_client=s3)
+
+    shipper.logger.info("second batch")
+    shipper.flush()
+    result = lambda_logs.compact_log_segments(partition, s3_client=s3, delete=False)
+
+    assert result["data"]["segments"] == 1
+    keys = segment_keys(s3)
+    assert len(keys) == 3
+    newest = lambda_logs.read_log_segment(
+        s3, BUCKET, result["data"]["path"].split("/", 3)[3]
+    )
+    assert "second batch" in newest and "first batch" not in newest
+
+
+def test_compacting_an_empty_partition_is_a_no_op(s3):
+    result = lambda_logs.compact_log_segments(
+        "s3://{}/logs/dt=2000-01-01/".format(BUCKET), s3_client=s3
+    )
+    assert result == {"success": True, "data": {"path": None, "segments": 0}}
+
+
+def test_records_logged_while_shipping_wait_for_the_next_segment(s3, make_shipper):
+    shipper = make_shipper()
+
+    class Chatty:
+        def put_object(self, **kwargs):
+            shipper.logger.info("logged during put")
+            return s3.put_object(**kwargs)
+
+    shipper.s3_client = Chatty()
+    shipper.logger.info("first")
+    shipper.flush()
+    shipper.s3_client = s3
+    shipper.flush()
+    first, second = segment_keys(s3)
+    assert "logged during put" not in lambda_logs.read_log_segment(s3, BUCKET, first)
+    assert "logged during put" in lambda_logs.read_log_segment(s3, BUCKET, second)
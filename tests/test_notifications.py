@@ -0,0 +1,206 @@
+import threading
+import urllib.parse
+
+import pytest
+
+import notifications
+
+
+class StubSender:
+    """Records what it sends; blocks while gate is cleared"""
+
+    def __init__(self, status=200):
+        self.status = status
+        self.sent = []
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def send(self, message, title=None):
+        self.gate.wait(5)
+        self.sent.append((message, title))
+        if isinstance(self.status, Exception):
+            raise self.status
+        return self.status
+
+
+class StubPool:
+    """ConnectionPool stand-in answering with scripted statuses or errors"""
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def request(self, method, path, body=None, headers=None):
+        self.requests.append((method, path, urllib.parse.parse_qs(body)))
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response, b"{}"
+
+
+def test_notify_sends_in_the_background():
+    sender = StubSender()
+    dispatcher = notifications.NotificationDispatcher(sender)
+
+    assert dispatcher.notify("one", title="t")
+    assert dispatcher.drain(5)
+
+    assert sender.sent == [("one", "t")]
+    assert dispatcher.stats()["sent"] == 1
+
+
+def test_notify_does_not_wait_for_the_sender():
+    sender = StubSender()
+    sender.gate.clear()
+    dispatcher = notifications.NotificationDispatcher(sender)
+
+    assert dispatcher.notify("one")
+    assert not dispatcher.drain(0.05)
+    sender.gate.set()
+    assert dispatcher.drain(5)
+
+
+def test_disabled_dispatcher_sends_nothing():
+    sender = StubSender()
+    dispatcher = notifications.NotificationDispatcher(sender, enabled=False)
+
+    assert not dispatcher.notify("one")
+    assert dispatcher.drain(0)
+    assert sender.sent == []
+
+
+def test_digest_collapses_messages_into_one():
+    sender = StubSender()
+    dispatcher = notifications.NotificationDispatcher(sender)
+
+    with dispatcher.digest(title="Summaries"):
+        dispatcher.notify("first")
+        with dispatcher.digest():
+            dispatcher.notify("second")
+        # Nothing goes out until the outermost block ends
+        assert dispatcher.drain(0)
+        dispatcher.notify("third")
+    assert dispatcher.drain(5)
+
+    assert sender.sent == [("3 updates:\n- first\n- second\n- third", "Summaries")]
+    assert dispatcher.stats()["digests"] == 1
+
+
+def test_digest_of_one_message_sends_it_unchanged():
+    sender = StubSender()
+    dispatcher = notifications.NotificationDispatcher(sender)
+
+    with dispatcher.digest(title="Summaries"):
+        dispatcher.notify("only")
+    with dispatcher.digest():
+        pass
+    assert dispatcher.drain(5)
+
+    assert sender.sent == [("only", "Summaries")]
+    assert dispatcher.stats()["digests"] == 0
+
+
+def test_digest_message_fits_the_pushover_limit():
+    messages = ["Notion video summary: {}".format("x" * 60)] * 40
+
+    message = notifications.digest_message(messages)
+
+    assert len(message) <= notifications.MESSAGE_LIMIT
+    lines = message.splitlines()
+    assert lines[0] == "40 updates:"
+    listed = len(lines) - 2
+    assert 0 < listed < 40
+    assert lines[-1] == "+{} more".format(40 - listed)
+
+
+def test_digest_message_lists_everything_that_fits():
+    assert notifications.digest_message(["a", "b"], limit=100) == (
+        "2 updates:\n- a\n- b"
+    )
+    assert notifications.digest_message(["a" * 50, "b"], limit=30) == (
+        "2 updates:\n+2 more"
+    )
+
+
+def test_full_queue_drops_messages():
+    sender = StubSender()
+    sender.gate.clear()
+    dispatcher = notifications.NotificationDispatcher(sender, queue_size=1)
+
+    assert dispatcher.notify("one")
+    # The worker may already hold "one", so fill the queue behind it
+    results = [dispatcher.notify(str(n)) for n in range(3)]
+    sender.gate.set()
+    assert dispatcher.drain(5)
+
+    assert results[-1] is False
+    stats = dispatcher.stats()
+    assert stats["dropped"] == results.count(False)
+    assert stats["sent"] == len(sender.sent) == 4 - stats["dropped"]
+
+
+@pytest.mark.parametrize("status", [500, ConnectionResetError("reset")])
+def test_failed_sends_are_counted(status):
+    sender = StubSender(status=status)
+    dispatcher = notifications.NotificationDispatcher(sender)
+
+    dispatcher.notify("one")
+    assert dispatcher.drain(5)
+
+    assert dispatcher.stats()["failed"] == 1
+    assert dispatcher.stats()["sent"] == 0
+
+
+def make_sender(responses, max_retries=3):
+    pool = StubPool(responses)
+    sender = notifications.PushoverSender(
+        "app",
+        "user",
+        url="https://api.pushover.net/1/messages.json",
+        pool=pool,
+        max_retries=max_retries,
+        backoff_base=0,
+        backoff_max=0,
+    )
+    return sender, pool
+
+
+def test_pushover_sender_posts_the_message():
+    sender, pool = make_sender([200])
+
+    assert sender.send("hello", title="t") == 200
+
+    method, path, fields = pool.requests[0]
+    assert (method, path) == ("POST", "/1/messages.json")
+    assert fields == {
+        "token": ["app"],
+        "user": ["user"],
+        "message": ["hello"],
+        "title": ["t"],
+    }
+
+
+def test_pushover_sender_retries_rate_limits_and_connection_errors():
+    sender, pool = make_sender([429, ConnectionResetError("reset"), 503, 200])
+
+    assert sender.send("hello") == 200
+    assert len(pool.requests) == 4
+    assert sender.retries == 3
+
+
+def test_pushover_sender_does_not_retry_client_errors():
+    sender, pool = make_sender([400, 200])
+
+    assert sender.send("hello") == 400
+    assert len(pool.requests) == 1
+
+
+def test_pushover_sender_gives_up_after_max_retries():
+    sender, pool = make_sender([500, 500, 500], max_retries=2)
+    assert sender.send("hello") == 500
+    assert len(pool.requests) == 3
+
+    sender, pool = make_sender([OSError("down")] * 3, max_retries=2)
+    with pytest.raises(OSError):
+        sender.send("hello")
+    assert len(pool.requests) == 3
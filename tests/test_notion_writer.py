@@ -0,0 +1,118 @@
+from types import SimpleNamespace
+
+import config
+import notion_writer
+
+SUMMARY = {
+    "TITLE": "Title",
+    "KEYPOINTS": "- one\n- two",
+    "SUMMARY": "Text",
+    "TAGS": ["ai", "x" * 150],
+}
+
+
+def text_of(items):
+    return "".join(item["text"]["content"] for item in items)
+
+
+def test_short_text_is_one_item():
+    assert notion_writer.chunk_rich_text("hello") == [{"text": {"content": "hello"}}]
+    assert notion_writer.chunk_rich_text("") == []
+
+
+def test_long_text_splits_under_the_limit_at_line_breaks_then_spaces():
+    lines = "\n".join("line {} ".format(n) * 20 for n in range(100))
+
+    items = notion_writer.chunk_rich_text(lines)
+
+    assert text_of(items) == lines
+    assert all(len(item["text"]["content"]) <= 2000 for item in items)
+    assert all(item["text"]["content"].endswith("\n") for item in items[:-1])
+
+    words = "word " * 1000
+    items = notion_writer.chunk_rich_text(words)
+    assert text_of(items) == words
+    assert all(item["text"]["content"].endswith(" ") for item in items[:-1])
+
+
+def test_text_without_separators_is_cut_at_the_limit():
+    items = notion_writer.chunk_rich_text("x" * 4500)
+
+    assert [len(item["text"]["content"]) for item in items] == [2000, 2000, 500]
+
+
+def test_text_is_truncated_at_the_item_limit():
+    items = notion_writer.chunk_rich_text("x" * 2000 * 150)
+
+    assert len(items) == notion_writer.RICH_TEXT_MAX_ITEMS
+    assert len(text_of(items)) == 2000 * 100
+
+
+def test_page_properties_maps_the_summary_fields():
+    properties = notion_writer.page_properties(SUMMARY)
+
+    assert properties["Name"]["title"] == [{"text": {"content": "Title"}}]
+    assert text_of(properties["Key points"]["rich_text"]) == "- one\n- two"
+    assert text_of(properties["Summary"]["rich_text"]) == "Text"
+    assert properties["Tags"]["multi_select"] == [{"name": "ai"}, {"name": "x" * 100}]
+
+
+def test_page_properties_keeps_the_title_to_one_item():
+    properties = notion_writer.page_properties(dict(SUMMARY, TITLE="t " * 3000))
+    assert len(properties["Name"]["title"]) == 1
+
+    properties = notion_writer.page_properties(dict(SUMMARY, TITLE=""))
+    assert properties["Name"]["title"] == [{"text": {"content": ""}}]
+
+
+def test_page_properties_adds_analyses_the_database_has_a_column_for(monkeypatch):
+    monkeypatch.setitem(
+        config.VIDEO_PROMPTS,
+        "risks",
+        {"prompt": "", "parser": "tags", "fields": ["RISKS"], "property": "Risks"},
+    )
+    summary = dict(
+        SUMMARY,
+        ANALYSES={
+            "action_items": {"ACTION_ITEMS": "- ship it", "QUESTIONS": ""},
+            "risks": {"RISKS": ["cost", "time"]},
+            "unknown": {"X": "y"},
+        },
+    )
+
+    properties = notion_writer.page_properties(summary, columns={"Action items"})
+    assert text_of(properties["Action items"]["rich_text"]) == (
+        "ACTION_ITEMS:\n- ship it"
+    )
+    assert "Risks" not in properties
+
+    # Without the schema every configured analysis is written
+    properties = notion_writer.page_properties(summary)
+    assert text_of(properties["Risks"]["rich_text"]) == "RISKS:\n- cost\n- time"
+    assert "unknown" not in properties
+
+
+def test_page_batch_writes_in_queue_order_and_returns_errors():
+    created = []
+
+    def create(parent, properties):
+        title = properties["Name"]["title"][0]["text"]["content"]
+        if title == "bad":
+            raise ValueError("validation_error")
+        created.append(title)
+        return {"url": "https://notion.so/" + title}
+
+    client = SimpleNamespace(pages=SimpleNamespace(create=create))
+    writer = notion_writer.NotionWriter(client, "db", requests_per_second=1000)
+    batch = writer.batch()
+    for key, title in enumerate(["a", "bad", "c"]):
+        batch.enqueue(dict(SUMMARY, TITLE=title), key=key)
+
+    results = batch.flush()
+
+    assert [key for key, _, _ in results] == [0, 1, 2]
+    assert results[0][2] == {"url": "https://notion.so/a"}
+    assert isinstance(results[1][2], ValueError)
+    assert created == ["a", "c"]
+    assert batch.flush() == []
+    assert writer.stats()["pages_written"] == 2
@@ -0,0 +1,43 @@
+import pytest
+
+import config
+import encoder
+import preprocess
+from benchmarks.fakes import synthetic_clip
+
+
+@pytest.fixture(scope="module")
+def clip(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("clips") / "clip.mp4")
+    synthetic_clip(path, 3, 360)
+    return path, encoder.probe_media(path)
+
+
+def test_no_profile_by_default(clip):
+    path, info = clip
+    assert preprocess.get_profile() is None
+    assert preprocess.prepare(path, info, 1024) is None
+
+
+@pytest.mark.parametrize(
+    "model_name, mime_types",
+    [
+        ("gemini-1.5-flash-002", {"image/jpeg", "audio/mp4"}),
+        ("gemini-pro-vision", {"image/jpeg"}),
+    ],
+)
+def test_scenes_profile_adds_audio_only_for_models_that_take_it(
+    clip, tmp_path, monkeypatch, model_name, mime_types
+):
+    path, info = clip
+    monkeypatch.setattr(config, "GEMINI_MODEL_NAME", model_name)
+
+    prepared = preprocess.prepare(
+        path,
+        info,
+        1024,
+        preprocess.get_profile("scenes"),
+        output_base=str(tmp_path / "clip"),
+    )
+
+    assert {mime_type for _, mime_type in prepared["parts"]} == mime_types
@@ -0,0 +1,36 @@
+import threading
+import time
+
+import rate_limit
+
+
+def test_token_bucket_allows_a_burst_then_paces_at_the_rate():
+    bucket = rate_limit.TokenBucket(rate=20, capacity=3)
+    start = time.monotonic()
+    for _ in range(3):
+        bucket.acquire()
+    assert time.monotonic() - start < 0.05
+    for _ in range(4):
+        bucket.acquire()
+    # Four more tokens at 20/s take ~0.2s
+    assert 0.15 < time.monotonic() - start < 0.5
+
+
+def test_token_bucket_is_shared_between_threads():
+    bucket = rate_limit.TokenBucket(rate=50, capacity=1)
+    start = time.monotonic()
+    threads = [threading.Thread(target=bucket.acquire) for _ in range(11)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # One token up front, then ten at 50/s
+    assert 0.15 < time.monotonic() - start < 0.6
+
+
+def test_backoff_delay_is_jittered_under_an_exponential_cap():
+    for attempt in range(8):
+        cap = min(5.0, 0.5 * 2**attempt)
+        delays = [rate_limit.backoff_delay(attempt, 0.5, 5.0) for _ in range(200)]
+        assert all(0 <= delay <= cap for delay in delays)
+        assert max(delays) > cap / 2
@@ -0,0 +1,161 @@
+import json
+import os
+import urllib.parse
+from types import SimpleNamespace
+
+import pytest
+
+import config
+import dedupe
+import gemini_client
+import lambda_function
+import notifications
+from benchmarks.fakes import FakeGenerativeModel, FileGCSClient
+from conftest import BUCKET, SECRETS
+
+GCS_BUCKET = "notion-gpt-videos"
+KEY = "uploads/team sync.mp4"
+BODY = b"not really an mp4, but small enough to pass straight through"
+
+
+class StubNotionWriter:
+    def __init__(self):
+        self.pages = []
+
+    def create_page(self, summary_content):
+        self.pages.append(summary_content)
+        return {"url": "https://notion.so/page-{}".format(len(self.pages))}
+
+
+class StubSender:
+    def __init__(self):
+        self.messages = []
+
+    def send(self, message, title=None):
+        self.messages.append(message)
+        return 200
+
+
+@pytest.fixture
+def services(s3, tmp_path, monkeypatch):
+    """
+    lambda_function wired to moto S3 (source objects, leases and summary
+    cache) plus local fakes for GCS, Gemini, Notion and Pushover.
+    """
+    gcs = FileGCSClient(str(tmp_path / "gcs"))
+    model = FakeGenerativeModel(first_chunk_latency=0, chunk_latency=0)
+    notion = StubNotionWriter()
+    sender = StubSender()
+    secrets = dict(SECRETS, GCS_BUCKET_NAME=GCS_BUCKET)
+    monkeypatch.setitem(config.CLIENT_FACTORIES, "SECRETS", lambda: dict(secrets))
+    monkeypatch.setitem(config.CLIENT_FACTORIES, "GCS_CLIENT", lambda: gcs)
+    monkeypatch.setitem(
+        config.CLIENT_FACTORIES,
+        "GEMINI_SCHEDULER",
+        lambda: gemini_client.GeminiScheduler(model),
+    )
+    monkeypatch.setitem(config.CLIENT_FACTORIES, "NOTION_WRITER", lambda: notion)
+    monkeypatch.setitem(
+        config.CLIENT_FACTORIES,
+        "NOTIFIER",
+        lambda: notifications.NotificationDispatcher(sender),
+    )
+    config.reset_clients()
+    monkeypatch.setattr(config, "DEDUPE_ENABLED", True)
+    monkeypatch.setattr(config, "DEDUPE_BACKEND", "s3")
+    monkeypatch.setattr(config, "SUMMARY_CACHE_BACKENDS", ["memory", "s3"])
+    monkeypatch.setattr(config, "FANOUT_PROMPTS", [])
+    # The fake model takes any object as a part; vertexai needn't be installed
+    monkeypatch.setattr(
+        lambda_function, "media_parts", lambda media: [blob for blob, _ in media]
+    )
+
+    return SimpleNamespace(s3=s3, gcs=gcs, model=model, notion=notion, sender=sender)
+
+
+def upload(s3, key=KEY, body=BODY):
+    return s3.put_object(Bucket=BUCKET, Key=key, Body=body)["ETag"].strip('"')
+
+
+def object_created(key, etag, size):
+    """An S3 ObjectCreated:Put notification as Lambda receives it"""
+    return {
+        "Records": [
+            {
+                "eventSource": "aws:s3",
+                "eventName": "ObjectCreated:Put",
+                "s3": {
+                    "bucket": {"name": BUCKET},
+                    "object": {
+                        "key": urllib.parse.quote_plus(key, safe="/"),
+                        "size": size,
+                        "eTag": etag,
+                    },
+                },
+            }
+        ]
+    }
+
+
+def test_object_is_streamed_to_gcs_and_summarized_into_notion(services):
+    etag = upload(services.s3)
+
+    response = lambda_function.handle_request(object_created(KEY, etag, len(BODY)))
+
+    assert response["statusCode"] == 200
+    body = json.loads(response["body"])
+    assert body["urls"] == ["https://notion.so/page-1"]
+    assert body["failed"] == [] and body["skipped"] == []
+    # Under the GCS limit, so the bytes are copied from S3 untouched
+    blob_path = os.path.join(
+        services.gcs.root, GCS_BUCKET, "src-s3-{}.mp4".format(etag)
+    )
+    with open(blob_path, "rb") as f:
+        assert f.read() == BODY
+    assert body["gcs"]["uploaded_bytes"] == len(BODY)
+    assert services.model.calls == 1
+    assert [page["TITLE"] for page in services.notion.pages] == ["Fake"]
+    assert config.drain_notifications(timeout=5)
+    assert services.sender.messages == ["Notion video summary: Fake"]
+    lease = dedupe.get_leases().result("s3/{}/{}@{}".format(BUCKET, KEY, etag))
+    assert lease["result"] == "https://notion.so/page-1"
+
+
+def test_redelivered_event_is_skipped(services):
+    etag = upload(services.s3)
+    event = object_created(KEY, etag, len(BODY))
+    lambda_function.handle_request(event)
+
+    response = lambda_function.handle_request(event)
+
+    body = json.loads(response["body"])
+    assert body["urls"] == []
+    assert body["skipped"] == ["s3://{}/{}".format(BUCKET, KEY)]
+    assert services.model.calls == 1
+    assert len(services.notion.pages) == 1
+
+
+def test_failed_object_raises_so_lambda_retries(services):
+    # The event arrives but the object can't be read yet
+    etag = "0123456789abcdef0123456789abcdef"
+    event = object_created(KEY, etag, len(BODY))
+
+    with pytest.raises(RuntimeError, match="team sync.mp4"):
+        lambda_function.handle_request(event)
+    assert services.notion.pages == []
+
+    # The lease was released, so Lambda's retry gets to process it
+    services.s3.put_object(Bucket=BUCKET, Key=KEY, Body=BODY)
+    response = lambda_function.handle_request(event)
+    assert json.loads(response["body"])["urls"] == ["https://notion.so/page-1"]
+
+
+def test_events_for_other_files_are_ignored(services):
+    etag = upload(services.s3, key="uploads/notes.txt", body=b"text")
+
+    response = lambda_function.handle_request(
+        object_created("uploads/notes.txt", etag, 4)
+    )
+
+    assert json.loads(response["body"])["urls"] == []
+    assert services.model.calls == 0
@@ -0,0 +1,92 @@
+import os
+import time
+
+import config
+import summary_cache
+from conftest import BUCKET
+
+
+def keys(s3):
+    return sorted(
+        item["Key"] for item in s3.list_objects_v2(Bucket=BUCKET).get("Contents", [])
+    )
+
+
+def test_s3_backend_evicts_on_the_first_put_and_then_every_few(s3, monkeypatch):
+    backend = summary_cache.S3Backend(max_entries=2, evict_every=3)
+    lists = []
+    evict = backend._evict
+    monkeypatch.setattr(backend, "_evict", lambda: lists.append(1) or evict())
+
+    for index in range(5):
+        backend.put(str(index), {"index": index})
+
+    # Evicted after puts 1 and 4, so only the fifth put is over the limit
+    assert len(lists) == 2
+    assert len(keys(s3)) == 3
+    backend.put("5", {"index": 5})
+    backend.put("6", {"index": 6})
+    assert len(lists) == 3
+    assert keys(s3) == ["summary-cache/5.json", "summary-cache/6.json"]
+
+
+def test_directory_backend_tolerates_files_removed_meanwhile(tmp_path, monkeypatch):
+    backend = summary_cache.LocalDirectoryBackend(str(tmp_path), max_entries=1)
+    backend.put("a", {"index": 0})
+    listdir = os.listdir
+
+    def listdir_then_race(path):
+        names = listdir(path)
+        # Another process evicts every file between the listing and the stat
+        for name in names:
+            os.remove(os.path.join(path, name))
+        return names
+
+    monkeypatch.setattr(os, "listdir", listdir_then_race)
+    backend.put("b", {"index": 1})
+    monkeypatch.setattr(os, "listdir", listdir)
+
+    assert os.listdir(str(tmp_path)) == []
+    backend.delete("b")
+    assert backend.get("b") is None
+
+
+def test_hit_in_a_later_backend_is_promoted_to_the_earlier_ones(tmp_path):
+    memory = summary_cache.MemoryBackend()
+    directory = summary_cache.LocalDirectoryBackend(str(tmp_path))
+    summary_cache.SummaryCache([directory]).put("hash", {"TITLE": "T"}, "blob", 4.0)
+    cache = summary_cache.SummaryCache([memory, directory])
+    key = cache.key("hash")
+    assert memory.get(key) is None
+
+    assert cache.get("hash")["summary"] == {"TITLE": "T"}
+
+    assert memory.get(key)["gcs_object"] == "blob"
+    assert cache.get("missing") is None
+    assert cache.stats() == {"hits": 1, "misses": 1, "saved_seconds": 4.0}
+
+
+def test_expired_entries_are_deleted_and_missed(tmp_path, monkeypatch):
+    memory = summary_cache.MemoryBackend()
+    directory = summary_cache.LocalDirectoryBackend(str(tmp_path))
+    cache = summary_cache.SummaryCache([memory, directory], ttl=60)
+    cache.put("hash", {"TITLE": "T"}, "blob", 1.0)
+    key = cache.key("hash")
+    now = time.time()
+
+    monkeypatch.setattr(time, "time", lambda: now + 59)
+    assert cache.get("hash") is not None
+
+    monkeypatch.setattr(time, "time", lambda: now + 61)
+    assert cache.get("hash") is None
+    assert memory.get(key) is None
+    assert directory.get(key) is None
+
+
+def test_edited_prompts_miss_the_old_entries(monkeypatch):
+    cache = summary_cache.SummaryCache([summary_cache.MemoryBackend()])
+    cache.put("hash", {"TITLE": "T"}, "blob", 1.0)
+
+    monkeypatch.setattr(config, "VIDEO_SUMMARY_PROMPT", "A new prompt")
+
+    assert cache.get("hash") is None
@@ -0,0 +1,92 @@
+import pytest
+
+import summary_parser
+
+RESPONSE = """<TITLE> Robots, Everywhere </TITLE>
+<KEYPOINTS>
+- Cheap actuators
+- Better models
+</KEYPOINTS>
+<SUMMARY> Hardware is catching up with software. </SUMMARY>
+<TAGS> robotics, ai,  </TAGS>"""
+
+EXPECTED = {
+    "TITLE": "Robots, Everywhere",
+    "KEYPOINTS": "- Cheap actuators\n- Better models",
+    "SUMMARY": "Hardware is catching up with software.",
+    "TAGS": ["robotics", "ai"],
+}
+
+
+def feed_in_chunks(text, size, on_field=None):
+    parser = summary_parser.StreamingTagParser(on_field=on_field)
+    for start in range(0, len(text), size):
+        parser.feed(text[start : start + size])
+    return parser.close()
+
+
+def test_parse_reads_every_field():
+    assert summary_parser.parse(RESPONSE) == EXPECTED
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 13])
+def test_chunk_boundaries_inside_tags_do_not_matter(size):
+    assert feed_in_chunks(RESPONSE, size) == EXPECTED
+
+
+def test_fields_are_emitted_as_their_closing_tag_arrives():
+    fields = []
+    parser = summary_parser.StreamingTagParser(
+        on_field=lambda name, value: fields.append(name)
+    )
+    parser.feed("<TITLE> A </TITLE><KEYPOI")
+    assert fields == ["TITLE"]
+    parser.feed("NTS> b </KEYPOINTS>")
+    assert fields == ["TITLE", "KEYPOINTS"]
+
+
+def test_unclosed_field_ends_at_the_next_opening_tag():
+    result = summary_parser.parse("<TITLE> A title <SUMMARY> Text </SUMMARY>")
+
+    assert result["TITLE"] == "A title"
+    assert result["SUMMARY"] == "Text"
+
+
+def test_unclosed_field_at_the_end_is_flushed_by_close():
+    result = feed_in_chunks("<TITLE> T </TITLE><TAGS> a, b", 4)
+
+    assert result["TITLE"] == "T"
+    assert result["TAGS"] == ["a", "b"]
+    assert result["SUMMARY"] == ""
+
+
+def test_stray_angle_brackets_and_unknown_tags_stay_in_the_text():
+    result = feed_in_chunks("<SUMMARY> 3 < 4 and <b>bold</b> <<SUMMARY </SUMMARY>", 5)
+
+    assert result["SUMMARY"] == "3 < 4 and <b>bold</b> <<SUMMARY"
+
+
+def test_first_occurrence_of_a_field_wins():
+    result = summary_parser.parse("<TITLE> First </TITLE><TITLE> Second </TITLE>")
+
+    assert result["TITLE"] == "First"
+
+
+def test_reset_forgets_a_partial_response():
+    parser = summary_parser.StreamingTagParser()
+    parser.feed("<TITLE> Abandoned")
+    parser.reset()
+    parser.feed("<TITLE> Retried </TITLE>")
+
+    assert parser.close()["TITLE"] == "Retried"
+
+
+def test_json_parser_tolerates_fences_and_falls_back_to_text():
+    parser = summary_parser.JsonResponseParser()
+    parser.feed('```json\n{"NOTE_PURPOSE": ')
+    parser.feed('"ideas"}\n```')
+    assert parser.close() == {"NOTE_PURPOSE": "ideas"}
+
+    parser.reset()
+    parser.feed("not json")
+    assert parser.close() == {"TEXT": "not json"}